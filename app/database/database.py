@@ -1,38 +1,211 @@
 '''
 defines engine, session, Base
 '''
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
-
-# Lngchain imports
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
-from langchain_qdrant import QdrantVectorStore
-from langchain_openai import OpenAIEmbeddings
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
 
 # Qdrant imports
-from qdrant_client import QdrantClient, AsyncQdrantClient
-from qdrant_client.http.models import Distance, VectorParams  
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.models import PointIdsList, PointStruct
 
+import asyncio
+import hashlib
 import os
 import dotenv
 import logging
-from uuid import uuid4
+import time
+from dataclasses import dataclass
+import uuid
+
+from app.v1.metrics import Counter, Gauge, Histogram
+from app.v1.telemetry import instrument_engine, timed
+from app.v1.services.ingestion import IncrementalSplitter
+from app.v1.services.vector_profile import VectorProfile, vector_profile
 
 
 logger = logging.getLogger("__database.py__")
-logging.basicConfig(level=logging.INFO)
+
+dotenv.load_dotenv()
 
 #DATABASE_URL = "sqlite:///./niqatech.db"
 # engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 
+DEFAULT_DATABASE_URL = "postgresql://postgres:Rahimmazouz707@db:5432/niqatechdb"
+
+POOL_CHECKOUT_WAIT = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection")
+POOL_CHECKED_OUT   = Gauge("db_pool_checked_out", "Connections currently checked out of the pool", ("engine",))  # sync | async
+POOL_OVERFLOW      = Gauge("db_pool_overflow", "Connections opened beyond pool_size", ("engine",))
+POOL_CONNECTS      = Counter("db_pool_connections_created_total", "New DBAPI connections opened by the pool")
+POOL_INVALIDATED   = Counter("db_pool_connections_invalidated_total", "Connections discarded as stale or broken")
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+
+@dataclass
+class DatabaseSettings:
+    """ Engine and pool configuration, read from the environment by `from_env`."""
+    url: str = DEFAULT_DATABASE_URL
+    pool_size: int = 10
+    max_overflow: int = 20
+    pool_timeout: float = 30.0          # seconds to wait for a connection before failing
+    pool_recycle: int = 1800            # seconds before a connection is replaced
+    pool_pre_ping: bool = True          # detect connections killed by a Postgres restart
+    statement_timeout_ms: int = 0       # 0 disables the timeout
+    pgbouncer: bool = False             # PgBouncer (transaction pooling) compatible mode
+    echo: bool = False
+
+    @classmethod
+    def from_env(cls) -> "DatabaseSettings":
+        return cls(
+            url=os.getenv("DATABASE_URL", DEFAULT_DATABASE_URL),
+            pool_size=int(os.getenv("DB_POOL_SIZE", cls.pool_size)),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", cls.max_overflow)),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", cls.pool_timeout)),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", cls.pool_recycle)),
+            pool_pre_ping=_env_bool("DB_POOL_PRE_PING", cls.pool_pre_ping),
+            statement_timeout_ms=int(os.getenv("DB_STATEMENT_TIMEOUT_MS", cls.statement_timeout_ms)),
+            pgbouncer=_env_bool("DB_PGBOUNCER", cls.pgbouncer),
+            echo=_env_bool("DB_ECHO", cls.echo),
+        )
+
+
+class TimedQueuePool(QueuePool):
+    """ QueuePool that records how long each checkout waited for a connection."""
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+
+class TimedAsyncQueuePool(TimedQueuePool, AsyncAdaptedQueuePool):
+    """ Same as TimedQueuePool, for the asyncio engine."""
+
+
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+
+def _instrument_pool(engine, kind: str) -> None:
+    """ Count the connections of `engine` (sync, or the sync_engine of an async one) under engine=`kind`."""
+    checked_out, overflow = POOL_CHECKED_OUT.labels(kind), POOL_OVERFLOW.labels(kind)
+
+    def on_checkout(*args):
+        pool = engine.pool
+        if isinstance(pool, QueuePool):
+            checked_out.set(pool.checkedout())
+            overflow.set(max(pool.overflow(), 0))
+
+    def on_checkin(*args):
+        # Fired before the pool takes the connection back: it is still counted
+        pool = engine.pool
+        if isinstance(pool, QueuePool):
+            checked_out.set(pool.checkedout() - 1)
+            # It is closed instead of kept when the pool is already full
+            overflow.set(max(pool.overflow() - (pool.checkedin() >= pool.size()), 0))
+
+    event.listen(engine, "connect", lambda *args: POOL_CONNECTS.inc())
+    event.listen(engine, "invalidate", lambda *args: POOL_INVALIDATED.inc())
+    event.listen(engine, "checkout", on_checkout)
+    event.listen(engine, "checkin", on_checkin)
+
+
+def create_db_engine(settings: DatabaseSettings = None, asynchronous: bool = False):
+    """
+    Build the SQLAlchemy engine from `settings` (defaults to the environment).
+    With asynchronous=True an AsyncEngine is returned and the URL is switched to
+    the asyncio driver of the same database (asyncpg, aiosqlite).
+
+    - PostgreSQL: sized QueuePool with pre-ping and recycle, statement timeout
+      passed as a startup option.
+    - PgBouncer mode: no client-side pool (PgBouncer does the pooling) and the
+      statement timeout is set per transaction, since PgBouncer rejects startup
+      options. asyncpg's prepared statement caches are disabled.
+    - SQLite: used by tests and local runs; file databases get the same
+      QueuePool settings, in-memory ones keep SQLAlchemy's default pool.
+    """
+    settings = settings or DatabaseSettings.from_env()
+    url = make_url(settings.url)
+    backend = url.get_backend_name()
+    if asynchronous:
+        url = url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+    is_postgres = backend == "postgresql"
+    kwargs = {"echo": settings.echo, "pool_pre_ping": settings.pool_pre_ping}
+    connect_args = {}
+
+    if backend == "sqlite":
+        connect_args["check_same_thread"] = False
+    if backend == "sqlite" and url.database in (None, "", ":memory:"):
+        pass  # in-memory databases live in a single connection, keep SQLAlchemy's pool
+    elif settings.pgbouncer:
+        kwargs["poolclass"] = NullPool
+        if asynchronous and is_postgres:
+            connect_args["statement_cache_size"] = 0
+            url = url.update_query_dict({"prepared_statement_cache_size": "0"})
+    else:
+        kwargs.update(
+            poolclass=TimedAsyncQueuePool if asynchronous else TimedQueuePool,
+            pool_size=settings.pool_size,
+            max_overflow=settings.max_overflow,
+            pool_timeout=settings.pool_timeout,
+            pool_recycle=settings.pool_recycle,
+        )
+        if settings.statement_timeout_ms and is_postgres:
+            if asynchronous:
+                connect_args["server_settings"] = {"statement_timeout": str(settings.statement_timeout_ms)}
+            else:
+                connect_args["options"] = f"-c statement_timeout={settings.statement_timeout_ms}"
+
+    if asynchronous:
+        engine = create_async_engine(url, connect_args=connect_args, **kwargs)
+        sync_engine = engine.sync_engine
+    else:
+        engine = sync_engine = create_engine(url, connect_args=connect_args, **kwargs)
+
+    if settings.pgbouncer and settings.statement_timeout_ms and is_postgres:
+        @event.listens_for(sync_engine, "begin")
+        def set_statement_timeout(conn):
+            conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(settings.statement_timeout_ms)}")
+
+    _instrument_pool(sync_engine, "async" if asynchronous else "sync")
+    instrument_engine(sync_engine)
+    logger.info("Database engine created for %s (%s)", url.render_as_string(hide_password=True), engine.pool.status())
+    return engine
+
+
+def pool_status(engine) -> dict:
+    """ Current pool usage, for the status endpoint."""
+    pool = engine.pool
+    status = {"pool": type(pool).__name__, "status": pool.status()}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+        )
+    return status
+
 
 # PostgreSQL
 # engine = create_engine("postgresql://postgres:Rahimmazouz707@db:5432/niqatechdb")
-engine = create_engine("postgresql://postgres:Rahimmazouz707@db:5432/niqatechdb")
+
+# Synchronous engine, kept for scripts such as app/create_db.py
+engine = create_db_engine()
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Asynchronous engine used by the API routers
+async_engine = create_db_engine(asynchronous=True)
+
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 
 Base = declarative_base()
 
@@ -43,71 +216,238 @@ def get_db():
         finally:
             db.close()
 
-dotenv.load_dotenv()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+INGEST_EMBED_BATCH_SIZE      = int(os.getenv("INGEST_EMBED_BATCH_SIZE", 64))   # chunks per embedding call and upsert
+INGEST_EMBED_CONCURRENCY     = int(os.getenv("INGEST_EMBED_CONCURRENCY", 4))   # batches in flight per document
+INGEST_UPSERT_RETRIES        = int(os.getenv("INGEST_UPSERT_RETRIES", 3))
+INGEST_RETRY_BACKOFF_SECONDS = float(os.getenv("INGEST_RETRY_BACKOFF_SECONDS", 0.5))
+RAG_COLLECTION = "rag_collection"
+
+CHUNK_ID_NAMESPACE = uuid.UUID("5b0c1f6e-8a7d-4c53-9a51-2f0e1d6b7c84")
+
+INDEXED_CHUNKS = Counter("ingestion_chunks_total", "Chunks seen by the indexer, by outcome", ("outcome",))
+UPSERT_RETRIES = Counter("ingestion_upsert_retries_total", "Qdrant upserts retried after a failure")
+
+
+def chunk_id(source: str, text: str) -> str:
+    """ Deterministic point id: the same chunk of the same source always gets the same id."""
+    content_hash = hashlib.sha256(text.encode()).hexdigest()
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{source}\x00{content_hash}"))
+
+
+@dataclass
+class IndexReport:
+    added: int = 0     # embedded and upserted
+    skipped: int = 0   # already indexed for this source, or repeated within the document
+    deleted: int = 0   # indexed before, gone from the new version
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
 class DocumentIndexer:
-    def __init__(self,qdrant_db_path):
-        self.db_path = qdrant_db_path
-        self.embedding_function = OpenAIEmbeddings(model="text-embedding-3-large", api_key=OPENAI_API_KEY)
-        self.vector_store = None
-        self.client = AsyncQdrantClient(self.db_path)
+    """
+    Indexes documents into Qdrant with clients shared by the whole process (see ClientRegistry).
+    Chunks are embedded and upserted in batches of `batch_size`, at most
+    `concurrency` batches at a time; the collection is created on first use.
+    With a `manifest` (ChunkManifest), a re-indexed source only embeds its new
+    chunks and loses the ones that disappeared. `profile` sets the storage of
+    the collection it creates.
+    """
+    def __init__(self, client: AsyncQdrantClient, embedding_function, collection_name: str = RAG_COLLECTION,
+                 batch_size: int = INGEST_EMBED_BATCH_SIZE, concurrency: int = INGEST_EMBED_CONCURRENCY,
+                 manifest=None, profile: VectorProfile = vector_profile):
+        self.client = client
+        self.embedding_function = embedding_function
+        self.collection_name = collection_name
+        self.profile = profile
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.manifest = manifest
+        self._known_collections = set()  # collections known to exist, not asked for again
+        self._lock, self._lock_loop = None, None
 
+    def _collection_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if loop is not self._lock_loop:
+            self._lock, self._lock_loop = asyncio.Lock(), loop
+        return self._lock
 
-    async def index_in_qdrantdb(self, content, file_name, doc_type, chunk_size=500):
-        try:
-            # create document object
-            document = Document(
-                page_content=content,
-                metadata={
-                    "source": file_name,
-                    "type": doc_type
-                    }
-                )
-            logger.info(f"Indexing document: {file_name} of type {doc_type}")
-            
-            # split document into chunks
-            text_splitter = RecursiveCharacterTextSplitter(
-                separators=['\\n\\n', '\\n', ','],
-                chunk_size=chunk_size,
-                chunk_overlap=200,)
-
-            docs = text_splitter.split_documents([document])
-            logger.info(f"Document split into {len(docs)} chunks.")
-
-            # Generate uids for each chunk
-            uuids = [f"{str(uuid4())}" for _ in range(len(docs))]
-            collection_name = "rag_collection"
-
-            collections = await self.client.get_collections()
-            logger.info(f"The list of collections: {collections}")
-
-            if collection_name in [col.name for col in collections.collections]:
-                logger.info(f"Collection {collection_name} already exists.")
-            else:
-                logger.info(f"Creating collection {collection_name}.")
-                await self.client.create_collection(
-                    collection_name=collection_name,
-                    vectors_config=VectorParams(size=3072, distance=Distance.COSINE),
-                )
-                logger.info(f"Created collection {collection_name}.")
+    async def collection_exists(self) -> bool:
+        if self.collection_name in self._known_collections:
+            return True
+        if await self.client.collection_exists(self.collection_name):
+            self._known_collections.add(self.collection_name)
+            return True
+        return False
+
+    async def ensure_collection(self, vector_size: int) -> None:
+        if self.collection_name in self._known_collections:
+            return
+        async with self._collection_lock():  # concurrent batches must not both create it
+            if await self.collection_exists():
+                await self._check_vector_size(vector_size)
+                return
+            logger.info("Creating collection %s (%s dimensions, %s).", self.collection_name, vector_size, self.profile)
+            try:
+                with timed("qdrant", "create_collection"):
+                    await self.client.create_collection(
+                        collection_name=self.collection_name,
+                        vectors_config=self.profile.vectors_config(vector_size),
+                        quantization_config=self.profile.quantization_config(),
+                    )
+            except Exception:
+                # Created meanwhile by another worker process
+                if not await self.client.collection_exists(self.collection_name):
+                    raise
+            self._known_collections.add(self.collection_name)
+
+    async def _check_vector_size(self, vector_size: int) -> None:
+        info = await self.client.get_collection(self.collection_name)
+        size = info.config.params.vectors.size
+        if size != vector_size:
+            raise ValueError(
+                f"Collection {self.collection_name} holds {size}-dimension vectors but the embeddings have "
+                f"{vector_size}: recreate the collection after changing EMBEDDING_DIMENSIONS or the model"
+            )
+
+    async def _upsert(self, points) -> None:
+        for attempt in range(1, INGEST_UPSERT_RETRIES + 1):
+            try:
+                with timed("qdrant", "upsert"):
+                    await self.client.upsert(collection_name=self.collection_name, points=points, wait=True)
+                return
+            except Exception as e:
+                if attempt == INGEST_UPSERT_RETRIES:
+                    raise
+                UPSERT_RETRIES.inc()
+                delay = INGEST_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+                logger.warning("Upsert of %s points failed (%s), retrying in %ss", len(points), e, delay)
+                await asyncio.sleep(delay)
+
+    async def _index_batch(self, batch: list[tuple], metadata: dict) -> list[str]:
+        """ Embed and upsert [(point id, text)]; returns the ids."""
+        with timed("openai", "embeddings"):
+            vectors = await self.embedding_function.aembed_documents([text for _, text in batch])
+        await self.ensure_collection(len(vectors[0]))
+        await self._upsert([
+            PointStruct(id=point_id, vector=vector, payload={"page_content": text, "metadata": metadata})
+            for (point_id, text), vector in zip(batch, vectors)
+        ])
+        INDEXED_CHUNKS.labels("added").inc(len(batch))
+        return [point_id for point_id, _ in batch]
 
-            self.vector_store =  QdrantVectorStore.from_existing_collection(collection_name=collection_name,
-                                                                            embedding=self.embedding_function,
-                                                                            url=self.db_path,
-                                                                            )
-            
-            logger.info(f"Vector store: {self.vector_store}")
+    async def _indexed_ids(self, source: str) -> set[str]:
+        if self.manifest is None:
+            return set()
+        if not await self.collection_exists():
+            # The collection was dropped: whatever the manifest says is gone
+            await self.manifest.forget(self.collection_name)
+            return set()
+        return await self.manifest.chunk_ids(self.collection_name, source)
 
-            await self.vector_store.aadd_documents(documents=docs, ids=uuids)
+    async def index_chunks(self, chunks, metadata: dict, progress=None) -> IndexReport:
+        """
+        Index the text chunks of (async) iterable `chunks` as the new content of
+        source metadata["source"]. Chunks already indexed for that source are
+        skipped, new ones are embedded and upserted (reading pauses while
+        `concurrency` batches are in flight) and the source's chunks that are
+        no longer there are deleted. `progress` is called with the running
+        number of chunks added.
+        """
+        if not hasattr(chunks, "__aiter__"):
+            chunks = _aiter(chunks)
+        source = metadata.get("source", "")
+        indexed_before = await self._indexed_ids(source)
+        report, seen, added = IndexReport(), set(), []
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = []
 
-            logger.info(f"Successfully indexed document in QdrantDB")
+        async def run(batch):
+            try:
+                ids = await self._index_batch(batch, metadata)
+                added.extend(ids)
+                report.added = len(added)
+                if progress is not None:
+                    progress(report.added)
+            finally:
+                slots.release()
+
+        async def submit(batch):
+            await slots.acquire()
+            for task in tasks:
+                if task.done() and task.exception() is not None:
+                    slots.release()
+                    raise task.exception()
+            tasks.append(asyncio.create_task(run(batch)))
+
+        try:
+            batch = []
+            async for chunk in chunks:
+                point_id = chunk_id(source, chunk)
+                if point_id in seen or point_id in indexed_before:
+                    report.skipped += 1
+                    seen.add(point_id)
+                    continue
+                seen.add(point_id)
+                batch.append((point_id, chunk))
+                if len(batch) == self.batch_size:
+                    await submit(batch)
+                    batch = []
+            if batch:
+                await submit(batch)
+            await asyncio.gather(*tasks)
+        except BaseException as e:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.manifest is not None and added and isinstance(e, Exception):
+                # Keep what was upserted, so that a retry does not embed it again
+                try:
+                    await self.manifest.update(self.collection_name, source, added, [])
+                except Exception as manifest_error:
+                    logger.error("Could not record the chunks indexed before the failure: %s", manifest_error)
+            raise
+        INDEXED_CHUNKS.labels("skipped").inc(report.skipped)
+
+        removed = list(indexed_before - seen)
+        if removed:
+            with timed("qdrant", "delete"):
+                await self.client.delete(
+                    collection_name=self.collection_name,
+                    points_selector=PointIdsList(points=removed),
+                    wait=True,
+                )
+            report.deleted = len(removed)
+            INDEXED_CHUNKS.labels("deleted").inc(len(removed))
+        if self.manifest is not None:
+            await self.manifest.update(self.collection_name, source, added, removed)
+        logger.info("Indexed %s: %s added, %s skipped, %s deleted", source, report.added, report.skipped, report.deleted)
+        return report
+
+    async def index_in_qdrantdb(self, content, file_name, doc_type, chunk_size=500):
+        """ Index a document held in memory (bytes or str). Returns True, or None on failure."""
+        try:
+            if isinstance(content, bytes):
+                content = content.decode("utf-8", errors="replace")
+            splitter = IncrementalSplitter(chunk_size)
+            chunks = splitter.feed(content) + splitter.finish()
+            logger.info("Indexing document: %s of type %s, %s chunks", file_name, doc_type, len(chunks))
+            await self.index_chunks(chunks, {"source": file_name, "type": doc_type})
+            logger.info("Successfully indexed document in QdrantDB")
             return True
-            
-            
         except Exception as e:
-            print(f"Error during indexing: {e}")
+            logger.error("Error during indexing: %s", e)
             return
-    
+
     def __str__(self):
-        return f"DocumentIndexer connected to Qdrant at {self.db_path}, {self.vector_store}"
+        return f"DocumentIndexer connected to Qdrant, collection {self.collection_name}"
@@ -116,6 +116,12 @@ class UploadedFile(Base):
         cascade="all, delete-orphan",
         passive_deletes=True
     )
+    pending_writes = relationship(
+        "PendingSheetWrite",
+        back_populates="file",
+        cascade="all, delete-orphan",
+        passive_deletes=True
+    )
     def generate_storage_path(self) -> str:
         """Generate a  safe path uploads/unique_file_id_filename.ext"""
         _, ext = os.path.splitext(self.file_name)
@@ -191,9 +197,35 @@ class Student(Base):
         return f"<student(student_id={self.student_id}>, evaluation={self.evaluation}, first_assignment={self.first_assignment}, final_exam={self.final_exam})"
 
 
+class PendingSheetWrite(Base):
+    """ A cell change committed to the database but not yet written back to the XLS file."""
+    __tablename__ = "pending_sheet_writes"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    file_id = Column(UUID(as_uuid=True), ForeignKey(UploadedFile.file_id, ondelete="CASCADE"), nullable=False, index=True)
+    sheet_name = Column(String, nullable=False)
+    row = Column(Integer, nullable=False)
+    col = Column(Integer, nullable=False)
+    value = Column(String, nullable=True)  # JSON encoded cell value
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")  # failed attempts to apply it
+    error = Column(String, nullable=True)  # last error while applying it
+    failed_at = Column(DateTime(timezone=True), nullable=True)  # set once given up on: dead letter, kept for inspection
 
+    file = relationship("UploadedFile", back_populates="pending_writes")
 
+    def __repr__(self):
+        return f"<pending_write(file_id={self.file_id}, sheet_name={self.sheet_name}, row={self.row}, col={self.col})>"
 
 
+class IndexedChunk(Base):
+    """ A chunk of a document indexed in the assistant's vector store: the per-source manifest."""
+    __tablename__ = "indexed_chunks"
 
+    collection = Column(String, primary_key=True)
+    source = Column(String, primary_key=True)
+    chunk_id = Column(String, primary_key=True)  # Qdrant point id, uuid5 of (source, content hash)
+    indexed_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
+    def __repr__(self):
+        return f"<indexed_chunk(collection={self.collection}, source={self.source}, chunk_id={self.chunk_id})>"
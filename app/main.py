@@ -16,29 +16,28 @@ from app.v1.routers import (
     file,
     classrooms,
     students,
-    admin
+    admin,
+    metrics,
+    profiles,
     )
 
 from contextlib import asynccontextmanager
-from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance
 
-from app.database.database import Base, engine
+from app.database.database import Base, engine, async_engine
 from app.database import models  # make sure all models are imported here
+from app.v1.services.workers import shutdown_pools
+from app.v1.services.sheet_sync import sheet_sync
+from app.v1.services.ingestion import ingestion_jobs
+from app.v1.auth.google_certs import google_certs
+from app.v1.auth.token_cache import revoked_tokens
+from app.v1.services.clients import ClientRegistry
+from app.v1.logs import configure_logging
+from app.v1.telemetry import MetricsMiddleware
+from app.v1.profiling import ProfilingMiddleware
 
 
+configure_logging()
 
-# Qdrant client
-qdrant_client = QdrantClient(
-    host="localhost",
-    port=6333,
-    prefer_grpc=True
-)
-
-# Define collections and their configs
-COLLECTIONS = {
-    "document_embeddings": VectorParams(size=384, distance=Distance.DOT),
-}
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -50,33 +49,29 @@ async def lifespan(app: FastAPI):
 
     try:
         logging.info("Creating database and tables...")
-        Base.metadata.create_all(bind=engine)
+        async with async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
         logging.info("Done.")
+        app.state.clients = ClientRegistry.from_env()
+        revoked_tokens.load()
+        revoked_tokens.start()
+        sheet_sync.start()
         yield
     except Exception as e:
-        logging.error(f"Error during startup: {e}")
+        logging.error("Error during startup: %s", e)
         raise e
+    finally:
+        # ---- Shutdown ----
+        await sheet_sync.stop()
+        await revoked_tokens.stop()
+        await ingestion_jobs.shutdown()
+        if getattr(app.state, "clients", None) is not None:
+            await app.state.clients.aclose()
+        shutdown_pools()
+        google_certs.close()
+        await async_engine.dispose()
+        engine.dispose()
 
-"""
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # ---- Startup ----
-    existing = [c.name for c in qdrant_client.get_collections().collections]
-    for name, config in COLLECTIONS.items():
-        if name not in existing:
-            qdrant_client.recreate_collection(
-                collection_name=name,
-                vectors_config=config,
-            )
-            print(f"✅ Created collection {name}")
-        else:
-            print(f"ℹ️ Collection {name} already exists")
-    
-    yield  # <-- application runs here
-
-    # ---- Shutdown ----
-    print("🔻 Shutting down app...")
-"""
 logger = logging.getLogger("__main.py__")
 
 
@@ -114,6 +109,8 @@ app.add_middleware(
     allow_methods=["*"],  # Allow all HTTP methods
     allow_headers=["*"],  # Allow all headers
 )
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)  # outermost: the profiler reads its request stats
 
 app.include_router(status.router)
 app.include_router(auth.router)
@@ -124,6 +121,8 @@ app.include_router(file.router)
 app.include_router(classrooms.router)
 app.include_router(students.router)
 app.include_router(admin.router)
+app.include_router(metrics.router)
+app.include_router(profiles.router)
 
 
 if __name__ == "__main__":
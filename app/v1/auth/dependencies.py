@@ -1,23 +1,21 @@
 from fastapi import Request, HTTPException, status
 from jose import jwt, JWTError
+from app.v1.auth import jwt_utils
+from app.v1.auth.token_cache import claims_cache, revoked_tokens
+from app.v1.services.workers import io_pool
+from app.v1.telemetry import phase
+import hashlib
+import hmac
 import logging
+import os
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
 logger = logging.getLogger("__dependencies.py__")
 
+OPERATOR_TOKEN  = os.getenv("OPERATOR_TOKEN", "")  # empty: the operator endpoints are disabled
+OPERATOR_HEADER = "X-Operator-Token"
 
-def get_current_user(request: Request):
-    """
-    Extracts the user ID from the JWT token in the request headers.
-    This function is used as a dependency in FastAPI routes to ensure that the user is authorized.
-    """
-     # logger.info(f"Headers: {request.headers}")
-    logger.info(f"Authorization Header: {request.headers.get('Authorization')}")
 
-    
+def get_token(request: Request) -> str:
     auth_header = request.headers.get("Authorization")
 
     if not auth_header or not auth_header.startswith("Bearer"):
@@ -26,15 +24,55 @@ def get_current_user(request: Request):
             detail="Authorization header missing",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    token = auth_header.split(" ")[1]
-    try:
-        payload = jwt.decode(token, "1234", algorithms=["HS256"])
-        logger.info(f"Payload! {payload}")
-        user_id: str = payload.get("user_id")
-        if user_id is None:
-            raise JWTError("User ID not found in token")
-        return user_id
-    except JWTError as e:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
+    return auth_header.split(" ")[1]
 
 
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+async def get_current_user(request: Request):
+    """
+    Extracts the user ID from the JWT token in the request headers.
+    This function is used as a dependency in FastAPI routes to ensure that the user is authorized.
+    Verified claims are cached per token until it expires; revoked tokens are refused.
+    """
+    with phase("auth"):
+        token = get_token(request)
+        digest = token_digest(token)
+        if revoked_tokens.is_revoked(digest):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token has been revoked")
+
+        payload = claims_cache.get(digest)
+        try:
+            if payload is None:
+                payload = jwt.decode(token, jwt_utils.SECRET_KEY, algorithms=[jwt_utils.ALGORITHM])
+                claims_cache.put(digest, payload)
+            user_id: str = payload.get("user_id")
+            if user_id is None:
+                raise JWTError("User ID not found in token")
+            return user_id
+        except JWTError as e:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
+
+
+def require_operator(request: Request) -> None:
+    """ Dependency of the endpoints describing the service's internals: the operator token."""
+    if not OPERATOR_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+    token = request.headers.get(OPERATOR_HEADER, "")
+    if not token or not hmac.compare_digest(token.encode(), OPERATOR_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid operator token")
+
+
+async def revoke_current_token(request: Request) -> None:
+    """ Log the request's token out: refused from now on, by every worker."""
+    token = get_token(request)
+    digest = token_digest(token)
+    try:
+        # the routes already verified it; the claims cache may have evicted the payload
+        expires = jwt.get_unverified_claims(token).get("exp")
+    except JWTError:
+        expires = None
+    await io_pool.run(revoked_tokens.revoke, digest, expires)
+    claims_cache.discard(digest)
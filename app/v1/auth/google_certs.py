@@ -0,0 +1,138 @@
+'''
+Cached verification of Google ID tokens.
+
+`id_token.verify_oauth2_token` downloads Google's signing certificates on every
+call. GoogleCertCache keeps them for the max-age announced in the response's
+Cache-Control header, fetches them through a pooled requests.Session, and
+refreshes them in a background thread shortly before they expire so that no
+login waits for the download. Verification is blocking: run it in the io pool.
+'''
+from app.v1.metrics import Counter
+
+from google.auth import jwt as google_jwt
+from requests.adapters import HTTPAdapter
+
+import logging
+import os
+import re
+import threading
+import time
+
+import requests
+
+
+logger = logging.getLogger("__auth/google_certs.py__")
+
+GOOGLE_CERTS_URL           = os.getenv("GOOGLE_CERTS_URL", "https://www.googleapis.com/oauth2/v1/certs")
+GOOGLE_ISSUERS             = ("accounts.google.com", "https://accounts.google.com")
+CERTS_DEFAULT_MAX_AGE      = int(os.getenv("GOOGLE_CERTS_DEFAULT_MAX_AGE", 3600))   # when no Cache-Control max-age
+CERTS_REFRESH_MARGIN       = int(os.getenv("GOOGLE_CERTS_REFRESH_MARGIN", 300))     # seconds before expiry
+CERTS_MIN_REFRESH_INTERVAL = int(os.getenv("GOOGLE_CERTS_MIN_REFRESH_INTERVAL", 30))  # unknown key id refetch limit
+CERTS_HTTP_TIMEOUT         = float(os.getenv("GOOGLE_CERTS_HTTP_TIMEOUT", 5.0))
+CLOCK_SKEW_SECONDS         = int(os.getenv("GOOGLE_TOKEN_CLOCK_SKEW_SECONDS", 10))
+
+MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+CERT_FETCHES = Counter("auth_google_cert_fetches_total", "Downloads of Google's signing certificates", ("reason",))
+
+
+def pooled_session(pool_maxsize: int = 10) -> requests.Session:
+    """ requests.Session keeping its TCP/TLS connections open between calls."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def parse_max_age(cache_control: str, default: int = CERTS_DEFAULT_MAX_AGE) -> int:
+    match = MAX_AGE_RE.search(cache_control or "")
+    return int(match.group(1)) if match else default
+
+
+class GoogleCertCache:
+    def __init__(self, url: str = GOOGLE_CERTS_URL, session: requests.Session = None,
+                 refresh_margin: int = CERTS_REFRESH_MARGIN, clock=time.monotonic):
+        self.url = url
+        self.session = session or pooled_session()
+        self.refresh_margin = refresh_margin
+        self.clock = clock
+        self._certs = {}          # key id -> PEM certificate
+        self._expires_at = 0.0
+        self._fetched_at = float("-inf")
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    # ---- cache ----
+    def _fetch(self, reason: str) -> None:
+        response = self.session.get(self.url, timeout=CERTS_HTTP_TIMEOUT)
+        response.raise_for_status()
+        certs = response.json()
+        max_age = parse_max_age(response.headers.get("Cache-Control"))
+        now = self.clock()
+        self._certs, self._expires_at, self._fetched_at = certs, now + max_age, now
+        CERT_FETCHES.labels(reason).inc()
+        logger.info("Fetched %s Google certificates (%s), valid for %ss", len(certs), reason, max_age)
+
+    def _refresh_in_background(self) -> None:
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                with self._lock:
+                    self._fetch("refresh")
+            except Exception as e:
+                # The current certificates stay in use until they expire
+                logger.error("Background refresh of Google certificates failed: %s", e)
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=refresh, name="google-certs-refresh", daemon=True).start()
+
+    def get(self) -> dict:
+        """ The current certificates, downloading them only when missing or expired."""
+        now = self.clock()
+        if now >= self._expires_at:
+            with self._lock:
+                if self.clock() >= self._expires_at:  # another thread may have fetched them meanwhile
+                    self._fetch("expired" if self._certs else "initial")
+        elif now >= self._expires_at - self.refresh_margin:
+            self._refresh_in_background()
+        return self._certs
+
+    def _refetch_for_unknown_key(self, key_id) -> None:
+        """ Google rotated its keys before our copy expired: refetch, at most every few seconds."""
+        with self._lock:
+            if key_id in self._certs or self.clock() - self._fetched_at < CERTS_MIN_REFRESH_INTERVAL:
+                return
+            self._fetch("unknown_key")
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._certs, self._expires_at = {}, 0.0
+
+    def close(self) -> None:
+        self.session.close()
+
+    # ---- verification ----
+    def verify(self, token: str, audience: str) -> dict:
+        """
+        Verify the signature, expiry, audience and issuer of a Google ID token
+        and return its claims. Raises ValueError on an invalid token.
+        """
+        certs = self.get()
+        key_id = google_jwt.decode_header(token).get("kid")
+        if key_id not in certs:
+            self._refetch_for_unknown_key(key_id)
+            certs = self._certs
+
+        claims = google_jwt.decode(token, certs=certs, audience=audience, clock_skew_in_seconds=CLOCK_SKEW_SECONDS)
+        if claims.get("iss") not in GOOGLE_ISSUERS:
+            raise ValueError(f"Wrong issuer: {claims.get('iss')}")
+        return claims
+
+
+google_certs = GoogleCertCache()
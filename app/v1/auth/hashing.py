@@ -0,0 +1,19 @@
+'''
+Password hashing off the event loop.
+
+An argon2 hash costs tens of milliseconds of CPU. Running it inside an async
+handler stalls every other request on the worker, so hashes and verifications
+go through hash_pool: a few dedicated threads with a bounded queue that answers
+503 + Retry-After when a login storm fills it.
+'''
+from app.v1.services.workers import hash_pool
+from app.v1.utils import get_password_hash, verify_and_update_password
+
+
+async def hash_password(password: str) -> str:
+    return await hash_pool.run(get_password_hash, password)
+
+
+async def check_password(plain_password: str, hashed_password: str):
+    """ (valid, new_hash), see verify_and_update_password."""
+    return await hash_pool.run(verify_and_update_password, plain_password, hashed_password)
@@ -1,19 +1,22 @@
+from datetime import datetime, timedelta, timezone
 from jose import jwt
 import os
 
 SECRET_KEY = os.getenv("SECRET_KEY")  # Use a secure key in production
-ALGORITHM = os.getenv("ALGORITHM")  # Use a secure algorithm
+ALGORITHM = os.getenv("ALGORITHM", "HS256")  # Use a secure algorithm
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 24 * 60))
 
 
 # Function to generate a JWT token
-async def create_access_token(data):
+async def create_access_token(data, expires_minutes: int = None):
     """
     Generate a JWT token for the authenticated user.
-    This is a placeholder function; implement JWT generation logic here.
+    It expires after ACCESS_TOKEN_EXPIRE_MINUTES (`exp` claim).
     """
     to_enocde = data.copy()
-    # add expiration time if needed
-    # to_enocde.update({"exp": datetime.utcnow() + timedelta(minutes=15)})
+    now = datetime.now(timezone.utc)
+    minutes = ACCESS_TOKEN_EXPIRE_MINUTES if expires_minutes is None else expires_minutes
+    to_enocde.update({"iat": now, "exp": now + timedelta(minutes=minutes)})
 
     token = jwt.encode(to_enocde, SECRET_KEY, algorithm=ALGORITHM)
     return token
@@ -0,0 +1,116 @@
+'''
+In-memory sliding-window rate limiting for the password endpoints.
+
+Every attempt is counted before any hashing is done, so that a flood of logins
+is turned away for the price of a dict lookup. Limits are per process:
+  - per client and account: one client guessing a password is stopped
+    without locking the account for the others;
+  - per account, from anywhere: a higher limit against distributed guessing.
+The client is the address the request came from or, when that is one of the
+TRUSTED_PROXIES (the reverse proxy), the first untrusted address of
+X-Forwarded-For read from the right. Keying on the socket address alone would
+put every client behind the proxy in the same bucket.
+'''
+from app.v1.metrics import Counter
+
+from collections import OrderedDict, deque
+from fastapi import HTTPException, Request, status
+
+import ipaddress
+import logging
+import math
+import os
+import threading
+import time
+
+
+logger = logging.getLogger("__auth/rate_limit.py__")
+
+LOGIN_WINDOW_SECONDS      = float(os.getenv("LOGIN_RATE_LIMIT_WINDOW_SECONDS", 60))
+LOGIN_ATTEMPTS_PER_CLIENT = int(os.getenv("LOGIN_RATE_LIMIT_PER_CLIENT", 10))  # per client and account
+LOGIN_ATTEMPTS_PER_EMAIL  = int(os.getenv("LOGIN_RATE_LIMIT_PER_EMAIL", 50))   # per account, all clients
+RATE_LIMIT_MAX_KEYS       = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100_000))
+TRUSTED_PROXIES           = os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1")  # addresses or networks, comma separated
+
+RATE_LIMITED = Counter("auth_rate_limited_total", "Password attempts rejected by the rate limiter", ("scope",))
+
+
+class SlidingWindowLimiter:
+    def __init__(self, max_attempts: int, window_seconds: float, max_keys: int = RATE_LIMIT_MAX_KEYS, clock=time.monotonic):
+        self.max_attempts = max_attempts
+        self.window = window_seconds
+        self.max_keys = max_keys
+        self.clock = clock
+        self._attempts = OrderedDict()  # key -> deque of attempt times, least recently used first
+        self._lock = threading.Lock()
+
+    def hit(self, key) -> float:
+        """ Record an attempt for `key`. Returns 0 when allowed, else the seconds until the next one is."""
+        now = self.clock()
+        with self._lock:
+            attempts = self._attempts.get(key)
+            if attempts is None:
+                attempts = self._attempts[key] = deque()
+                while len(self._attempts) > self.max_keys:
+                    self._attempts.popitem(last=False)
+            else:
+                self._attempts.move_to_end(key)
+
+            while attempts and attempts[0] <= now - self.window:
+                attempts.popleft()
+            if len(attempts) >= self.max_attempts:
+                return attempts[0] + self.window - now
+            attempts.append(now)
+            return 0.0
+
+    def reset(self, key) -> None:
+        with self._lock:
+            self._attempts.pop(key, None)
+
+
+client_limiter = SlidingWindowLimiter(LOGIN_ATTEMPTS_PER_CLIENT, LOGIN_WINDOW_SECONDS)
+email_limiter  = SlidingWindowLimiter(LOGIN_ATTEMPTS_PER_EMAIL, LOGIN_WINDOW_SECONDS)
+
+
+def parse_networks(value: str) -> tuple:
+    return tuple(ipaddress.ip_network(item.strip(), strict=False) for item in value.split(",") if item.strip())
+
+
+trusted_proxies = parse_networks(TRUSTED_PROXIES)
+
+
+def _is_trusted(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted_proxies)
+
+
+def client_address(request: Request) -> str:
+    """ The client's address, looking through the trusted proxies' X-Forwarded-For."""
+    address = request.client.host if request.client else "unknown"
+    if not _is_trusted(address):
+        return address
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        address = hop
+        if not _is_trusted(hop):
+            break
+    return address
+
+
+def check_login_rate(request: Request, email: str) -> None:
+    """ Count a password attempt, raising 429 with Retry-After when the client or the account is over its limit."""
+    email = email.lower()
+    for scope, limiter, key in (("client", client_limiter, (client_address(request), email)),
+                                ("email", email_limiter, email)):
+        retry_after = limiter.hit(key)
+        if retry_after:
+            RATE_LIMITED.labels(scope).inc()
+            logger.warning("Rate limited password attempt (%s)", scope)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many attempts. Please retry later.",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
@@ -0,0 +1,199 @@
+'''
+Fast path for get_current_user: a cache of verified JWT claims and the list of
+revoked (logged out) tokens.
+
+Both are keyed by the SHA-256 digest of the token. ClaimsCache keeps up to
+AUTH_CLAIMS_CACHE_SIZE verified payloads, each until the token's own `exp`
+(AUTH_CLAIMS_CACHE_TTL_SECONDS for tokens without one), so a known token is
+not decoded and verified again.
+
+RevocationList is checked on every request before the cache. The digests map
+to the token's expiry in a dict, fronted by a Bloom filter built from the
+digest bytes: a token that was never revoked is turned away after a few bit
+tests. The check is a pure in-memory lookup. The list is saved to
+REVOCATION_LIST_PATH on every revocation (empty: memory only) and a background
+task reloads it when the file changes, checked every REVOCATION_RELOAD_SECONDS
+in the io pool, so the worker processes share logouts without a stat or a
+read on the request path. Expired entries are dropped on save and load.
+'''
+from app.v1.metrics import Counter
+from app.v1.services.workers import io_pool
+
+from collections import OrderedDict
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+logger = logging.getLogger("__auth/token_cache.py__")
+
+AUTH_CLAIMS_CACHE_SIZE        = int(os.getenv("AUTH_CLAIMS_CACHE_SIZE", 10000))
+AUTH_CLAIMS_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CLAIMS_CACHE_TTL_SECONDS", 300))  # tokens without `exp`
+REVOCATION_LIST_PATH          = os.getenv("REVOCATION_LIST_PATH", "app/cache/revoked_tokens.json")
+REVOCATION_RELOAD_SECONDS     = float(os.getenv("REVOCATION_RELOAD_SECONDS", 5))
+REVOCATION_BLOOM_BITS         = int(os.getenv("REVOCATION_BLOOM_BITS", 1 << 20))
+
+BLOOM_HASHES = 4  # bit positions per digest, each taken from 4 of its bytes
+
+CLAIMS_LOOKUPS = Counter("auth_claims_cache_lookups_total", "Verified claims cache lookups", ("result",))
+REVOKED_SEEN   = Counter("auth_revoked_tokens_rejected_total", "Requests made with a revoked token")
+
+
+class ClaimsCache:
+    def __init__(self, max_entries: int = AUTH_CLAIMS_CACHE_SIZE, ttl_seconds: float = AUTH_CLAIMS_CACHE_TTL_SECONDS,
+                 clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.clock = clock
+        self._entries = OrderedDict()  # digest -> (expires at, claims), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, digest: bytes) -> dict:
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None or entry[0] <= self.clock():
+                CLAIMS_LOOKUPS.labels("miss").inc()
+                return None
+            self._entries.move_to_end(digest)
+        CLAIMS_LOOKUPS.labels("hit").inc()
+        return entry[1]
+
+    def put(self, digest: bytes, claims: dict) -> None:
+        expires = claims.get("exp") or self.clock() + self.ttl
+        with self._lock:
+            self._entries[digest] = (expires, claims)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, digest: bytes) -> None:
+        with self._lock:
+            self._entries.pop(digest, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class RevocationList:
+    def __init__(self, path: str = None, bloom_bits: int = REVOCATION_BLOOM_BITS,
+                 reload_seconds: float = REVOCATION_RELOAD_SECONDS, clock=time.time):
+        self.path = REVOCATION_LIST_PATH if path is None else path
+        self.bloom_bits = bloom_bits
+        self.reload_seconds = reload_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._revoked = {}      # digest -> expiry of the token (None: never expires)
+        self._bloom = bytearray(bloom_bits // 8)
+        self._next_expiry = None  # earliest expiry in the list
+        self._mtime = None      # of the file when last loaded
+        self._task = None       # the reload loop
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+    def _positions(self, digest: bytes):
+        for i in range(BLOOM_HASHES):
+            yield int.from_bytes(digest[4 * i:4 * i + 4], "little") % self.bloom_bits
+
+    def _add_to_bloom(self, digest: bytes) -> None:
+        for position in self._positions(digest):
+            self._bloom[position >> 3] |= 1 << (position & 7)
+
+    def _rebuild(self, revoked: dict) -> None:
+        now = self.clock()
+        self._revoked = {digest: exp for digest, exp in revoked.items() if exp is None or exp > now}
+        self._bloom = bytearray(self.bloom_bits // 8)
+        for digest in self._revoked:
+            self._add_to_bloom(digest)
+        self._next_expiry = min((exp for exp in self._revoked.values() if exp is not None), default=None)
+
+    def is_revoked(self, digest: bytes) -> bool:
+        bloom = self._bloom
+        for position in self._positions(digest):
+            if not bloom[position >> 3] & (1 << (position & 7)):
+                return False
+        if digest not in self._revoked:
+            return False  # Bloom filter false positive
+        REVOKED_SEEN.inc()
+        return True
+
+    def revoke(self, digest: bytes, expires: float = None) -> None:
+        """ Deny the token until `expires` (its `exp`). Saves the list: run it off the event loop."""
+        with self._lock:
+            self._load_if_changed()  # keep the revocations of the other workers
+            self._revoked[digest] = expires
+            self._add_to_bloom(digest)
+            if expires is not None and (self._next_expiry is None or expires < self._next_expiry):
+                self._next_expiry = expires
+            self._save()
+
+    # ---- persistence ----
+    def load(self) -> None:
+        with self._lock:
+            self._load_if_changed()
+
+    async def _reload_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.reload_seconds)
+            try:
+                await io_pool.run(self.load)
+            except Exception as e:
+                logger.error("Could not reload the revoked tokens: %s", e)
+
+    def start(self) -> None:
+        """ Reload the list in the background while the event loop runs (after load() at startup)."""
+        if self.path and self._task is None:
+            self._task = asyncio.create_task(self._reload_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _load_if_changed(self) -> None:
+        if not self.path:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error("Could not load the revoked tokens from %s: %s", self.path, e)
+            return
+        revoked = {bytes.fromhex(digest): exp for digest, exp in stored.items()}
+        revoked.update(self._revoked)
+        self._rebuild(revoked)
+        self._mtime = mtime
+        logger.info("Loaded %s revoked tokens from %s", len(self._revoked), self.path)
+
+    def _save(self) -> None:
+        if self._next_expiry is not None and self._next_expiry <= self.clock():
+            self._rebuild(self._revoked)  # drop the expired entries
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        descriptor, tmp_path = tempfile.mkstemp(dir=directory, prefix=".revoked-")
+        with os.fdopen(descriptor, "w") as f:
+            json.dump({digest.hex(): exp for digest, exp in self._revoked.items()}, f)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+
+claims_cache = ClaimsCache()
+revoked_tokens = RevocationList()
@@ -0,0 +1,226 @@
+'''
+Central logging setup: one background writer for the whole process.
+
+configure_logging() replaces the per-module basicConfig calls. The root logger
+gets a single QueueHandler; the message of a record (and its traceback) is
+rendered where it is logged, since its arguments may be objects that are only
+valid there (an ORM instance bound to the request's session), and a
+QueueListener thread formats the record, as JSON lines by default, and writes
+it out. Logging a message on the event loop is then a level check, the
+filters, one %-formatting and a queue put: no I/O. Log with %-style arguments
+(logger.info("Saved %s cells", n)) so that messages below the level or dropped
+by the filters are never rendered.
+
+The hot-path loggers, LOG_HOT_LOGGERS and any logger named in
+LOG_SAMPLE_RATES, get a HotPathFilter; the records of the other loggers are
+all kept. Of a hot-path logger, records below WARNING are filtered:
+  - LOG_SAMPLE_RATES keeps a fraction of the records of the given loggers,
+    e.g. "__routers/classrooms.py__=0.1,__routers/me.py__=0.5";
+  - LOG_RATE_LIMIT caps the records per second of each logger (token bucket
+    of LOG_RATE_LIMIT tokens, 0: no limit).
+Warnings and errors are never dropped. When LOG_QUEUE_SIZE records are
+waiting (the writer cannot keep up) records are dropped rather than blocking
+the caller; every drop is counted in log_records_dropped_total. The queue is
+a SimpleQueue: a put is a fraction of a microsecond, against a few for the
+lock and condition of queue.Queue.
+'''
+from app.v1.metrics import Counter
+
+from logging.handlers import QueueHandler, QueueListener
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+
+LOG_LEVEL        = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT       = os.getenv("LOG_FORMAT", "json")  # json | text
+LOG_QUEUE_SIZE   = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+LOG_RATE_LIMIT   = float(os.getenv("LOG_RATE_LIMIT", 200))  # records per second and hot-path logger
+LOG_HOT_LOGGERS  = os.getenv("LOG_HOT_LOGGERS", "__routers/classrooms.py__,__routers/students.py__,"
+                                                "__routers/assistant.py__,__dependencies.py__,__utils.py__")
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+DROPPED = Counter("log_records_dropped_total", "Log records dropped before being written", ("reason",))
+
+# Attributes every LogRecord has; anything else was passed with `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_encoder = json.JSONEncoder(ensure_ascii=False, default=str)
+_traceback_formatter = logging.Formatter()
+
+_listener = None
+_queue_handler = None
+_hot_filter = None
+_hot_loggers = ()
+
+
+def parse_sample_rates(value: str) -> dict:
+    """ "name=rate,name=rate" -> {name: rate}."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, rate = item.rpartition("=")
+        rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__()
+        self._second = None  # the last second formatted, and its text
+        self._second_text = ""
+
+    def format_time(self, created: float) -> str:
+        second = int(created)
+        if second != self._second:
+            self._second, self._second_text = second, time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+        return f"{self._second_text}.{int((created - second) * 1000):03d}Z"
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.format_time(record.created),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in record.__dict__.keys() - _RECORD_ATTRIBUTES:
+            if not key.startswith("_"):
+                entry[key] = record.__dict__[key]
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return _encoder.encode(entry)
+
+
+class HotPathFilter(logging.Filter):
+    def __init__(self, sample_rates: dict = None, rate_limit: float = LOG_RATE_LIMIT, clock=time.monotonic):
+        super().__init__()
+        self.sample_rates = parse_sample_rates(LOG_SAMPLE_RATES) if sample_rates is None else sample_rates
+        self.rate_limit = rate_limit
+        self.clock = clock
+        self._buckets = {}  # logger name -> [tokens, last refill]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.sample_rates.get(record.name)
+        if rate is not None and random.random() >= rate:
+            DROPPED.labels("sampled").inc()
+            return False
+        if self.rate_limit and not self._take_token(record.name):
+            DROPPED.labels("rate_limited").inc()
+            return False
+        return True
+
+    def _take_token(self, name: str) -> bool:
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(name)
+            if bucket is None:
+                bucket = self._buckets[name] = [self.rate_limit, now]
+            tokens = min(self.rate_limit, bucket[0] + (now - bucket[1]) * self.rate_limit)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                return False
+            bucket[0] = tokens - 1
+            return True
+
+
+class LazyQueueHandler(QueueHandler):
+    """ Enqueues the record with its message rendered; the listener thread formats it."""
+    def __init__(self, max_size: int = LOG_QUEUE_SIZE):
+        super().__init__(queue.SimpleQueue())
+        self.max_size = max_size
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only records past the level and the filters get here. The queue is in
+        # process, so nothing is pickled, but the args and the exception are
+        # rendered now: on the listener thread, later, they may have changed
+        # or be unsafe to read.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.queue.qsize() >= self.max_size:
+            DROPPED.labels("queue_full").inc()
+            return
+        self.queue.put_nowait(record)
+
+
+class _StderrHandler(logging.StreamHandler):
+    """ Writes to the current sys.stderr, even when it is replaced after setup."""
+    def __init__(self):
+        super().__init__(stream=None)
+
+    @property
+    def stream(self):
+        return sys.stderr
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, stream=None,
+                      sample_rates: dict = None, rate_limit: float = LOG_RATE_LIMIT,
+                      queue_size: int = LOG_QUEUE_SIZE, hot_loggers=None) -> QueueListener:
+    """ Route the root logger through the queue and start the writer thread. Replaces any earlier setup."""
+    global _listener, _queue_handler, _hot_filter, _hot_loggers
+    shutdown_logging()
+
+    output = _StderrHandler() if stream is None else logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    handler = LazyQueueHandler(queue_size)
+
+    if sample_rates is None:
+        sample_rates = parse_sample_rates(LOG_SAMPLE_RATES)
+    if hot_loggers is None:
+        hot_loggers = [name.strip() for name in LOG_HOT_LOGGERS.split(",") if name.strip()]
+    _hot_filter = HotPathFilter(sample_rates, rate_limit)
+    _hot_loggers = tuple(dict.fromkeys([*hot_loggers, *sample_rates]))
+    for name in _hot_loggers:
+        logging.getLogger(name).addFilter(_hot_filter)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if type(existing) is logging.StreamHandler:
+            root.removeHandler(existing)  # left by a basicConfig call
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _queue_handler = handler
+    _listener = QueueListener(handler.queue, output)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging() -> None:
+    """ Write out the queued records and stop the writer thread."""
+    global _listener, _queue_handler, _hot_filter, _hot_loggers
+    if _listener is None:
+        return
+    logging.getLogger().removeHandler(_queue_handler)
+    for name in _hot_loggers:
+        logging.getLogger(name).removeFilter(_hot_filter)
+    _listener.stop()
+    _listener = _queue_handler = _hot_filter = None
+    _hot_loggers = ()
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,169 @@
+'''
+Minimal in-process metrics: counters, gauges and histograms with optional labels.
+Every metric registers itself in REGISTRY so it can be reported from one place:
+snapshot() for the status endpoints, exposition() in the Prometheus text format.
+'''
+from bisect import bisect_left
+import math
+import threading
+
+
+EXPOSITION_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY: dict = {}
+
+
+class _CounterChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = value
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {"count": self.count, "sum": self.sum, "counts": list(self.counts)}
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """ Return the child metric for the given label values."""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def samples(self):
+        """ Yield (labels dict, value snapshot) for every child."""
+        for key, child in list(self._children.items()):
+            yield dict(zip(self.labelnames, key)), child.snapshot()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+
+def snapshot(prefix: str = "") -> dict:
+    """ JSON friendly view of the registered metrics whose name starts with `prefix`."""
+    return {
+        name: [{"labels": labels, "value": value} for labels, value in metric.samples()]
+        for name, metric in REGISTRY.items()
+        if name.startswith(prefix)
+    }
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(labels: dict, le: str = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in labels.items()]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def exposition() -> str:
+    """ Every registered metric in the Prometheus text format (version 0.0.4)."""
+    lines = []
+    for name, metric in list(REGISTRY.items()):
+        documentation = metric.documentation.replace("\\", "\\\\").replace("\n", "\\n")
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for labels, value in metric.samples():
+            if metric.kind != "histogram":
+                lines.append(f"{name}{_label_text(labels)} {float(value)!r}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + (math.inf,), value["counts"]):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                lines.append(f"{name}_bucket{_label_text(labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(labels)} {float(value['sum'])!r}")
+            lines.append(f"{name}_count{_label_text(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,312 @@
+'''
+Opt-in profiling of single requests, for "this endpoint is slow for me".
+
+A request is profiled when it carries PROFILE_TOKEN in the PROFILE_HEADER
+header or in the `profile` query parameter (both off while PROFILE_TOKEN is
+unset), or when it is drawn by PROFILE_SAMPLE_RATE (0 by default). The
+routers are not involved: ProfilingMiddleware wraps the whole app.
+
+While profiled requests run, a sampler thread looks at the event loop every
+PROFILE_INTERVAL_MS. When the task the loop is running belongs to the request
+(its context holds the request's RequestStats, so the tasks the request
+starts, such as an event stream producer, count too) the stack of that task
+is counted; otherwise the request is waiting (on I/O, a worker pool or other
+requests) and the sample is counted as "(waiting)". Work done in worker
+threads and processes shows up as waiting. Task.get_context() is new in
+Python 3.12; before it the middleware sets a context variable to the profile
+and a task factory records the tasks created while it is set, the request's
+own task included, and a task belongs to the request when it was recorded.
+
+The report (collapsed stacks, the functions with most samples, the request's
+Server-Timing phases) is written to PROFILE_DIR/<profile id>.json off the
+event loop, keeping the newest PROFILE_MAX_REPORTS. The response carries the
+id in an X-Profile-Id header; GET /profiles/{id} with the token returns the
+report, or with ?format=collapsed the stacks in the input format of
+flamegraph.pl and speedscope.
+'''
+from app.v1.services.workers import io_pool
+from app.v1.telemetry import current_request, stats_in
+
+from collections import Counter
+from contextvars import ContextVar
+from fastapi import HTTPException, Request, status
+from urllib.parse import parse_qs
+
+import asyncio
+import glob
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+import weakref
+
+
+logger = logging.getLogger("__profiling.py__")
+
+PROFILE_TOKEN       = os.getenv("PROFILE_TOKEN", "")
+PROFILE_HEADER      = os.getenv("PROFILE_HEADER", "X-Profile")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_DIR         = os.getenv("PROFILE_DIR", "app/cache/profiles")
+PROFILE_MAX_REPORTS = int(os.getenv("PROFILE_MAX_REPORTS", 200))
+
+PROFILE_QUERY_PARAM = "profile"
+WAITING = "(waiting)"
+TOP_FUNCTIONS = 20
+
+_HANDLE_RUN = asyncio.Handle._run.__code__  # runs a task step, under the event loop's frames
+
+# Before Python 3.12: the profile of the request, copied into the tasks it starts
+_profiled = ContextVar("profile", default=None)
+
+
+def is_profile_token(value: str) -> bool:
+    return bool(PROFILE_TOKEN) and bool(value) and hmac.compare_digest(value.encode(), PROFILE_TOKEN.encode())
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    path = "/".join(code.co_filename.split(os.sep)[-2:])
+    return f"{code.co_qualname} ({path}:{frame.f_lineno})"
+
+
+class Profile:
+    def __init__(self, loop, thread_id: int, stats, method: str, path: str, reason: str):
+        self.profile_id = uuid.uuid4().hex
+        self.loop = loop
+        self.thread_id = thread_id      # of the event loop
+        self.stats = stats
+        self.method = method
+        self.path = path
+        self.reason = reason            # token, sampled
+        self.started = time.time()
+        self.stacks = Counter()         # "outer;...;inner" -> samples
+        self.tasks = weakref.WeakSet()  # of the request, when the tasks have no get_context()
+        self._lock = threading.Lock()   # the sampler may still be in a pass when the report is made
+
+    def sample(self, frame) -> None:
+        """ Count one sample; `frame` is the innermost frame of the loop's thread."""
+        task = asyncio.current_task(self.loop)
+        names = []
+        if task is not None and self._owns(task):
+            # The frames of the task, above the event loop's Handle._run
+            while frame is not None and frame.f_code is not _HANDLE_RUN:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+        with self._lock:
+            self.stacks[";".join(reversed(names)) or WAITING] += 1
+
+    def _owns(self, task) -> bool:
+        get_context = getattr(task, "get_context", None)
+        if get_context is None:
+            return task in self.tasks
+        return stats_in(get_context()) is self.stats
+
+    def report(self, status_code: int, duration: float) -> dict:
+        with self._lock:
+            stacks = Counter(self.stacks)
+        functions = Counter()
+        for stack, samples in stacks.items():
+            if stack != WAITING:
+                # "f (dir/file.py:12)" -> "f (dir/file.py)": the lines of a function add up
+                for name in {frame[:frame.rindex(":")] + ")" for frame in stack.split(";")}:
+                    functions[name] += samples
+        return {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.stats.route,
+            "status": status_code,
+            "reason": self.reason,
+            "started_at": self.started,
+            "duration_ms": round(duration * 1000, 1),
+            "interval_ms": PROFILE_INTERVAL_MS,
+            "samples": sum(stacks.values()),
+            "waiting_samples": stacks[WAITING],
+            "server_timing": self.stats.server_timing(duration),
+            "db_queries": self.stats.db_queries,
+            # Samples in which the function was on the stack
+            "top_functions": [{"function": name, "samples": n} for name, n in functions.most_common(TOP_FUNCTIONS)],
+            "stacks": dict(stacks.most_common()),
+        }
+
+
+class StackSampler:
+    """ One thread sampling every running profile; it exits when there are none."""
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self._profiles = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+
+    def stop(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._profiles:
+                    self._thread = None
+                    return
+                profiles = list(self._profiles)
+            frames = sys._current_frames()
+            for profile in profiles:
+                frame = frames.get(profile.thread_id)
+                if frame is None:
+                    continue
+                try:
+                    profile.sample(frame)
+                except Exception as e:
+                    # The thread samples the other profiles too: give up on this one only
+                    logger.error("Stopped sampling profile %s: %s", profile.profile_id, e)
+                    self.stop(profile)
+            del frames
+            time.sleep(self.interval)
+
+
+sampler = StackSampler()
+
+
+def _track_tasks(loop) -> None:
+    """ Install a task factory recording the tasks created while a profile is set (before Python 3.12)."""
+    previous = loop.get_task_factory()
+    if getattr(previous, "tracks_profiles", False):
+        return
+
+    def factory(loop, coro, **kwargs):
+        task = previous(loop, coro, **kwargs) if previous is not None else asyncio.Task(coro, loop=loop, **kwargs)
+        context = kwargs.get("context")
+        profile = _profiled.get() if context is None else context.get(_profiled)
+        if profile is not None:
+            profile.tasks.add(task)
+        return task
+
+    factory.tracks_profiles = True
+    loop.set_task_factory(factory)
+
+
+# ---- reports ----
+def _report_path(profile_id: str) -> str:
+    return os.path.join(PROFILE_DIR, f"{profile_id}.json")
+
+
+def save_report(report: dict) -> None:
+    """ Write the report and drop the oldest beyond PROFILE_MAX_REPORTS. Blocking: run it in the io pool."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(_report_path(report["profile_id"]), "w") as f:
+        json.dump(report, f)
+    reports = sorted(glob.glob(os.path.join(PROFILE_DIR, "*.json")), key=os.path.getmtime)
+    for path in reports[:-PROFILE_MAX_REPORTS]:
+        os.remove(path)
+
+
+def load_report(profile_id: str) -> dict:
+    """ The saved report, None when there is none with that id."""
+    if not profile_id.isalnum():
+        return None
+    try:
+        with open(_report_path(profile_id)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def list_reports() -> list[dict]:
+    """ Summaries of the saved reports, newest first."""
+    summaries = []
+    for path in sorted(glob.glob(os.path.join(PROFILE_DIR, "*.json")), key=os.path.getmtime, reverse=True):
+        try:
+            with open(path) as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            continue
+        summaries.append({key: report[key] for key in ("profile_id", "method", "path", "status", "reason",
+                                                       "started_at", "duration_ms", "server_timing")})
+    return summaries
+
+
+def collapsed(report: dict) -> str:
+    return "".join(f"{stack} {samples}\n" for stack, samples in report["stacks"].items())
+
+
+def require_profile_token(request: Request) -> None:
+    """ Dependency of the report endpoints: the profile token, in the header or the query."""
+    if not PROFILE_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profiling is disabled")
+    token = request.headers.get(PROFILE_HEADER) or request.query_params.get(PROFILE_QUERY_PARAM, "")
+    if not is_profile_token(token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid profile token")
+
+
+# ---- middleware ----
+class ProfilingMiddleware:
+    """ Profiles the requests that ask for it or are sampled. Goes inside MetricsMiddleware."""
+    def __init__(self, app):
+        self.app = app
+        self._header = PROFILE_HEADER.lower().encode("latin-1")
+
+    def _reason(self, scope) -> str:
+        if PROFILE_TOKEN:
+            for name, value in scope["headers"]:
+                if name == self._header and is_profile_token(value.decode("latin-1")):
+                    return "token"
+            if scope.get("query_string"):
+                values = parse_qs(scope["query_string"].decode("latin-1")).get(PROFILE_QUERY_PARAM, ())
+                if any(is_profile_token(value) for value in values):
+                    return "token"
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        stats = current_request()
+        reason = self._reason(scope) if scope["type"] == "http" and stats is not None else None
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        loop = asyncio.get_running_loop()
+        profile = Profile(loop, threading.get_ident(), stats, scope["method"], scope["path"], reason)
+        response = {"status": 500}
+        task = asyncio.current_task()
+        if not hasattr(task, "get_context"):
+            profile.tasks.add(task)
+            _track_tasks(loop)
+        profiled = _profiled.set(profile)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                message["headers"] = [*message.get("headers", ()), (b"x-profile-id", profile.profile_id.encode())]
+            await send(message)
+
+        sampler.start(profile)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _profiled.reset(profiled)
+            sampler.stop(profile)
+            duration = time.perf_counter() - start
+            # The route is known once the router has run
+            stats.route = getattr(scope.get("route"), "path", stats.route)
+            report = profile.report(response["status"], duration)
+            try:
+                await io_pool.run(save_report, report)
+                logger.info("Saved profile %s of %s %s (%.1f ms)", profile.profile_id, profile.method,
+                            profile.path, duration * 1000)
+            except Exception as e:
+                logger.error("Could not save profile %s: %s", profile.profile_id, e)
@@ -9,13 +9,14 @@ from app.v1.auth.dependencies import get_current_user
 from app.v1.utils import parse_xls, to_float_or_none
 
 
-from app.database.database import get_db
+from app.database.database import get_async_db
 from app.database.models import User
 from app.database.models import UploadedFile, User, Classroom, Student
 
 from typing import Optional
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import logging
 import xlrd
 from sqlalchemy.exc import SQLAlchemyError
@@ -31,21 +32,21 @@ router = APIRouter(
     responses={404: {"description": "Not found"}}
 )
 @router.get("/users")
-def get_all_users(db: Session = Depends(get_db)):
+async def get_all_users(db: AsyncSession = Depends(get_async_db)):
     """ Endpoint to retrieve all users. Admin access required."""
     try:
-        users = db.query(User).all()
+        users = (await db.scalars(select(User))).all()
         return users
     except SQLAlchemyError as e:
-        logger.error(f"Database error: {e}")
+        logger.error("Database error: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @router.get("/students/")
-def get_all_students(db: Session = Depends(get_db)):
+async def get_all_students(db: AsyncSession = Depends(get_async_db)):
     """ Endpoint to retrieve all students. Admin access required."""
     try:
-        students = db.query(Student).all()
+        students = (await db.scalars(select(Student))).all()
         return students
     except SQLAlchemyError as e:
-        logger.error(f"Database error: {e}")
+        logger.error("Database error: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -1,23 +1,27 @@
 # Fastapi 
 from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, status
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse
 
 # App packages
-from app.v1.utils import parse_xls, to_float_or_none, expand_query, retrieve_from_qdrant
+from app.v1.utils import parse_xls, to_float_or_none, expand_query_cached
 from app.v1.schemas.schemas import WorkbookParseResponse, FileUploadResponse, QueryExpantion
 from app.v1.auth.dependencies import get_current_user
-from app.database.database import get_db, DocumentIndexer
+from app.database.database import DocumentIndexer
+from app.v1.services.embeddings import EmbeddingBatcher
+from app.v1.services.ingestion import ingestion_jobs, spool_upload
+from app.v1.services.retrieval import build_context, plan_retrieval, rerank
+from app.v1.services.semantic_cache import answer_cache
+from app.v1.services.streaming import EventStream
+from app.v1.telemetry import timed
+from app.v1.services.clients import get_qdrant, get_chat_model, get_query_expansion_model, get_embedder, get_indexer
 from app.database.models import UploadedFile, User, Classroom, Student
 
 # Sqlalchemy
-from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 
 from pydantic import BaseModel
 
 # Langchain
-from langchain_openai import OpenAIEmbeddings
-from langchain.chat_models import init_chat_model
 from langchain_core.prompts import ChatPromptTemplate
 
 #from langchain_docling import DoclingLoader
@@ -40,10 +44,6 @@ import re
 
 
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
 logger = logging.getLogger("__routers/assistant.py__")
 
 router = APIRouter(
@@ -63,94 +63,82 @@ class QueryExpantion(BaseModel):
 class Query(BaseModel):
     query: str
 
-async def send_completion_events(response):
-    async for chunk in response:
-        yield f"{chunk.content}"
-
-
 @router.post("/chat/reponse", summary="chat with the AI assistant")
-async def reponse(query: Query, db: Session = Depends(get_db)):
+async def reponse(
+                query: Query,
+                client: AsyncQdrantClient = Depends(get_qdrant),
+                generation_model = Depends(get_chat_model),
+                query_expansion_model = Depends(get_query_expansion_model),
+                embedder: EmbeddingBatcher = Depends(get_embedder),
+                ):
     """
     Endpoint to chat with an AI assistant (tools: RAGs)
+    The answer is a stream of server-sent events: `progress` while the
+    context is retrieved, `token` as the answer is generated, then `done`
+    (or `error`).
     """
-    if not os.environ.get("OPENAI_API_KEY"):
-        logger.error("OPENAI_API_KEY is not set in the environment variables.")
-
-    client = AsyncQdrantClient(url="http://qdrant:6333")
-    generation_model = init_chat_model(model="gpt-4.1", model_provider="openai")
-
 
     collection_name = "rag_collection"
-    if not await client.collection_exists(collection_name=collection_name):
-        response = generation_model.astream(
-        input=query.query,
-        )
-        return StreamingResponse(send_completion_events(response), media_type="text/event-stream")
-
-    
-    # Expand similar queries
-    queries = await expand_query(query.query)
-    logger.info(f"Expanded queries: {queries}")
-
-
-    
-    embedding_model = OpenAIEmbeddings(model="text-embedding-3-large",
-                                          api_key=os.environ.get("OPENAI_API_KEY")
-                                          )
-
-    embedding_queries = embedding_model.embed_documents(queries)
-    logger.info(f"The number of vectors: {len(embedding_queries), len(embedding_queries[0])}")
-    logger.info(f"Show vector: {embedding_queries[0][0:5]} ... {embedding_queries[0][-5:]}")
-
-    
-    # Retrieval
-    results = await retrieve_from_qdrant(embedding_queries, collection_name, client)
-    logger.info(f"Number of results retrieved: {len(results)}")
-
-    # Re-ranking
-    
-    # Generation
-    generation_model = init_chat_model(model="gpt-4.1", model_provider="openai")
 
-    context = "\n".join([f"{res.payload.get("page_content", None)}" for res in results])
-    logger.info(f"Context:\n{context}")
+    async def answer(stream: EventStream):
+        if not await client.collection_exists(collection_name=collection_name):
+            await stream.progress("generating")
+            with timed("openai", "chat"):
+                await stream.relay(generation_model.astream(input=query.query))
+            return
+
+        await stream.progress("embedding")
+        query_vector = await embedder.embed_query(query.query)
+        cached_answer = answer_cache.get(query_vector)
+        if cached_answer is not None:
+            logger.info("Answering from the semantic answer cache")
+            await stream.token(cached_answer)
+            return {"cached": True}
+
+        # Search with the query itself while it is expanded
+        await stream.progress("retrieving")
+        expansion = expand_query_cached(query.query, query_vector, query_expansion_model, client, collection_name)
+        fused = await plan_retrieval(client, collection_name, query.query, query_vector, expansion, embedder.embed)
+
+        # Re-ranking
+        passages = build_context(rerank(query.query, fused))
+        logger.info("%s of %s retrieved passages kept for the context", len(passages), len(fused))
+
+        context = "\n".join(passages)
+        logger.debug("Context:\n%s", context)
+
+        # Generation
+        system_prompt =(
+        "You are an assistant for question-answering tasks. you must be polite and helpful. "
+        "Use the following pieces of retrieved context to answer the question. "
+        "If you don't know the answer, just say that you don't know. Use three sentences maximum and keep the answer concise."
+        )
+        prompt_template = ChatPromptTemplate([
+            ("system", system_prompt),
+            ("human", f"Question: {query}"),
+            ("human", f"Context':\n{context}")
+        ])
 
-    # Generation
-    system_prompt =(
-    "You are an assistant for question-answering tasks. you must be polite and helpful. "
-    "Use the following pieces of retrieved context to answer the question. "
-    "If you don't know the answer, just say that you don't know. Use three sentences maximum and keep the answer concise."
-    )
-    prompt_template = ChatPromptTemplate([
-        ("system", system_prompt),
-        ("human", f"Question: {query}"),
-        ("human", f"Context':\n{context}")
-    ])
+        messages = prompt_template.invoke({"query": query.query, "context":context})
 
-    messages = prompt_template.invoke({"query": query.query, "context":context})
-    logger.info("Final messages to the model: {messages}")
+        await stream.progress("generating", passages=len(passages))
+        with timed("openai", "chat"):
+            text = await stream.relay(generation_model.astream(input=messages))
+        # Only reached when the whole answer was streamed
+        answer_cache.put(query_vector, text)
 
-    response = generation_model.astream(
-        input=messages,
-    )
-    
-    if not response:
-        logger.error("No response received from the model.")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to get a response from the AI assistant."
-        )
-    return StreamingResponse(send_completion_events(response), media_type="text/event-stream")
+    return EventStream(answer).response()
 
-@router.post("/file/upload", summary="upload files")
-async def reponse(file: UploadFile = File(...)):
+@router.post("/file/upload", summary="upload files", status_code=status.HTTP_202_ACCEPTED)
+async def upload_document(file: UploadFile = File(...), my_document_indexer: DocumentIndexer = Depends(get_indexer)):
     """
     Endpoint to upload a file into a vectorial database
-    This endpoint accepts a file upload, processes it, and stores the content in a vectorial database.
+    The file is stored and indexed in the background; poll
+    GET /assistant/file/upload/{job_id} for the progress.
     input:
     - file: UploadFile - The file to be processed and stored.
     output:
-    - A JSON response indicating the success of the operation.
+    - The ingestion job (job_id, status, progress).
     """
     if not file.filename:
         raise HTTPException(
@@ -158,22 +146,26 @@ async def reponse(file: UploadFile = File(...)):
             detail="No file provided"
         )
 
-    content  = await file.read()
-
-    my_document_indexer = DocumentIndexer("http://qdrant:6333")
-    logger.info(f"document indexer: {my_document_indexer}")
-
+    path, size = await spool_upload(file)
+    doc_type = os.path.splitext(file.filename)[1].lstrip(".").lower() or "txt"
+    job = ingestion_jobs.submit(
+        my_document_indexer, path, size,
+        file_name=file.filename,
+        doc_type=doc_type,
+        chunk_size=200,
+        # Cached answers were generated without the new document
+        on_done=answer_cache.clear,
+    )
+    logger.info("Queued ingestion job %s for %s (%s bytes)", job.job_id, file.filename, size)
+    return JSONResponse(content=job.to_dict(), status_code=status.HTTP_202_ACCEPTED)
 
-    if not my_document_indexer.vector_store:
 
-        logger.info(f"vectore store does'nt exist")
-        await my_document_indexer.index_in_qdrantdb(
-            content=content,
-            file_name="test",
-            doc_type="md",
-            chunk_size=200
+@router.get("/file/upload/{job_id}", summary="progress of a document upload")
+async def upload_status(job_id: str):
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Unknown ingestion job"
         )
-
-
-        return JSONResponse(content='File processed and stored successfully',status_code=200)
-
+    return job.to_dict()
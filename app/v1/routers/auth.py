@@ -1,11 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException
-from google.auth.transport import requests as grequests
-from google.oauth2 import id_token
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.v1.auth.jwt_utils import create_access_token
+from app.v1.auth.google_certs import google_certs
+from app.v1.auth.hashing import hash_password, check_password
+from app.v1.auth.rate_limit import check_login_rate
+from app.v1.services.workers import io_pool
 
 from app.database.models import User
-from app.database.database import get_db
+from app.database.database import get_async_db
 from app.v1.schemas.schemas import TokenData, SignUpResponse, LoginResponse, LocalSignUp
 from fastapi import status
 from fastapi.responses import JSONResponse
@@ -13,7 +16,6 @@ from fastapi.responses import JSONResponse
 from jose import jwt
 import logging
 import os
-from app.v1.utils import get_password_hash, verify_password 
 
 from pydantic import BaseModel, EmailStr, constr
 import secrets
@@ -23,10 +25,6 @@ import datetime
 from datetime import datetime
 from sqlalchemy.exc import IntegrityError
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
 logger = logging.getLogger("__routers/auth.py__")
 
 
@@ -41,17 +39,13 @@ router = APIRouter(
     responses={404: {"description": "Not found"}}
 )
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(User).filter(User.email == email).first()
+async def get_user_by_email(db: AsyncSession, email: str):
+    return (await db.scalars(select(User).where(User.email == email))).first()
 
 async def verify_google_token(token: TokenData):
-    """ Verify OAuth token with Google."""
+    """ Verify OAuth token with Google (certificates are cached, see GoogleCertCache)."""
     try:
-        id_info = id_token.verify_oauth2_token(
-            token.token,
-            grequests.Request(),
-            GOOGLE_CLIENT_ID
-        )
+        id_info = await io_pool.run(google_certs.verify, token.token, GOOGLE_CLIENT_ID)
         user_id = id_info.get('sub', None)
         email = id_info.get('email', None)
 
@@ -63,58 +57,58 @@ async def verify_google_token(token: TokenData):
             'email': email,
         }
     except ValueError as e:
-        logger.error(f"Google token verification failed: {e}")
+        logger.error("Google token verification failed: %s", e)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid Google token"
         )
-def create_user(id: str, email: str, password:str | None, auth_provider: str, db: Session):
+async def create_user(id: str, email: str, password:str | None, auth_provider: str, db: AsyncSession):
     
-    hash_password = get_password_hash(password) if password else None
+    password_hash = await hash_password(password) if password else None
     
     try: 
         new_user = User(
             id=id,
             email=email,
-            hash_password=hash_password,
+            hash_password=password_hash,
             auth_provider=auth_provider
         )
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        await db.refresh(new_user)
         return new_user
     
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail="User already exists")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.exception("Error creating user")
         raise HTTPException(status_code=500, detail="Internal server error")   
      
 @router.post("/google/signup", response_model=SignUpResponse)
-async def signup(token_data: TokenData, db: Session = Depends(get_db)):
+async def signup(token_data: TokenData, db: AsyncSession = Depends(get_async_db)):
     """ Authenticate user via Google OAuth token."""
     logger.info("Google sign-up request received.")
 
     
     google_user = await verify_google_token(token_data)
-    logger.info(f"User ID: {google_user['user_id']}, Email: {google_user['email']}")
-    existing_user = get_user_by_email(db, google_user['email'])
+    logger.info("User ID: %s, Email: %s", google_user['user_id'], google_user['email'])
+    existing_user = await get_user_by_email(db, google_user['email'])
 
     if existing_user:
-        logger.warning(f"Signup attempted for existing user: {google_user['email']}")
+        logger.warning("Signup attempted for existing user: %s", google_user['email'])
         raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="User already exists. Please login instead."
             )
 
     # If user does not exist, prompt to complete profile
-    logger.info(f"User with ID {google_user['user_id']} not found in the database.")
+    logger.info("User with ID %s not found in the database.", google_user['user_id'])
     
     try:
-        new_user = create_user(id=google_user['user_id'], email=google_user['email'], password=None, auth_provider="google", db=db)
-        logger.info(f"New user created with ID {new_user.id} and email {new_user.email}. password: {new_user.hash_password}")
+        new_user = await create_user(id=google_user['user_id'], email=google_user['email'], password=None, auth_provider="google", db=db)
+        logger.info("New user created with ID %s and email %s.", new_user.id, new_user.email)
         access_token = await create_access_token(google_user)
 
         return {
@@ -133,13 +127,13 @@ async def signup(token_data: TokenData, db: Session = Depends(get_db)):
 
 
 @router.post("/google/login", response_model=LoginResponse)
-async def google_login(token_data: TokenData, db: Session = Depends(get_db)):
+async def google_login(token_data: TokenData, db: AsyncSession = Depends(get_async_db)):
     """Login user with JWT token"""
     
     logger.info("Login request received.")
     try:
         google_user = await verify_google_token(token_data)
-        user = get_user_by_email(db, google_user['email'])
+        user = await get_user_by_email(db, google_user['email'])
         
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
@@ -156,10 +150,10 @@ async def google_login(token_data: TokenData, db: Session = Depends(get_db)):
                 }
             )
 
-        logger.info(f"User {user.email} logged in successfully.")
+        logger.info("User %s logged in successfully.", user.email)
 
         user.last_login = datetime.now()
-        db.commit()
+        await db.commit()
 
         access_token = await create_access_token(google_user)
 
@@ -180,7 +174,7 @@ async def google_login(token_data: TokenData, db: Session = Depends(get_db)):
         }
 
     except jwt.JWTError as e:
-        logger.error(f"JWT error: {e}")
+        logger.error("JWT error: %s", e)
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
@@ -188,13 +182,14 @@ async def google_login(token_data: TokenData, db: Session = Depends(get_db)):
 
 
 @router.post("/signup", response_model=SignUpResponse)
-async def local_signup(data: LocalSignUp, db: Session = Depends(get_db)):
-    if get_user_by_email(db, data.email):
+async def local_signup(data: LocalSignUp, request: Request, db: AsyncSession = Depends(get_async_db)):
+    check_login_rate(request, data.email)
+    if await get_user_by_email(db, data.email):
         return JSONResponse(
             status_code=status.HTTP_409_CONFLICT,
             content={"message": "User already exists"}
         )
-    new_user = create_user(id=uuid.uuid4().hex, email=data.email, password=data.password, auth_provider="local", db=db)
+    new_user = await create_user(id=uuid.uuid4().hex, email=data.email, password=data.password, auth_provider="local", db=db)
     access_token = await create_access_token({"user_id": new_user.id, "email": new_user.email})
 
     # In a real application, send a verification email here
@@ -207,12 +202,14 @@ async def local_signup(data: LocalSignUp, db: Session = Depends(get_db)):
         }
 
 @router.post("/login", response_model=LoginResponse)
-async def local_login(data: LocalSignUp, db: Session = Depends(get_db)):
+async def local_login(data: LocalSignUp, request: Request, db: AsyncSession = Depends(get_async_db)):
     logger.info("Local login request received.")
+    check_login_rate(request, data.email)
 
-    logger.info(f"Login email: {data.email}. login password: {data.password}    ")
-    user = get_user_by_email(db, data.email)
-    if not user or not verify_password(data.password, user.hash_password):
+    logger.info("Login email: %s", data.email)
+    user = await get_user_by_email(db, data.email)
+    valid, updated_hash = await check_password(data.password, user.hash_password) if user else (False, None)
+    if not valid:
         return JSONResponse(
             status_code=status.HTTP_401_UNAUTHORIZED,
             content={"message": "Invalid email or password"}
@@ -223,12 +220,14 @@ async def local_login(data: LocalSignUp, db: Session = Depends(get_db)):
             content={"message": "Profile incomplete. Please complete your profile."}
         )
     
-    logger.info(f"User {user.email} logged in successfully.")
+    logger.info("User %s logged in successfully.", user.email)
     try:
         user.last_login = datetime.now()
-        db.commit()
+        if updated_hash:
+            user.hash_password = updated_hash  # hashed with older argon2 parameters
+        await db.commit()
     except ValueError as e:
-        logger.error(f"Error updating last login: {e}")
+        logger.error("Error updating last login: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
     payload = {
@@ -1,27 +1,27 @@
 from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from app.v1.utils import parse_xls, to_float_or_none
+from app.v1.services.sheet_sync import enqueue_writes, sheet_sync
+from app.v1.services.ownership import RequestOwnership, get_ownership
 
 from app.v1.schemas.schemas import WorkbookParseResponse, FileUploadResponse, BulkGradeUpdate
 from app.v1.auth.dependencies import get_current_user
-from app.database.database import get_db
+from app.database.database import get_async_db
 from app.database.models import UploadedFile, User, Classroom, Student
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 from pydantic import BaseModel
 import logging
 import xlrd
-from xlutils.copy import copy
+import json
 import os
 
 
 
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
-logger = logging.getLogger("__routers/me.py__")
+logger = logging.getLogger("__routers/classrooms.py__")
 
 router = APIRouter(
     prefix="/me",
@@ -29,6 +29,106 @@ router = APIRouter(
     responses={404: {"description": "Not found"}}
 )
 
+STREAM_BATCH_SIZE = 500  # rows fetched per round trip when streaming
+
+
+
+CLASSROOM_LISTING_COLUMNS = (
+    Classroom.classroom_id,
+    Classroom.file_id,
+    Classroom.sheet_name,
+    Classroom.number_of_students,
+    Student.student_id,
+    Student.row,
+    Student.last_name,
+    Student.first_name,
+    Student.date_birth,
+    Student.evaluation,
+    Student.first_assignment,
+    Student.final_exam,
+    Student.observation,
+)
+
+
+def query_classroom_rows(user_id: str):
+    """
+    One query for every (classroom, student) pair of the user's file, ordered so
+    that the students of a classroom are consecutive.
+    """
+    return (
+        select(*CLASSROOM_LISTING_COLUMNS)
+        .join(UploadedFile, UploadedFile.file_id == Classroom.file_id)
+        .outerjoin(Student, Student.classroom_id == Classroom.classroom_id)
+        .where(UploadedFile.user_id == user_id)
+        .order_by(Classroom.sheet_name, Classroom.classroom_id, Student.row)
+    )
+
+
+def _classroom_info(row) -> dict:
+    return {
+        "classroom": {
+            "classroom_id": row.classroom_id,
+            "name": row.file_id,
+            "sheet_name": row.sheet_name,
+            "number_of_students": row.number_of_students,
+            "students": [],
+        },
+    }
+
+
+def _student_info(row) -> dict:
+    return {
+        "student_id": row.student_id,
+        "row": row.row,
+        "classroom_id": row.classroom_id,
+        "last_name": row.last_name,
+        "first_name": row.first_name,
+        "date_of_birth": row.date_birth,
+        "evaluation": row.evaluation,
+        "first_assignment": row.first_assignment,
+        "final_exam": row.final_exam,
+        "observation": row.observation,
+    }
+
+
+def group_classroom_rows(rows):
+    """ Assemble ordered (classroom, student) rows into classroom objects, yielding each one as soon as it is complete."""
+    classroom_info = None
+    for row in rows:
+        if classroom_info is None or classroom_info["classroom"]["classroom_id"] != row.classroom_id:
+            if classroom_info is not None:
+                yield classroom_info
+            classroom_info = _classroom_info(row)
+        if row.row is not None:  # classroom without students (outer join)
+            classroom_info["classroom"]["students"].append(_student_info(row))
+    if classroom_info is not None:
+        yield classroom_info
+
+
+async def agroup_classroom_rows(rows):
+    """ Same as group_classroom_rows, for an async result stream."""
+    classroom_info = None
+    async for row in rows:
+        if classroom_info is None or classroom_info["classroom"]["classroom_id"] != row.classroom_id:
+            if classroom_info is not None:
+                yield classroom_info
+            classroom_info = _classroom_info(row)
+        if row.row is not None:
+            classroom_info["classroom"]["students"].append(_student_info(row))
+    if classroom_info is not None:
+        yield classroom_info
+
+
+async def stream_classrooms(bind, user_id: str):
+    """ Stream the classrooms as a JSON array. Uses its own session since it outlives the request handler."""
+    async with AsyncSession(bind=bind) as db:
+        rows = await db.stream(query_classroom_rows(user_id).execution_options(yield_per=STREAM_BATCH_SIZE))
+        yield "["
+        i = 0
+        async for classroom_info in agroup_classroom_rows(rows):
+            yield ("," if i else "") + json.dumps(jsonable_encoder(classroom_info), ensure_ascii=False)
+            i += 1
+        yield "]"
 
 
 # ===============================
@@ -36,91 +136,36 @@ router = APIRouter(
 # ===============================
 @router.get("/classrooms", summary="returns the list of all the user's classrooms")
 async def get_all_classrooms(
-                            db:Session = Depends(get_db),
-                            current_user: str = Depends(get_current_user)
+                            stream: bool = False,
+                            db:AsyncSession = Depends(get_async_db),
+                            current_user: str = Depends(get_current_user),
+                            owner: RequestOwnership = Depends(get_ownership),
                             ):
     """
     Endpoint to list all the user's classrooms.
+    With `stream=true` the classrooms are sent one by one as they are assembled.
     """
-    file = db.query(UploadedFile).filter(UploadedFile.user_id==current_user).first()
-    if file is None:
-        raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail= "No existing file. please upload file first"
-            )
-    
-    classrooms  = db.query(Classroom).filter(Classroom.file_id==file.file_id).all()
-    students    = db.query(Student).filter(Student.classroom_id.in_([c.classroom_id for c in classrooms])).all()
-
-    # Prepare the result
-    result = []
-
-    for classroom in classrooms:
-        # Get students in this classroom
-        students = db.query(Student).filter(Student.classroom_id == classroom.classroom_id).all()
-
-
-        # classroom_id = Column(Integer, primary_key=True,index=True) 
-        # file_id = Column(UUID(as_uuid=True), ForeignKey(UploadedFile.file_id, ondelete="CASCADE"), nullable=False)
-        # sheet_name = Column(String, nullable=False)
-        # number_of_students = Column(Integer,nullable=False)
-
-
-        # student_id = Column(String, primary_key=True)
-        # classroom_id = Column(String, ForeignKey(Classroom.classroom_id, ondelete="CASCADE"), nullable=False)
-        # row = Column(Integer, nullable=False)
-        # last_name = Column(String, nullable=False)
-        # first_name = Column(String, nullable=False)
-        # date_birth = Column(String, nullable=False)
-        # evaluation = Column(Float)
-        # first_assignment = Column(Float)
-        # final_exam = Column(Float)
-        # observation = Column(String)
-
-        # Convert classroom and students to dictionaries
-        classroom_info = {
-            "classroom": {
-                "classroom_id": classroom.classroom_id,
-                "name": classroom.file_id,
-                "sheet_name": classroom.sheet_name,  # add other fields you want
-                "number_of_students": classroom.number_of_students,
-                "students": [
-                {
-                    "student_id": s.student_id,
-                    "row": s.row,
-                    "classroom_id": s.classroom_id,
-                    "last_name": s.last_name,
-                    "first_name": s.first_name,
-                    "date_of_birth": s.date_birth,
-                    "evaluation": s.evaluation,
-                    "first_assignment": s.first_assignment,
-                    "final_exam": s.final_exam,
-                    "observation": s.observation,
-                } for s in students
-            ]
-            },
-        }
-        result.append(classroom_info)
-
-    logger.info(f'Returning data for {len(classrooms)} classrooms')
-    logger.info(f'Found {len(classrooms)} classrooms for user {current_user}')
+    if stream:
+        await owner.file()
+        return StreamingResponse(stream_classrooms(db.bind, current_user), media_type="application/json")
+
+    result = list(group_classroom_rows(await db.execute(query_classroom_rows(current_user))))
+
+    if not result:
+        # Only resolve the ownership when there is nothing to return
+        await owner.file()
+
+    logger.info('Found %s classrooms for user %s', len(result), current_user)
     return result
 
 @router.get("/classrooms/{classroom_id}", summary="returns a specific classroom")
-async def get_classroom(classroom_id:str, db:Session = Depends(get_db), current_user: str = Depends(get_current_user)):
+async def get_classroom(classroom_id:str, db:AsyncSession = Depends(get_async_db), owner: RequestOwnership = Depends(get_ownership)):
     """
     Endpoint to get specific classroom
     """
-    file = db.query(UploadedFile).filter(UploadedFile.user_id==current_user).first()
-    if file is None:
-        raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail= "No existing file. please upload file first"
-            )
-    # logger.info(f"file {file}")
-
+    ownership = await owner.classroom(classroom_id)
 
-    classroom = db.query(Classroom).filter(Classroom.file_id==file.file_id, Classroom.classroom_id == classroom_id ).all()
+    classroom = (await db.scalars(select(Classroom).where(Classroom.file_id==ownership.file_id, Classroom.classroom_id == classroom_id ))).all()
     if not classroom:
         raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -131,16 +176,21 @@ async def get_classroom(classroom_id:str, db:Session = Depends(get_db), current_
 
 
 @router.put("/classrooms/{classroom_id}/grades",summary="bulk update")
-async def grade_classroom(classroom_id, grades:BulkGradeUpdate, db: Session = Depends(get_db), current: str = Depends(get_current_user)):
+async def grade_classroom(classroom_id, grades:BulkGradeUpdate, db: AsyncSession = Depends(get_async_db), current: str = Depends(get_current_user),
+                          owner: RequestOwnership = Depends(get_ownership)):
     """
     Endpoint to update the grades of all the students in a specific classroom"""
 
-    logger.info(f"Updating grades for classroom '{classroom_id}' by user '{current}'")
+    logger.info("Updating grades for classroom '%s' by user '%s'", classroom_id, current)
     try:
         grade_updates = {update.student_id: update for update in grades.classroom_grades}
 
-        students = db.query(Student).filter_by(classroom_id=classroom_id).all()
-        logger.info(f"Fetched {len(students)} students from the database for classroom '{classroom_id}'")
+        # The file of the current user, and the sheet of the classroom in it (not from the cache: we write to it)
+        ownership = await owner.classroom(classroom_id, fresh=True)
+        sheet_name = ownership.classrooms[classroom_id]
+
+        students = (await db.scalars(select(Student).filter_by(classroom_id=classroom_id))).all()
+        logger.info("Fetched %s students from the database for classroom '%s'", len(students), classroom_id)
 
         if len(students) == 0:
             raise HTTPException(
@@ -150,6 +200,7 @@ async def grade_classroom(classroom_id, grades:BulkGradeUpdate, db: Session = De
             
 
         updated_students = []
+        cells = []  # (row, col, value) to write back into the workbook
         for student in students:
             if student.student_id in grade_updates:
                 grades_update = grade_updates[student.student_id]
@@ -158,86 +209,31 @@ async def grade_classroom(classroom_id, grades:BulkGradeUpdate, db: Session = De
                 student.first_assignment = grades_update.new_first_assignment
                 student.final_exam = grades_update.new_final_exam
                 student.observation = grades_update.new_observation
+                cells.extend([
+                    (student.row, 4, grades_update.new_evaluation),
+                    (student.row, 5, grades_update.new_first_assignment),
+                    (student.row, 6, grades_update.new_final_exam),
+                    (student.row, 7, grades_update.new_observation),
+                ])
             
-            updated_students.append(student)
-            logger.info(f'Updated grades for student {student.student_id}')
-
-            
-        db.commit()
-        logger.info(f"Committed updates to the database for {len(updated_students)} students")  
-
-        # Get the storage path of the file associated with the current user 
-        
-        file = db.query(UploadedFile).filter_by(user_id=current).one_or_none()
-        logger.info(f"File associated with the current user {current} is {file}")
-
-        if not file:
-            raise HTTPException(status_code=404, detail="No file has been found")
-        
-        storage_path = file.storage_path
-        logger.info(f"Storage path of the file associated with the current user {current} is {storage_path}")
-
-        if not storage_path:
-            raise HTTPException(status_code=404, detail="No file has been found")
-        
-        if not os.path.exists(storage_path):
-            raise HTTPException(status_code=404, detail="The file associated with this user does not exist on the sotrage disk")
-        
-        # Open the file
-        try:
-            workbook = xlrd.open_workbook(storage_path, ignore_workbook_corruption=True, formatting_info=True)
-            logger.info(f"Opened workbook at {storage_path} successfully")
-        except Exception as e:
-            logger.error(f"Error opening workbook at {storage_path}: {e}")
-            raise HTTPException(status_code=500, detail="Failed to open the Excel file")
-        
-        # Create a writable copy of the workbook
-        
-        try: 
-            workbook_copy = copy(workbook)
-            logger.info(f"Created writable copy of the workbook successfully")
-        except Exception as e:
-            logger.error(f"Error creating writable copy of the workbook: {e}")
-            raise HTTPException(status_code=500, detail="Failed to create a writable copy of the Excel file")
-
-        try:
-            classroom = db.query(Classroom).filter_by(classroom_id=classroom_id).one_or_none()
-            logger.info(f"Fetched classroom {classroom_id} from the database")
-        except SQLAlchemyError as e:
-            logger.error(f"Database error fetching classroom {classroom_id}: {e}")
-            raise HTTPException(status_code=500, detail="Database error occurred")
-
-        if not classroom:
-            raise HTTPException(status_code=404, detail=f"No classroom with id {classroom_id} found")
-        
-        
-
-        logger.info(f"Accessing sheet {classroom.sheet_name} in the workbook")
-        sheet_wt = workbook_copy.get_sheet(classroom.sheet_name)
-
-        students = db.query(Student).filter_by(classroom_id=classroom_id).all()
-        
-        # Insert grades into the specified rows/columns
-        for student in students:
-            if student.student_id in grade_updates:
-                grades_update = grade_updates[student.student_id]
-                logger.info(f"Updating student {student.student_id} in row {student.row}")
-                sheet_wt.write(student.row, 4, grades_update.new_evaluation)
-                sheet_wt.write(student.row, 5, grades_update.new_first_assignment)
-                sheet_wt.write(student.row, 6, grades_update.new_final_exam)
-                sheet_wt.write(student.row, 7, grades_update.new_observation)
-        
-        # Save the updated workbook
-        workbook_copy.save(storage_path)
-        logger.info(f"Saved updated workbook to {storage_path} successfully")
+            updated_students.append({"student_id": student.student_id, "last_name": student.last_name, "name": student.first_name})
+            logger.debug('Updated grades for student %s', student.student_id)
 
+        # The XLS file is updated by the sheet sync worker once this commits
+        enqueue_writes(db, ownership.file_id, sheet_name, cells)
+        await db.commit()
+        sheet_sync.wake()
+        logger.info("Committed updates to the database for %s students", len(updated_students))  
 
         return {
             "message": f"Updated grades for {len(updated_students)} students",
-            "updated_students": [{"student_id": s.student_id,"last_name":s.last_name, "name": s.first_name} for s in updated_students]
+            "updated_students": updated_students
                 }
+    except HTTPException:
+        await db.rollback()
+        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to update grades"
@@ -245,11 +241,10 @@ async def grade_classroom(classroom_id, grades:BulkGradeUpdate, db: Session = De
 
 
 @router.get("/classrooms/{classroom_id}/students", summary="returns the list all the students in a specific classroom")
-async def get_all_classrooms(classroom_id: int, db:Session = Depends(get_db), current_user: str = Depends(get_current_user)):
+async def get_all_classrooms(classroom_id: str, db:AsyncSession = Depends(get_async_db), owner: RequestOwnership = Depends(get_ownership)):
     """
     Endpoint to list all in a specific classroom
     """
-    file = db.query(UploadedFile).filter(UploadedFile.user_id==current_user).first()
-    classroom = db.query(Classroom).filter(Classroom.file_id==file.file_id, Classroom.classroom_id == classroom_id).first()
-    students = db.query(Student).filter(Student.classroom_id == classroom.classroom_id).all()
+    await owner.classroom(classroom_id)
+    students = (await db.scalars(select(Student).where(Student.classroom_id == classroom_id))).all()
     return students
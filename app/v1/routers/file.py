@@ -1,12 +1,19 @@
 from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, status
 from fastapi.responses import JSONResponse, FileResponse
-from app.v1.utils import parse_xls, to_float_or_none
+from app.v1.utils import parse_xls, to_float_or_none, write_file
+from app.v1.services.workers import cpu_pool, io_pool
+from app.v1.services.bulk_ingest import populate_database
+from app.v1.services.xls_writer import workbook_writer
+from app.v1.services.sheet_sync import sheet_sync
+from app.v1.services.ownership import RequestOwnership, get_ownership, ownership_cache
+from app.v1.telemetry import timed
 
 from app.v1.schemas.schemas import WorkbookParseResponse, FileUploadResponse, BulkGradeUpdate
 from app.v1.auth.dependencies import get_current_user
-from app.database.database import get_db
+from app.database.database import get_async_db
 from app.database.models import UploadedFile, User, Classroom, Student
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 from pydantic import BaseModel
 import logging
@@ -16,11 +23,7 @@ import os
 print("=== FILE.PY LOADED ===")
 
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
-logger = logging.getLogger("__routers/me.py__")
+logger = logging.getLogger("__routers/file.py__")
 
 router = APIRouter(
     prefix="/me",
@@ -38,15 +41,16 @@ ALLOWED_FILE_EXTENSIONS = ['.xls', '.xlsx']
 @router.post("/file", summary="upload an XLS file",response_model=FileUploadResponse)
 async def upload_file(
                     file: UploadFile = File(...),
-                    db: Session = Depends(get_db),
-                    current_user: str = Depends(get_current_user)
+                    db: AsyncSession = Depends(get_async_db),
+                    current_user: str = Depends(get_current_user),
+                    owner: RequestOwnership = Depends(get_ownership),
                     ):
     """Endpoint to upload an XLS file with proper validation and error handling."""
 
-    logger.info(f"File upload request from user: {current_user}")
-    existing_user = db.query(User).filter_by(id=current_user).one_or_none()
+    logger.info("File upload request from user: %s", current_user)
+    existing_user = await db.get(User, current_user)
     if not existing_user:
-        logger.error(f"User: {current_user} not found in database")
+        logger.error("User: %s not found in database", current_user)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not registred. Please register first"
@@ -78,9 +82,9 @@ async def upload_file(
                 detail=f"Empty file is provided")
 
         # Check if user already has a file
-        existing_file = db.query(UploadedFile).filter_by(user_id=current_user).one_or_none()
-        if existing_file:
-            logging.warning(f'User {current_user} already has a file {existing_file.file_name}')
+        existing_file = await owner.get(fresh=True)
+        if existing_file.file_id is not None:
+            logging.warning('User %s already has a file %s', current_user, existing_file.file_name)
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail="User already has a file. Delete the existing filefirst"
@@ -90,7 +94,10 @@ async def upload_file(
 
         # Parse XLS file
         try:    
-            data = parse_xls(content)
+            with timed("xls", "parse"):
+                data = await cpu_pool.run(parse_xls, content)
+        except HTTPException:
+            raise
         except Exception as parse_error:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -99,17 +106,14 @@ async def upload_file(
         
         # Check the mismatch of academic level
         level_from_file =  data.get('classrooms')[0].get("level")
-        user = db.query(User).filter_by(id=current_user).first()
+        user = existing_user
         level_from_user = user.academic_level.value
 
-        logger.info(f"Level from file: {level_from_file}")
-        logger.info(f"Level from user: {level_from_user}")
-
-        logger.info(f"{'متوسط' in level_from_file}")
-        logger.info(f"{level_from_user == 'secondary'}")
+        logger.info("Level from file: %s", level_from_file)
+        logger.info("Level from user: %s", level_from_user)
 
         if ("متوسط" not in level_from_file or level_from_user != "secondary"):
-            logger.error(f"Academic level mismatch: {level_from_file} vs {level_from_user}")
+            logger.error("Academic level mismatch: %s vs %s", level_from_file, level_from_user)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Academic level mismatch: the level from the file:{level_from_file} vs the level provided by the user:{level_from_user}"
@@ -122,34 +126,33 @@ async def upload_file(
             )
             # Generate and set storage path
             uploaded_file.storage_path = uploaded_file.generate_storage_path()
-            logger.info(f"Generated storage path: {uploaded_file.storage_path}")
-            logger.info(f'uploaded_file instance {uploaded_file}')
+            logger.info("Generated storage path: %s", uploaded_file.storage_path)
+            logger.debug('uploaded_file instance %s', uploaded_file)
         
             db.add(uploaded_file)
-            db.flush() # Get the file_id
-            populate_database(db, uploaded_file.file_id, data)    
-            db.commit()
-            logger.info(f"Successfully processed file: {file.filename} for user: {current_user}")          
+            await db.flush() # Get the file_id
+            await db.run_sync(populate_database, uploaded_file.file_id, data)
+            await db.commit()
+            ownership_cache.invalidate(current_user)
+            logger.info("Successfully processed file: %s for user: %s", file.filename, current_user)          
 
             try:
-                # Ensure directory exists
-                storage_dir = os.path.dirname(uploaded_file.storage_path)
-                os.makedirs(storage_dir, exist_ok=True)
+                # Save the file (creates the directory if needed)
+                await io_pool.run(write_file, uploaded_file.storage_path, content)
+                workbook_writer.invalidate(uploaded_file.storage_path)
 
-                # Save the file
-                with open(uploaded_file.storage_path, 'wb') as f:
-                    f.write(content)
-
-                logger.info(f"File saved successfully at {uploaded_file.storage_path}")
+                logger.info("File saved successfully at %s", uploaded_file.storage_path)
 
+            except HTTPException:
+                raise
             except OSError as e:
                 # Handles filesystem errors: permission denied, disk full, etc.
-                logger.error(f"Failed to save file at {uploaded_file.storage_path}: {e}")
+                logger.error("Failed to save file at %s: %s", uploaded_file.storage_path, e)
                 raise RuntimeError(f"Could not save file: {e}") from e
 
             except Exception as e:
                 # Catch any other unexpected errors
-                logger.error(f"Unexpected error while saving file: {e}")
+                logger.error("Unexpected error while saving file: %s", e)
                 raise RuntimeError(f"Unexpected error: {e}") from e
         
             return JSONResponse(
@@ -161,8 +164,8 @@ async def upload_file(
                 })
     
         except SQLAlchemyError as db_error:
-            db.rollback()
-            logger.error(f"Database error: {str(db_error)}")
+            await db.rollback()
+            logger.error("Database error: %s", db_error)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Database error occured while saving file")
@@ -170,166 +173,75 @@ async def upload_file(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Unexpected error processing file: {str(e)}")
+        logger.error("Unexpected error processing file: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An unexpected error occurred while processing the file"
         )
 
-def populate_database(db: Session, file_id:str , data:dict) -> None:
-    """
-    Populate database with parsed XLS data.
-    """
-    classrooms: list = data.get('classrooms', [])
-
-    if not classrooms:
-        logger.warning(f'No classrooms found in parsed data')
-        return 
-    # 
-    #
-    #
-    #
-    # THE CLASSROOM MODEL
-    # ===============================
-    # class Classroom(Base):
-    # __tablename__ = "classrooms"
-
-    # classroom_id = Column(Integer, primary_key=True,index=True) 
-    # file_id = Column(UUID(as_uuid=True), ForeignKey(UploadedFile.file_id, ondelete="CASCADE"), nullable=False)
-    # sheet_name = Column(String, nullable=False)
-    # number_of_students = Column(Integer,nullable=False)
-
-    # students = relationship(
-    #    "Student",
-    #    back_populates="classroom",
-    #    cascade="all, delete-orphan",
-    #    passive_deletes=True
-    #)
-    # file = relationship("UploadedFile", back_populates="classrooms")
-
-    #  WHAT I WANT TO ADD ARE THE FOLLOWING FIELDS
-        # "school_name": "متوسطة مرزقان محمد المدعو معمر (قصر الصباحي)",
-        # "term": "الأول",
-        # "year": "2020-2021",
-        # "level": "أولى  متوسط    1",
-        # "subject": "المعلوماتية",
-        # "classroom_name": "Sheet-0",
-        # "sheet_name": "2100001_1",
-
-
-    for classroom in classrooms:
-        try:
-        # Create classroom
-            new_classroom = Classroom(
-                file_id=file_id,
-                school_name=classroom.get("school_name", "Unknown"),
-                term=classroom.get("term", "Unknown"),
-                year=classroom.get("year", "Unknown"),
-                level=classroom.get("level", "Unknown"),
-                subject=classroom.get("subject", "Unknown"),
-                classroom_name=classroom.get("classroom_name", "Unknown"),
-                sheet_name=classroom.get("sheet_name", "Unknown"),
-                number_of_students=classroom.get("number_of_students", 0),
-
-            )
-            
-            db.add(new_classroom)
-            db.flush()
-
-            # Add students
-            students = classroom.get('students', [])
-            for student in students:
-
-                new_student = Student(
-                    student_id = student['id'],
-                    classroom_id = new_classroom.classroom_id,
-                    row = student['row'],
-                    last_name = student['last_name'],
-                    first_name = student['first_name'],
-                    date_birth = student['date_of_birth'],
-                    # i want to group evaluation and f assign + final exam + observation in one cluster grades : {field:value, field:value, ....}
-                    evaluation = to_float_or_none(student['evaluation']),
-                    first_assignment = to_float_or_none(student['first_assignment']),
-                    final_exam = to_float_or_none(student['final_exam']),
-                    observation = to_float_or_none(student['observation']),
-                )
-                db.add(new_student)
-        except Exception as e:
-            logger.error(f"Error processing classroom {classroom.get('sheet_name', 'Unknown')}: {str(e)}")
-    
-    logger.info(f"Successfully processed {len(classrooms)} classrooms")
-
-
 @router.delete("/file", summary="deletes the uploaded file",) #response_model=WorkbookParseResponse)
-async def delete_file(db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
+async def delete_file(db: AsyncSession = Depends(get_async_db), current_user: str = Depends(get_current_user),
+                      owner: RequestOwnership = Depends(get_ownership)):
     """
     Endpoint to delete the XLS uploaded file.
     """
-    object_file = db.query(UploadedFile).filter_by(user_id = current_user).first()
-
-    if not object_file:
-        raise HTTPException(status_code=404, detail="No file has been found")
+    ownership = await owner.file(fresh=True)
 
      # Delete related classrooms and students
      # The cascade="all, delete-orphan" in the relationship should handle this automatically,
      # but we'll do it explicitly for clarity.
      # Also, we need to delete the physical file from storage if applicable.
     
-    logger.info(f"Deleting file {object_file.file_id}")
-    classrooms = db.query(Classroom).filter_by(file_id=object_file.file_id).all()
-
-    for classroom in classrooms:
-        db.query(Student).filter_by(classroom_id=classroom.classroom_id).delete()
-        db.delete(classroom)
-
-    db.delete(object_file)
-
-    db.commit()
+    logger.info("Deleting file %s", ownership.file_id)
+    await db.execute(delete(Student).where(Student.classroom_id.in_(ownership.classroom_ids)))
+    await db.execute(delete(Classroom).where(Classroom.file_id == ownership.file_id))
+    await db.execute(delete(UploadedFile).where(UploadedFile.file_id == ownership.file_id))
+
+    await db.commit()
+    ownership_cache.invalidate(current_user)
+    workbook_writer.invalidate(ownership.storage_path)
     logger.info("The file and all related classrooms and students have been deleted")
 
     return {
             "message": "success",
             "details": "The XLS file and all related data have been deleted",
-            "file_id": str(object_file.file_id)
+            "file_id": str(ownership.file_id)
             }
     
     raise HTTPException(status_code=404, detail="No file has been found")
 
 
 @router.get("/file", summary="returns the uploaded file")
-async def get_file(db:Session = Depends(get_db), current_user: str = Depends(get_current_user)):
+async def get_file(db:AsyncSession = Depends(get_async_db), current_user: str = Depends(get_current_user),
+                   owner: RequestOwnership = Depends(get_ownership)):
     """
     Endpoint to get the filename if it exists from the data base
     """
     
     try:
-        user = db.query(User).filter(User.id == current_user).first()
+        user = await db.get(User, current_user)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail= "No existing user"
             )
-        if not user.file:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail= "No existing file. please upload file first"
-            ) 
+        user_file = await owner.file()
 
-        logger.debug(f'User: {user.file}')
+        logger.debug('User: %s', user_file)
 
         return {
             "message":"success",
             "user_name":user.first_name,
             "user_id":user.id,
             "file_info":{
-                "file_id":user.file.file_id,
-                "file_name":user.file.file_name
+                "file_id":user_file.file_id,
+                "file_name":user_file.file_name
                 }
             }
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error retrieving file info: {str(e)}")
+        logger.error("Error retrieving file info: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error retrieving file information"
@@ -338,17 +250,35 @@ async def get_file(db:Session = Depends(get_db), current_user: str = Depends(get
 
 
 @router.get('/file/download', summary="download the uploaded file")
-async def download_file(db:Session = Depends(get_db), current_user: str = Depends(get_current_user)):
+async def download_file(db:AsyncSession = Depends(get_async_db), owner: RequestOwnership = Depends(get_ownership)):
     """
     Endpoint to download the XLS uploaded file.
+    The X-Sheet-Sync header tells whether it holds every grade committed so far:
+    "ok", "stale" (pending writes could not be applied yet) or "failed-writes"
+    (some writes were given up on, listed by /status/sync).
     """
-    file = db.query(UploadedFile).filter_by(user_id = current_user).one_or_none()
-    if not file:
-        raise HTTPException(status_code=404, detail="No file has been found")
+    file = await owner.file()
+
+    # Make sure the grades committed so far are in the file
+    sync_state = "ok"
+    try:
+        await sheet_sync.flush_file(file.file_id, bind=db.bind)
+    except Exception as e:
+        logger.error("Failed to flush pending writes before download: %s", e)
+        sync_state = "stale"
+    if sync_state == "ok" and await sheet_sync.dead_letters(db, file.file_id):
+        sync_state = "failed-writes"
+
+    if not os.path.exists(file.storage_path):
+        logger.error("The file %s of %s is missing from storage", file.storage_path, file.file_id)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="The uploaded file is missing from storage"
+        )
+    logger.info("The file path is %s", file.storage_path)
 
-    logger.info(f"The file path is {file.storage_path}")
-    
     return FileResponse(path=file.storage_path,
                         filename=os.path.basename(file.storage_path),
-                        media_type="application/xls"
+                        media_type="application/xls",
+                        headers={"X-Sheet-Sync": sync_state},
                         )
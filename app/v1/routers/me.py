@@ -1,13 +1,15 @@
-from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, status
+from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, Request, status
 from fastapi.responses import JSONResponse
 
 from app.v1.utils import parse_xls, to_float_or_none
 from app.v1.schemas.schemas import WorkbookParseResponse, FileUploadResponse, BulkGradeUpdate
-from app.v1.auth.dependencies import get_current_user
+from app.v1.auth.dependencies import get_current_user, revoke_current_token
+from app.v1.services.ownership import RequestOwnership, get_ownership
 
-from app.database.database import get_db
+from app.database.database import get_async_db
 from app.database.models import UploadedFile, User, Classroom, Student
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 from pydantic import BaseModel
 import logging
@@ -16,10 +18,6 @@ import xlrd
 
 print("=== ME.PY FILE LOADED ===")
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
 logger = logging.getLogger("__routers/me.py__")
 
 router = APIRouter(
@@ -34,14 +32,14 @@ router = APIRouter(
 # 👤 USER PROFILE ENDPOINTS
 # ===============================
 @router.get("/profile",summary="return the current user profile")
-async def get_current_user_profile(db: Session = Depends(get_db), current_user=Depends(get_current_user)):
+async def get_current_user_profile(db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_user)):
 
     """ Endpoint to get the current user's profile."""
     
-    logger.info(f"Fetching profile for user ID: {current_user}")
-    user = db.query(User).filter(User.id == current_user).first()
+    logger.info("Fetching profile for user ID: %s", current_user)
+    user = await db.get(User, current_user)
     if not user:
-        logger.error(f"User with ID {current_user} not found.")
+        logger.error("User with ID %s not found.", current_user)
         raise HTTPException(status_code=404, detail="User not found")
 
 
@@ -64,15 +62,13 @@ async def get_current_user_profile(db: Session = Depends(get_db), current_user=D
 # 🔐 AUTHENTICATION ENDPOINTS
 # ===============================
 @router.post("/logout", summary="signs out current user")
-async def signout_user(data, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
-    """ Endpoint to sign out the current user."""
+async def signout_user(data, request: Request, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_user)):
+    """ Endpoint to sign out the current user: the token used is revoked."""
     
-    logger.info(f"Signing out user ID: {current_user}")
-    logger.info(f"Data received for sign out: {data}")
-
-    # Here you would typically invalidate the user's session or JWT token.
-    # Since this is a stateless API, we just return a success message.
+    logger.info("Signing out user ID: %s", current_user)
+    logger.debug("Data received for sign out: %s", data)
 
+    await revoke_current_token(request)
 
     return JSONResponse(
         content={"message": "User signed out successfully"},
@@ -87,41 +83,30 @@ async def signout_user(data, db: Session = Depends(get_db), current_user=Depends
 async def update_grade(
                 student_id:str,
                 grades: BulkGradeUpdate,
-                db: Session = Depends(get_db),
-                current_user=Depends(get_current_user)
+                db: AsyncSession = Depends(get_async_db),
+                current_user=Depends(get_current_user),
+                owner: RequestOwnership = Depends(get_ownership),
                 ):
     """ Endpoint to update the student's grade."""
 
     try:
-        logger.info(f"Current user ID: {current_user}")
-        logger.info(f"Student id: {student_id}")
-        logger.info(f"New student's grades: {grades}")
-
-        user = db.query(User).filter_by(id=current_user).first()
-
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
-        
-        logger.info(f'User found: {user}')
-        file = db.query(UploadedFile).filter(UploadedFile.user_id == current_user).first()
+        logger.info("Current user ID: %s", current_user)
+        logger.info("Student id: %s", student_id)
+        logger.debug("New student's grades: %s", grades)
 
-        if not file:
-                raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
-        logger.info(f'File found: {file}')
+        ownership = await owner.file(fresh=True)
+        logger.info('File found: %s', ownership.file_id)
         
-        student = db.query(Student).filter_by(id=student_id).first()
+        student = (await db.scalars(select(Student).where(
+            Student.id == student_id,
+            Student.classroom_id.in_(ownership.classroom_ids),
+        ))).first()
         if not student:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Student not found"
             )
-        logger.info(f'Student found: {student}')
+        logger.debug('Student found: %s', student)
 
         # class StudentGradeUpdate(BaseModel):
         # id: str = Field(..., description="Database student record ID")
@@ -132,42 +117,47 @@ async def update_grade(
         # new_observation: str  = Field(description="Teacher observation/notes")
 
 
-        logger.info(f"grades: {grades.classroom_grades[0].new_evaluation}, {grades.classroom_grades[0].new_first_assignment}, {grades.classroom_grades[0].new_final_exam}, {grades.classroom_grades[0].new_observation}")
+        logger.debug("grades: %s, %s, %s, %s", grades.classroom_grades[0].new_evaluation, grades.classroom_grades[0].new_first_assignment, grades.classroom_grades[0].new_final_exam, grades.classroom_grades[0].new_observation)
 
         student.grades = grades.classroom_grades[0].new_evaluation
         student.first_assignment = grades.classroom_grades[0].new_first_assignment
         student.final_exam = grades.classroom_grades[0].new_final_exam
         student.observation = grades.classroom_grades[0].new_observation
 
-        logger.info(f'{student}')
+        logger.debug('%s', student)
         
 
         # Commit the change
-        db.commit()
-        db.refresh(student)
+        await db.commit()
+        await db.refresh(student)
 
         return {"message": "Grade updated successfully", "student_id": student_id, "new_grade": grades}
     
     except Exception as e:
-        logger.error(f"Error updating grade: {e}")
+        logger.error("Error updating grade: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
     
 
 @router.get("/students/{student_id}", summary="returns a specific student")
-async def get_all_classrooms(student_id, db:Session = Depends(get_db), current_user: str = Depends(get_current_user)):
+async def get_all_classrooms(student_id, db:AsyncSession = Depends(get_async_db), current_user: str = Depends(get_current_user),
+                             owner: RequestOwnership = Depends(get_ownership)):
     """
     Endpoint to get specific student
     """
 
-    logger.info(f"Current user ID: {current_user}")
-    logger.info(f"Student id: {student_id}")
+    logger.info("Current user ID: %s", current_user)
+    logger.info("Student id: %s", student_id)
 
-    student = db.query(Student).filter(Student.id==student_id).first()
+    ownership = await owner.file()
+    student = (await db.scalars(select(Student).where(
+        Student.id==student_id,
+        Student.classroom_id.in_(ownership.classroom_ids),
+    ))).first()
     if not student:
         raise HTTPException(status_code=404, detail="No student was found for this user")
     
 
-    logger.info(f"Student found: {student}")
+    logger.debug("Student found: %s", student)
 
     return student
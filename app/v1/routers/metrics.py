@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+from app.v1.metrics import EXPOSITION_CONTENT_TYPE, exposition
+
+router = APIRouter(
+    tags=["metrics"],
+)
+
+
+@router.get("/metrics", summary="all metrics, in the Prometheus text format")
+async def metrics():
+    return Response(content=exposition(), media_type=EXPOSITION_CONTENT_TYPE)
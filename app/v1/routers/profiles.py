@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from app.v1.profiling import collapsed, list_reports, load_report, require_profile_token
+from app.v1.services.workers import io_pool
+
+router = APIRouter(
+    prefix="/profiles",
+    tags=["profiles"],
+    dependencies=[Depends(require_profile_token)],
+    responses={404: {"description": "Not found"}}
+)
+
+
+@router.get("/", summary="saved request profiles, newest first")
+async def get_profiles():
+    return await io_pool.run(list_reports)
+
+
+@router.get("/{profile_id}", summary="one request profile, as JSON or collapsed stacks (?format=collapsed)")
+async def get_profile(profile_id: str, format: str = "json"):
+    report = await io_pool.run(load_report, profile_id)
+    if report is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No profile with this id")
+    if format == "collapsed":
+        return PlainTextResponse(collapsed(report))
+    return report
@@ -1,4 +1,11 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.database import get_async_db, async_engine, pool_status
+from app.v1.metrics import snapshot
+from app.v1.services.workers import cpu_pool, io_pool, hash_pool
+from app.v1.services.sheet_sync import sheet_sync
+from app.v1.services.ownership import RequestOwnership, get_ownership
+from app.v1.auth.dependencies import require_operator
 
 router  = APIRouter(
     prefix="/status",
@@ -9,3 +16,34 @@ router  = APIRouter(
 @router.get("/")
 async def status():
     return {"message": "API is running"}
+
+
+@router.get("/workers", summary="worker pool usage and timings", dependencies=[Depends(require_operator)])
+async def workers_status():
+    return {
+        "pools": {pool.name: pool.stats() for pool in (cpu_pool, io_pool, hash_pool)},
+        "metrics": snapshot(prefix="worker_"),
+    }
+
+
+@router.get("/sync", summary="pending spreadsheet writes and sync lag of the user's file, and the writes given up on")
+async def sync_status(db: AsyncSession = Depends(get_async_db), owner: RequestOwnership = Depends(get_ownership)):
+    ownership = await owner.get()
+    if ownership.file_id is None:
+        files, failed = [], []
+    else:
+        files = await sheet_sync.lag(db, ownership.file_id)
+        failed = await sheet_sync.dead_letters(db, ownership.file_id)
+    return {
+        "files": files,
+        "max_lag_seconds": max((f["lag_seconds"] for f in files), default=0.0),
+        "failed_writes": failed,
+    }
+
+
+@router.get("/db", summary="database connection pool usage", dependencies=[Depends(require_operator)])
+async def db_status():
+    return {
+        "pool": pool_status(async_engine),
+        "metrics": snapshot(prefix="db_pool_"),
+    }
@@ -4,9 +4,11 @@ from app.v1.utils import parse_xls, to_float_or_none
 
 from app.v1.schemas.schemas import WorkbookParseResponse, FileUploadResponse, BulkGradeUpdate
 from app.v1.auth.dependencies import get_current_user
-from app.database.database import get_db
+from app.v1.services.ownership import RequestOwnership, get_ownership
+from app.database.database import get_async_db
 from app.database.models import UploadedFile, User, Classroom, Student
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 from pydantic import BaseModel
 import logging
@@ -14,18 +16,7 @@ import xlrd
 
 print("=== STUDENTS.PY FILE LOADED ===")
 
-# Configure logger for this module
-logger = logging.getLogger(__name__)
-
-# Ensure the logger level is set (this can also be done globally)
-if not logger.handlers:
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    logger.setLevel(logging.INFO)
+logger = logging.getLogger("__routers/students.py__")
 
 router = APIRouter(
     prefix="/me",
@@ -41,77 +32,59 @@ router = APIRouter(
 async def update_student_grade(
                 student_id:str,
                 grades: BulkGradeUpdate,
-                db: Session = Depends(get_db),
-                current_user=Depends(get_current_user)
+                db: AsyncSession = Depends(get_async_db),
+                current_user=Depends(get_current_user),
+                owner: RequestOwnership = Depends(get_ownership),
                 ):
     """ Endpoint to update the student's grade."""
 
     try:
-        logger.info(f"Current user ID: {current_user}")
-        logger.info(f"Student id: {student_id}")
-        logger.info(f"New student's grades: {grades}")
-
-        user = db.query(User).filter_by(id=current_user).first()
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
-        
-        file = db.query(UploadedFile).filter(UploadedFile.user_id == current_user.id).first()
-        if not file:
-                raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
+        logger.info("Current user ID: %s", current_user)
+        logger.info("Student id: %s", student_id)
+        logger.debug("New student's grades: %s", grades)
+
+        ownership = await owner.file(fresh=True)
         
-        student = db.query(Student).filter_by(student_id=student_id).first()
+        student = (await db.scalars(select(Student).where(
+            Student.student_id == student_id,
+            Student.classroom_id.in_(ownership.classroom_ids),
+        ))).first()
 
         student.grades = grades.evaluation
         student.first_assignment = grades.first_assignment
         student.final_exam = grades.final_exam
         student.observation = grades.observation
 
-        logger.info(f'{student}')
+        logger.debug('%s', student)
     
         # Commit the change
-        db.commit()
-        db.refresh(student)
+        await db.commit()
+        await db.refresh(student)
 
         return {"message": "Grade updated successfully", "student_id": student_id, "new_grade": grades}
     
     except Exception as e:
-        logger.error(f"Error updating grade: {e}")
+        logger.error("Error updating grade: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
     
 
 @router.get("/students/{student_id}", summary="returns a specific student")
-async def get_student_by_id(student_id, db:Session = Depends(get_db), current_user: str = Depends(get_current_user)):
+async def get_student_by_id(student_id, db:AsyncSession = Depends(get_async_db), current_user: str = Depends(get_current_user),
+                            owner: RequestOwnership = Depends(get_ownership)):
     """
     Endpoint to get specific student
     """
 
-    logger.info(f"Current user ID: {current_user}")
-    logger.info(f"Student id: {student_id}")
-
-    file = db.query(UploadedFile).filter(UploadedFile.user_id==current_user).first()
-    if not file:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    print(f"Type file: {type(file)}")
-    print(f"File: {file.classrooms[0].classroom_id}")
-    print(f"File: {file.classrooms[0].students[0].student_id}")
-
-    classroom_subquery = db.query(Classroom.classroom_id).filter(
-        Classroom.file_id == file.file_id
-    )
+    logger.info("Current user ID: %s", current_user)
+    logger.info("Student id: %s", student_id)
 
+    ownership = await owner.file()
+    query = select(Student).where(Student.student_id == student_id)
 
-    student = db.query(Student).filter(
-        Student.classroom_id.in_(classroom_subquery),
-        Student.student_id == student_id
-    ).first()
+    student = (await db.scalars(query.where(Student.classroom_id.in_(ownership.classroom_ids)))).first()
+    if student is None and not owner.verified:
+        # The cached ownership may predate a re-upload handled by another worker
+        ownership = await owner.file(fresh=True)
+        student = (await db.scalars(query.where(Student.classroom_id.in_(ownership.classroom_ids)))).first()
     return student
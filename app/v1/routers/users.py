@@ -1,16 +1,16 @@
-from fastapi import APIRouter, HTTPException, Depends, status, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, Depends, Request, status, UploadFile, File, Form
 from pydantic import EmailStr
 
 from fastapi.responses import JSONResponse
 
 
-from app.v1.auth.dependencies import get_current_user
+from app.v1.auth.dependencies import get_current_user, revoke_current_token
 
 
-from app.database.database import get_db
+from app.database.database import get_async_db
 from typing import Optional
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import logging
 from sqlalchemy.exc import SQLAlchemyError
 from app.v1.services.user_service import UserService
@@ -40,12 +40,12 @@ async def complete(
                     city: str = Form(...),
                     subject: str = Form(...),
                     file: Optional[UploadFile] = File(None),
-                    db: Session = Depends(get_db),
+                    db: AsyncSession = Depends(get_async_db),
                     current_user=Depends(get_current_user)
                     ):
     """ Endpoint to complete the user profile."""
 
-    logger.info(f"Registration for user {current_user}: {email}.")
+    logger.info("Registration for user %s: %s.", current_user, email)
     
     try:
         user, UploadedFile, parsed_data = await user_service.compete_profile(email,
@@ -59,8 +59,8 @@ async def complete(
                                                                              db,
                                                                              current_user)
     except SQLAlchemyError as e:
-        logger.error(f"Database error: {str(e)}")
-        db.rollback()
+        logger.error("Database error: %s", e)
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Database error occurred"
@@ -78,15 +78,13 @@ async def complete(
 
 
 @router.post("/logout", summary="Sign out current user")
-async def signout_user(data, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
-    """ Endpoint to sign out the current user."""
+async def signout_user(data, request: Request, db: AsyncSession = Depends(get_async_db), current_user=Depends(get_current_user)):
+    """ Endpoint to sign out the current user: the token used is revoked."""
     
-    logger.info(f"Signing out user ID: {current_user}")
-    logger.info(f"Data received for sign out: {data}")
-
-    # Here you would typically invalidate the user's session or JWT token.
-    # Since this is a stateless API, we just return a success message.
+    logger.info("Signing out user ID: %s", current_user)
+    logger.debug("Data received for sign out: %s", data)
 
+    await revoke_current_token(request)
 
     return JSONResponse(
         content={"message": "User signed out successfully"},
@@ -0,0 +1,152 @@
+'''
+Bulk ingestion of parsed XLS data into the classrooms and students tables.
+
+Rows are built as plain tuples (no ORM objects, no unit-of-work bookkeeping),
+classroom ids are generated up front so no flush is needed to link students,
+and the rows are written with multi-row INSERTs. On PostgreSQL they are
+streamed with COPY ... FROM STDIN instead (psycopg2 copy_expert, or asyncpg
+copy_records_to_table when running under an AsyncSession).
+'''
+from app.database.models import Classroom, Student
+from app.v1.utils import to_float_or_none
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.util import await_only
+
+import csv
+import io
+import logging
+import os
+import uuid
+
+
+logger = logging.getLogger("__services/bulk_ingest.py__")
+
+INSERT_BATCH_SIZE = int(os.getenv("BULK_INSERT_BATCH_SIZE", 1000))
+USE_COPY = os.getenv("BULK_INGEST_USE_COPY", "true").lower() in ("1", "true", "yes")
+COPY_NULL = r"\N"
+
+CLASSROOM_COLUMNS = (
+    "classroom_id", "file_id", "school_name", "term", "year", "level",
+    "subject", "classroom_name", "sheet_name", "number_of_students",
+)
+STUDENT_COLUMNS = (
+    "student_id", "classroom_id", "row", "last_name", "first_name", "date_birth",
+    "evaluation", "first_assignment", "final_exam", "observation",
+)
+
+
+def _to_text(value):
+    """ Values of String columns must be str for asyncpg (xlrd gives floats for numeric cells)."""
+    return None if value is None else str(value)
+
+
+def build_rows(file_id, data: dict):
+    """
+    Turn parsed XLS data into (classroom_rows, student_rows) tuples ordered like
+    CLASSROOM_COLUMNS and STUDENT_COLUMNS. A classroom that cannot be converted is
+    logged and skipped, the others are kept.
+    """
+    classroom_rows = []
+    student_rows = []
+
+    for classroom in data.get('classrooms', []):
+        try:
+            classroom_id = str(uuid.uuid4())
+            classroom_row = (
+                classroom_id,
+                file_id,
+                _to_text(classroom.get("school_name", "Unknown")),
+                classroom.get("term", "Unknown"),
+                classroom.get("year", "Unknown"),
+                classroom.get("level", "Unknown"),
+                classroom.get("subject", "Unknown"),
+                classroom.get("classroom_name", "Unknown"),
+                classroom.get("sheet_name", "Unknown"),
+                classroom.get("number_of_students", 0),
+            )
+            rows = [
+                (
+                    str(student['id']),
+                    classroom_id,
+                    student['row'],
+                    _to_text(student['last_name']),
+                    _to_text(student['first_name']),
+                    _to_text(student['date_of_birth']),
+                    to_float_or_none(student['evaluation']),
+                    to_float_or_none(student['first_assignment']),
+                    to_float_or_none(student['final_exam']),
+                    _to_text(to_float_or_none(student['observation'])),
+                )
+                for student in classroom.get('students', [])
+            ]
+        except Exception as e:
+            logger.error("Error processing classroom %s: %s", classroom.get('sheet_name', 'Unknown'), e)
+            continue
+
+        classroom_rows.append(classroom_row)
+        student_rows.extend(rows)
+
+    return classroom_rows, student_rows
+
+
+def insert_rows(db: Session, table, columns, rows, batch_size: int = INSERT_BATCH_SIZE) -> None:
+    """
+    Insert rows as multi-row INSERT ... VALUES statements of `batch_size` rows.
+    The statement is compiled once and SQLAlchemy's insertmanyvalues batching
+    renders the VALUES groups, which is much cheaper than insert().values(list).
+    """
+    db.execute(
+        insert(table).execution_options(insertmanyvalues_page_size=batch_size),
+        [dict(zip(columns, row)) for row in rows],
+    )
+
+
+def copy_rows(db: Session, table, columns, rows) -> None:
+    """ Stream rows into PostgreSQL with COPY ... FROM STDIN."""
+    dbapi_connection = db.connection().connection
+
+    if db.get_bind().dialect.driver == "asyncpg":
+        # Inside AsyncSession.run_sync: drive the asyncpg coroutine from the greenlet
+        await_only(dbapi_connection.driver_connection.copy_records_to_table(
+            table.name, records=rows, columns=list(columns),
+        ))
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([COPY_NULL if value is None else value for value in row])
+    buffer.seek(0)
+
+    with dbapi_connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+            buffer,
+        )
+
+
+def can_copy(db: Session) -> bool:
+    dialect = db.get_bind().dialect
+    return USE_COPY and dialect.name == "postgresql" and dialect.driver in ("psycopg2", "asyncpg")
+
+
+def populate_database(db: Session, file_id: str, data: dict) -> None:
+    """
+    Populate database with parsed XLS data.
+    The caller owns the transaction (flush the UploadedFile first, commit after).
+    From an AsyncSession: await db.run_sync(populate_database, file_id, data)
+    """
+    classroom_rows, student_rows = build_rows(file_id, data)
+
+    if not classroom_rows:
+        logger.warning('No classrooms found in parsed data')
+        return
+
+    write = copy_rows if can_copy(db) else insert_rows
+    write(db, Classroom.__table__, CLASSROOM_COLUMNS, classroom_rows)
+    if student_rows:  # an INSERT without rows would insert one row of defaults
+        write(db, Student.__table__, STUDENT_COLUMNS, student_rows)
+
+    logger.info("Successfully processed %s classrooms and %s students", len(classroom_rows), len(student_rows))
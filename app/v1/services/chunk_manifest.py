@@ -0,0 +1,54 @@
+'''
+Per-source manifest of the chunks indexed in Qdrant.
+
+Chunk point ids are derived from (source, content hash), so the manifest of a
+source tells which of a re-uploaded document's chunks are already indexed
+(skipped), which are new (embedded) and which disappeared (deleted from
+Qdrant). See DocumentIndexer.index_chunks.
+'''
+from app.database.database import async_engine
+from app.database.models import IndexedChunk
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import logging
+
+
+logger = logging.getLogger("__services/chunk_manifest.py__")
+
+DELETE_BATCH_SIZE = 500
+
+
+class ChunkManifest:
+    def __init__(self, bind=None):
+        self.bind = bind if bind is not None else async_engine
+
+    async def chunk_ids(self, collection: str, source: str) -> set[str]:
+        async with AsyncSession(self.bind) as db:
+            rows = await db.scalars(
+                select(IndexedChunk.chunk_id).where(IndexedChunk.collection == collection, IndexedChunk.source == source)
+            )
+            return set(rows)
+
+    async def update(self, collection: str, source: str, added, deleted) -> None:
+        """ Record the chunks added to and deleted from the source, in one transaction."""
+        async with AsyncSession(self.bind) as db:
+            deleted = list(deleted)
+            for start in range(0, len(deleted), DELETE_BATCH_SIZE):
+                await db.execute(delete(IndexedChunk).where(
+                    IndexedChunk.collection == collection,
+                    IndexedChunk.source == source,
+                    IndexedChunk.chunk_id.in_(deleted[start:start + DELETE_BATCH_SIZE]),
+                ))
+            db.add_all([IndexedChunk(collection=collection, source=source, chunk_id=chunk_id) for chunk_id in added])
+            await db.commit()
+
+    async def forget(self, collection: str, source: str = None) -> None:
+        """ Drop the manifest of a source, or of the whole collection (e.g. when it was recreated)."""
+        async with AsyncSession(self.bind) as db:
+            statement = delete(IndexedChunk).where(IndexedChunk.collection == collection)
+            if source is not None:
+                statement = statement.where(IndexedChunk.source == source)
+            await db.execute(statement)
+            await db.commit()
@@ -0,0 +1,132 @@
+'''
+Process-wide clients for the assistant: Qdrant, the OpenAI chat and embedding
+models and the HTTP connection pools under them.
+
+The registry is created once in the app lifespan (app.state.clients) and
+handed to the routes through the dependencies below, so keep-alive
+connections are reused across requests instead of being rebuilt for each one.
+Tests replace it with fakes by assigning app.state.clients or overriding
+get_clients.
+'''
+from app.database.database import DocumentIndexer
+from app.v1.services.chunk_manifest import ChunkManifest
+from app.v1.services.embedding_cache import CachedEmbeddings, EmbeddingCache
+from app.v1.services.embeddings import HASHING_EMBEDDING_SIZE, EmbeddingBatcher, HashingEmbeddings
+from app.v1.services.vector_profile import vector_profile
+from app.v1.schemas.schemas import QueryExpantion
+
+from dataclasses import dataclass, field
+from fastapi import Depends, HTTPException, Request, status
+from langchain.chat_models import init_chat_model
+from langchain_openai import OpenAIEmbeddings
+from qdrant_client import AsyncQdrantClient
+
+import httpx
+import logging
+import os
+
+
+logger = logging.getLogger("__services/clients.py__")
+
+QDRANT_URL            = os.getenv("QDRANT_URL", "http://qdrant:6333")
+CHAT_MODEL            = os.getenv("CHAT_MODEL", "gpt-4.1")
+EMBEDDING_MODEL       = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
+EMBEDDING_BACKEND     = os.getenv("EMBEDDING_BACKEND", "openai")  # "hashing": local, deterministic, offline
+HTTP_MAX_CONNECTIONS  = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE    = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+HTTP_TIMEOUT_SECONDS  = float(os.getenv("HTTP_TIMEOUT_SECONDS", 60))
+
+
+@dataclass
+class ClientRegistry:
+    qdrant: AsyncQdrantClient
+    chat_model: object = None            # None when OpenAI is not configured
+    query_expansion_model: object = None
+    embeddings: object = None
+    embedding_cache: EmbeddingCache = None
+    embedder: EmbeddingBatcher = None    # batches query embeddings over `embeddings` and the cache
+    indexer: DocumentIndexer = None
+    chunk_manifest: ChunkManifest = None  # lets the indexer skip chunks it already has
+    http_clients: list = field(default_factory=list)  # pools owned by the registry, closed with it
+
+    @classmethod
+    def from_env(cls) -> "ClientRegistry":
+        registry = cls(qdrant=AsyncQdrantClient(url=QDRANT_URL), embedding_cache=EmbeddingCache(),
+                       chunk_manifest=ChunkManifest())
+        if EMBEDDING_BACKEND == "hashing":
+            registry.use_embeddings(HashingEmbeddings(vector_profile.dimensions or HASHING_EMBEDDING_SIZE))
+
+        if not os.getenv("OPENAI_API_KEY"):
+            logger.error("OPENAI_API_KEY is not set, the assistant endpoints are disabled.")
+            return registry
+
+        limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE)
+        http_client = httpx.Client(limits=limits, timeout=HTTP_TIMEOUT_SECONDS)
+        http_async_client = httpx.AsyncClient(limits=limits, timeout=HTTP_TIMEOUT_SECONDS)
+        registry.http_clients = [http_client, http_async_client]
+        pools = {"http_client": http_client, "http_async_client": http_async_client}
+
+        registry.chat_model = init_chat_model(model=CHAT_MODEL, model_provider="openai", **pools)
+        registry.query_expansion_model = registry.chat_model.with_structured_output(QueryExpantion)
+        if registry.embeddings is None:
+            registry.use_embeddings(OpenAIEmbeddings(model=EMBEDDING_MODEL, dimensions=vector_profile.dimensions, **pools))
+        logger.info("Assistant clients ready (qdrant %s, chat %s, embeddings %s)", QDRANT_URL, CHAT_MODEL, registry.embeddings)
+        return registry
+
+    def use_embeddings(self, embeddings) -> None:
+        """ Set the embedding model and the batcher and indexer built on it (and on the cache, if any)."""
+        self.embeddings = embeddings
+        if self.embedding_cache is not None:
+            embeddings = CachedEmbeddings(embeddings, self.embedding_cache)
+        self.embedder = EmbeddingBatcher(embeddings)
+        self.indexer = DocumentIndexer(self.qdrant, embeddings, manifest=self.chunk_manifest)
+
+    async def aclose(self) -> None:
+        for client in self.http_clients:
+            try:
+                if isinstance(client, httpx.AsyncClient):
+                    await client.aclose()
+                else:
+                    client.close()
+            except Exception as e:
+                logger.error("Error closing HTTP client: %s", e)
+        await self.qdrant.close()
+        if self.embedding_cache is not None:
+            self.embedding_cache.close()
+
+
+def get_clients(request: Request) -> ClientRegistry:
+    return request.app.state.clients
+
+
+def _require(client, name: str):
+    if client is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"The assistant is not configured ({name} unavailable)",
+        )
+    return client
+
+
+def get_qdrant(clients: ClientRegistry = Depends(get_clients)) -> AsyncQdrantClient:
+    return clients.qdrant
+
+
+def get_chat_model(clients: ClientRegistry = Depends(get_clients)):
+    return _require(clients.chat_model, "chat model")
+
+
+def get_query_expansion_model(clients: ClientRegistry = Depends(get_clients)):
+    return _require(clients.query_expansion_model, "query expansion model")
+
+
+def get_embeddings(clients: ClientRegistry = Depends(get_clients)):
+    return _require(clients.embeddings, "embeddings")
+
+
+def get_embedder(clients: ClientRegistry = Depends(get_clients)) -> EmbeddingBatcher:
+    return _require(clients.embedder, "embeddings")
+
+
+def get_indexer(clients: ClientRegistry = Depends(get_clients)) -> DocumentIndexer:
+    return _require(clients.indexer, "document indexer")
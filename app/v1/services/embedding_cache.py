@@ -0,0 +1,219 @@
+'''
+Content-addressed cache of embeddings, shared by the query and indexing paths.
+
+Vectors are keyed by (model, sha256 of the normalised text) and stored as
+float32 bytes in two tiers: an in-memory LRU and a SQLite file that survives
+restarts. CachedEmbeddings wraps an embedding model and only sends it the
+texts neither tier knows, so repeated questions and re-uploaded documents are
+not embedded again. The disk tier is best effort: when it cannot be read or
+written (io pool saturated, SQLite error) the vectors are computed or returned
+anyway.
+'''
+from app.v1.metrics import Counter
+from app.v1.services.workers import io_pool
+
+from array import array
+from collections import OrderedDict
+from langchain_core.embeddings import Embeddings
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+
+
+logger = logging.getLogger("__services/embedding_cache.py__")
+
+EMBEDDING_CACHE_PATH        = os.getenv("EMBEDDING_CACHE_PATH", "app/cache/embeddings.sqlite3")  # empty: memory only
+EMBEDDING_CACHE_MEMORY_SIZE = int(os.getenv("EMBEDDING_CACHE_MEMORY_SIZE", 10_000))  # vectors
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+LOOKUPS     = Counter("embedding_cache_lookups_total", "Embedding cache lookups by the tier that answered", ("tier",))
+BYTES_SAVED = Counter("embedding_cache_bytes_saved_total", "Bytes of float32 vectors served from the cache instead of the model")
+DISK_ERRORS = Counter("embedding_cache_disk_errors_total", "Failed reads and writes of the disk tier", ("operation",))
+
+
+def text_key(text: str) -> bytes:
+    normalized = WHITESPACE_RE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+    return hashlib.sha256(normalized.encode()).digest()
+
+
+def model_name(embeddings) -> str:
+    """ Name the vectors of `embeddings` are cached under."""
+    name = getattr(embeddings, "model", None) or type(embeddings).__name__
+    dimensions = getattr(embeddings, "dimensions", None)
+    return f"{name}:{dimensions}" if dimensions else name
+
+
+class EmbeddingCache:
+    def __init__(self, path: str = None, memory_size: int = EMBEDDING_CACHE_MEMORY_SIZE):
+        path = EMBEDDING_CACHE_PATH if path is None else path
+        self.memory_size = memory_size
+        self._memory = OrderedDict()  # (model, key) -> float32 bytes
+        self._lock = threading.Lock()     # the memory tier, taken on the event loop: held for dict operations only
+        self._db_lock = threading.Lock()  # the SQLite connection, taken in the io pool
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, key BLOB NOT NULL, vector BLOB NOT NULL,"
+                " PRIMARY KEY (model, key)) WITHOUT ROWID"
+            )
+            self._db.commit()
+
+    # ---- memory tier, cheap enough for the event loop ----
+    def get_memory(self, model: str, keys: list) -> dict:
+        found = {}
+        with self._lock:
+            for key in keys:
+                blob = self._memory.get((model, key))
+                if blob is not None:
+                    self._memory.move_to_end((model, key))
+                    found[key] = blob
+        return found
+
+    def _remember(self, model: str, items: dict) -> None:
+        with self._lock:
+            for key, blob in items.items():
+                self._memory[(model, key)] = blob
+                self._memory.move_to_end((model, key))
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    # ---- disk tier, blocking: run it in the io pool ----
+    @property
+    def has_disk(self) -> bool:
+        return self._db is not None
+
+    def get_disk(self, model: str, keys: list) -> dict:
+        if self._db is None or not keys:
+            return {}
+        found = {}
+        with self._db_lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(chunk))})",
+                    (model, *chunk),
+                )
+                found.update(rows)
+        self._remember(model, found)
+        return found
+
+    def put(self, model: str, items: dict) -> None:
+        """ Store {key: float32 bytes} in both tiers."""
+        self._remember(model, items)
+        self.put_disk(model, items)
+
+    def put_disk(self, model: str, items: dict) -> None:
+        if self._db is None or not items:
+            return
+        with self._db_lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, key, vector) VALUES (?, ?, ?)",
+                [(model, key, blob) for key, blob in items.items()],
+            )
+            self._db.commit()
+
+    def close(self) -> None:
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+
+def _to_blob(vector) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _from_blob(blob: bytes) -> list[float]:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """ An embedding model behind an EmbeddingCache."""
+    def __init__(self, embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model_name(embeddings)
+
+    def _lookup_memory(self, texts):
+        keys = [text_key(text) for text in texts]
+        found = self.cache.get_memory(self.model, keys)
+        LOOKUPS.labels("memory").inc(len(found))
+        return keys, found, [key for key in dict.fromkeys(keys) if key not in found]
+
+    def _missing(self, texts, keys, found) -> dict:
+        """ {key: text} of the texts neither tier knows."""
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        LOOKUPS.labels("miss").inc(len(missing))
+        BYTES_SAVED.inc(sum(len(found[key]) for key in keys if key in found))
+        return missing
+
+    def _assemble(self, keys, found, missing, computed):
+        """ (vectors in the order of `keys`, {key: blob} of the newly computed ones)."""
+        fresh = {key: _to_blob(vector) for key, vector in zip(missing, computed)}
+        found = {**found, **fresh}
+        return [_from_blob(found[key]) for key in keys], fresh
+
+    def _disk_failed(self, operation: str, n: int, error: Exception) -> None:
+        DISK_ERRORS.labels(operation).inc()
+        logger.warning("Embedding cache %s of %s vectors failed, skipping the disk tier: %s", operation, n, error)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, found, unknown = self._lookup_memory(texts)
+        try:
+            disk = self.cache.get_disk(self.model, unknown)
+        except Exception as e:
+            self._disk_failed("read", len(unknown), e)
+            disk = {}
+        LOOKUPS.labels("disk").inc(len(disk))
+        found.update(disk)
+        missing = self._missing(texts, keys, found)
+
+        computed = self.embeddings.embed_documents(list(missing.values())) if missing else []
+        result, fresh = self._assemble(keys, found, missing, computed)
+        self.cache._remember(self.model, fresh)
+        try:
+            self.cache.put_disk(self.model, fresh)
+        except Exception as e:
+            self._disk_failed("write", len(fresh), e)
+        return result
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, found, unknown = self._lookup_memory(texts)
+        if unknown and self.cache.has_disk:
+            try:
+                disk = await io_pool.run(self.cache.get_disk, self.model, unknown)
+            except Exception as e:
+                self._disk_failed("read", len(unknown), e)
+                disk = {}
+            LOOKUPS.labels("disk").inc(len(disk))
+            found.update(disk)
+        missing = self._missing(texts, keys, found)
+
+        computed = await self.embeddings.aembed_documents(list(missing.values())) if missing else []
+        result, fresh = self._assemble(keys, found, missing, computed)
+        if fresh:
+            self.cache._remember(self.model, fresh)
+            if self.cache.has_disk:
+                try:
+                    await io_pool.run(self.cache.put_disk, self.model, fresh)
+                except Exception as e:
+                    self._disk_failed("write", len(fresh), e)
+        return result
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_documents([text]))[0]
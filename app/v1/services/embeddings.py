@@ -0,0 +1,154 @@
+'''
+Embedding of chat queries.
+
+EmbeddingBatcher sits in front of an embedding model and coalesces the texts
+that concurrent chats ask for within a few milliseconds into one
+aembed_documents call, so N simultaneous messages cost one round trip instead
+of N. A text that is already waiting or in flight is not sent twice, and a
+batch is sent early once it holds max_batch_size texts.
+
+HashingEmbeddings is a deterministic local backend (EMBEDDING_BACKEND=hashing)
+for offline tests and benchmarks: no network, same text -> same vector, and
+texts sharing words get similar vectors.
+'''
+from app.v1.metrics import Counter, Histogram
+from app.v1.telemetry import timed
+
+from langchain_core.embeddings import Embeddings
+
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import re
+import time
+
+
+logger = logging.getLogger("__services/embeddings.py__")
+
+EMBED_BATCH_WINDOW_MS  = float(os.getenv("EMBED_BATCH_WINDOW_MS", 5))
+EMBED_MAX_BATCH_SIZE   = int(os.getenv("EMBED_MAX_BATCH_SIZE", 256))
+HASHING_EMBEDDING_SIZE = int(os.getenv("HASHING_EMBEDDING_SIZE", 3072))
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+BATCH_SIZE      = Histogram("embedding_batch_size", "Texts per embedding call", buckets=BATCH_SIZE_BUCKETS)
+BATCH_LATENCY   = Histogram("embedding_batch_latency_seconds", "Duration of one batched embedding call")
+REQUEST_LATENCY = Histogram("embedding_request_latency_seconds", "Time a caller waits for its embeddings, batching window included")
+DEDUPLICATED    = Counter("embedding_deduplicated_total", "Texts served by a batch already holding the same text")
+BATCH_ERRORS    = Counter("embedding_batch_errors_total", "Batched embedding calls that failed")
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+class HashingEmbeddings(Embeddings):
+    """ Signed feature hashing of the lower-cased words, L2 normalised."""
+    def __init__(self, size: int = HASHING_EMBEDDING_SIZE):
+        self.size = size
+        self.model = f"hashing-{size}"
+
+    def _embed(self, text: str) -> list[float]:
+        vector = [0.0] * self.size
+        for token in TOKEN_RE.findall(text.lower()):
+            digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.size] += 1.0 if value >> 63 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector))
+        if norm == 0:
+            vector[0] = 1.0  # keep empty texts usable with cosine distance
+            return vector
+        return [x / norm for x in vector]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return self._embed(text)
+
+
+class EmbeddingBatcher:
+    def __init__(self, embeddings, max_batch_size: int = EMBED_MAX_BATCH_SIZE,
+                 window_ms: float = EMBED_BATCH_WINDOW_MS):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000
+        # Futures are bound to the loop that created them: the state below
+        # belongs to self._loop and is only touched from it
+        self._loop = None
+        self._futures = {}   # text -> future, for texts waiting or in flight
+        self._pending = []   # texts of the batch being collected
+        self._timer = None
+        self._tasks = set()  # running batches, referenced so they are not garbage collected
+
+    def _bind(self, loop) -> None:
+        if loop is not self._loop:
+            self._loop, self._futures, self._pending, self._timer = loop, {}, [], None
+
+    def _future_for(self, text: str) -> asyncio.Future:
+        future = self._futures.get(text)
+        if future is not None:
+            DEDUPLICATED.inc()
+            return future
+
+        future = self._futures[text] = self._loop.create_future()
+        self._pending.append(text)
+        if len(self._pending) >= self.max_batch_size:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._send()
+        elif self._timer is None:
+            self._timer = self._loop.call_later(self.window, self._send)
+        return future
+
+    def _send(self) -> None:
+        self._timer = None
+        texts, self._pending = self._pending, []
+        if texts:
+            task = self._loop.create_task(self._run(texts))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, texts: list[str]) -> None:
+        BATCH_SIZE.observe(len(texts))
+        start = time.perf_counter()
+        try:
+            with timed("openai", "embeddings"):
+                vectors = await self.embeddings.aembed_documents(texts)
+        except Exception as e:
+            BATCH_ERRORS.inc()
+            logger.error("Embedding a batch of %s texts failed: %s", len(texts), e)
+            for text in texts:
+                future = self._futures.pop(text)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            BATCH_LATENCY.observe(time.perf_counter() - start)
+
+        for text, vector in zip(texts, vectors):
+            future = self._futures.pop(text)
+            if not future.done():
+                future.set_result(vector)
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        """ Embed `texts`, sharing the call to the model with concurrent callers."""
+        if not texts:
+            return []
+        self._bind(asyncio.get_running_loop())
+        start = time.perf_counter()
+        futures = [self._future_for(text) for text in texts]
+        try:
+            # shield: a cancelled chat must not cancel vectors other chats wait for
+            return list(await asyncio.gather(*(asyncio.shield(future) for future in futures)))
+        finally:
+            REQUEST_LATENCY.observe(time.perf_counter() - start)
+
+    async def embed_query(self, text: str) -> list[float]:
+        return (await self.embed([text]))[0]
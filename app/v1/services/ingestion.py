@@ -0,0 +1,194 @@
+'''
+Streaming ingestion of documents into the assistant's vector store.
+
+An upload is copied to a temporary file piece by piece and indexed by a
+background job, so the request returns at once with a job id and
+GET /assistant/file/upload/{job_id} reports the progress. The job reads the
+file back in INGEST_READ_CHUNK_BYTES pieces, decodes and splits it
+incrementally (IncrementalSplitter) and hands the chunks to
+DocumentIndexer.index_chunks, which embeds and upserts them in bounded
+concurrent batches. Neither the upload nor the text is ever held in memory
+whole.
+'''
+from app.v1.metrics import Counter, Gauge
+from app.v1.services.workers import io_pool
+
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from typing import AsyncIterator
+
+import asyncio
+import codecs
+import logging
+import os
+import tempfile
+import time
+import uuid
+
+
+logger = logging.getLogger("__services/ingestion.py__")
+
+READ_CHUNK_BYTES    = int(os.getenv("INGEST_READ_CHUNK_BYTES", 256 * 1024))
+CHUNK_OVERLAP       = int(os.getenv("INGEST_CHUNK_OVERLAP", 50))
+MAX_CONCURRENT_JOBS = int(os.getenv("INGEST_MAX_CONCURRENT_JOBS", 2))
+JOB_HISTORY         = int(os.getenv("INGEST_JOB_HISTORY", 200))   # finished jobs kept for the status endpoint
+INGEST_TMP_DIR      = os.getenv("INGEST_TMP_DIR") or None
+
+JOBS      = Counter("ingestion_jobs_total", "Finished ingestion jobs", ("status",))
+JOBS_LIVE = Gauge("ingestion_jobs_in_progress", "Ingestion jobs queued or running")
+
+
+class IncrementalSplitter:
+    """
+    RecursiveCharacterTextSplitter fed piece by piece. feed() returns the
+    chunks that later text can no longer change; the tail stays buffered
+    until more text or finish() arrives.
+    """
+    def __init__(self, chunk_size: int, chunk_overlap: int = CHUNK_OVERLAP):
+        self.chunk_size = chunk_size
+        self.splitter = RecursiveCharacterTextSplitter(
+            separators=["\n\n", "\n", ",", " ", ""],
+            chunk_size=chunk_size,
+            chunk_overlap=min(chunk_overlap, chunk_size // 2),
+            add_start_index=True,
+        )
+        self._buffer = ""
+
+    def feed(self, text: str) -> list[str]:
+        self._buffer += text
+        if len(self._buffer) < 4 * self.chunk_size:
+            return []
+        documents = self.splitter.create_documents([self._buffer])
+        # The last chunk may still grow: split it again with the next piece
+        self._buffer = self._buffer[documents[-1].metadata["start_index"]:]
+        return [document.page_content for document in documents[:-1]]
+
+    def finish(self) -> list[str]:
+        chunks, self._buffer = self.splitter.split_text(self._buffer), ""
+        return chunks
+
+
+async def spool_upload(file) -> tuple[str, int]:
+    """ Copy an UploadFile to a temporary file, one piece at a time. Returns (path, size)."""
+    descriptor, path = tempfile.mkstemp(prefix="ingest-", dir=INGEST_TMP_DIR)
+    size = 0
+    try:
+        with os.fdopen(descriptor, "wb") as out:
+            while piece := await file.read(READ_CHUNK_BYTES):
+                await io_pool.run(out.write, piece)
+                size += len(piece)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, size
+
+
+async def read_text_chunks(path: str, chunk_size: int, on_read=None) -> AsyncIterator[str]:
+    """ Yield the chunks of the UTF-8 text file at `path`, reading it in pieces in the io pool."""
+    splitter = IncrementalSplitter(chunk_size)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    with open(path, "rb") as source:
+        while piece := await io_pool.run(source.read, READ_CHUNK_BYTES):
+            if on_read is not None:
+                on_read(len(piece))
+            for chunk in splitter.feed(decoder.decode(piece)):
+                yield chunk
+    for chunk in splitter.feed(decoder.decode(b"", final=True)) + splitter.finish():
+        yield chunk
+
+
+@dataclass
+class IngestionJob:
+    job_id: str
+    file_name: str
+    total_bytes: int
+    status: str = "queued"        # queued, running, done, failed
+    bytes_read: int = 0
+    chunks_indexed: int = 0       # added: embedded and upserted
+    chunks_skipped: int = 0       # already indexed for this file name
+    chunks_deleted: int = 0       # indexed for a previous version of the file
+    error: str = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: float = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class IngestionJobs:
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_JOBS, history: int = JOB_HISTORY):
+        self.max_concurrent = max_concurrent
+        self.history = history
+        self._jobs = OrderedDict()   # job_id -> IngestionJob, oldest first
+        self._tasks = set()
+        self._loop = None
+        self._slots = None
+
+    def get(self, job_id: str) -> IngestionJob:
+        return self._jobs.get(job_id)
+
+    def submit(self, indexer, path: str, size: int, file_name: str, doc_type: str, chunk_size: int,
+               on_done=None) -> IngestionJob:
+        """ Index the file at `path` in the background; the file is removed once done."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop, self._slots = loop, asyncio.Semaphore(self.max_concurrent)
+
+        job = IngestionJob(job_id=uuid.uuid4().hex, file_name=file_name, total_bytes=size)
+        self._jobs[job.job_id] = job
+        self._forget_finished()
+        task = loop.create_task(self._run(job, indexer, path, doc_type, chunk_size, on_done))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def _forget_finished(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(len(finished) - self.history, 0)]:
+            del self._jobs[job_id]
+
+    async def _run(self, job, indexer, path, doc_type, chunk_size, on_done) -> None:
+        JOBS_LIVE.inc()
+        try:
+            async with self._slots:
+                job.status = "running"
+                logger.info("Indexing %s (%s bytes), job %s", job.file_name, job.total_bytes, job.job_id)
+
+                def on_read(n):
+                    job.bytes_read += n
+
+                def on_indexed(n):
+                    job.chunks_indexed = n
+
+                chunks = read_text_chunks(path, chunk_size, on_read)
+                report = await indexer.index_chunks(chunks, {"source": job.file_name, "type": doc_type}, on_indexed)
+            job.chunks_indexed, job.chunks_skipped, job.chunks_deleted = report.added, report.skipped, report.deleted
+            job.status = "done"
+            logger.info("Indexed %s: %s chunks added, %s skipped, %s deleted, job %s",
+                        job.file_name, report.added, report.skipped, report.deleted, job.job_id)
+            if on_done is not None:
+                on_done()
+        except asyncio.CancelledError:
+            job.status, job.error = "failed", "cancelled"
+            raise
+        except Exception as e:
+            job.status, job.error = "failed", str(e)
+            logger.error("Indexing %s failed, job %s: %s", job.file_name, job.job_id, e)
+        finally:
+            job.finished_at = time.time()
+            JOBS.labels(job.status).inc()
+            JOBS_LIVE.dec()
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.error("Could not remove %s: %s", path, e)
+
+    async def shutdown(self) -> None:
+        """ Cancel the running jobs (on application shutdown)."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+ingestion_jobs = IngestionJobs()
@@ -0,0 +1,167 @@
+'''
+Ownership of the data a request touches: the user's uploaded file and the
+classrooms in it.
+
+Handlers get a RequestOwnership through the get_ownership dependency and ask it
+for what they need (`await owner.file()`, `await owner.classroom(id)`). It is
+resolved with one query the first time it is needed in the request, and served
+from a process-level cache of OWNERSHIP_CACHE_TTL_SECONDS afterwards, so most
+requests check ownership without touching the database. Uploading or deleting
+the file invalidates the user's entry; another worker process sees the change
+after at most the TTL. Two things keep a stale entry from doing harm:
+  - endpoints that write resolve with `fresh=True`, bypassing the cache, so
+    they never target a file that another worker has deleted or replaced;
+  - a cached entry that would answer 404 (no file, unknown classroom) is
+    checked against the database once before the 404 is raised.
+'''
+from app.database.database import get_async_db
+from app.database.models import Classroom, UploadedFile
+from app.v1.auth.dependencies import get_current_user
+from app.v1.metrics import Counter
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from fastapi import Depends, HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import logging
+import os
+import threading
+import time
+import uuid
+
+
+logger = logging.getLogger("__services/ownership.py__")
+
+OWNERSHIP_CACHE_TTL_SECONDS = float(os.getenv("OWNERSHIP_CACHE_TTL_SECONDS", 30))
+OWNERSHIP_CACHE_MAX_ENTRIES = int(os.getenv("OWNERSHIP_CACHE_MAX_ENTRIES", 10000))
+
+LOOKUPS = Counter("ownership_cache_lookups_total", "Ownership resolutions", ("result",))  # hit, miss, fresh
+
+
+@dataclass(frozen=True)
+class Ownership:
+    user_id: str
+    file_id: uuid.UUID = None     # None: no uploaded file
+    file_name: str = None
+    storage_path: str = None
+    classrooms: dict = field(default_factory=dict)  # classroom_id -> sheet_name; read only
+
+    @property
+    def classroom_ids(self) -> list[str]:
+        return list(self.classrooms)
+
+
+class OwnershipCache:
+    def __init__(self, ttl_seconds: float = OWNERSHIP_CACHE_TTL_SECONDS,
+                 max_entries: int = OWNERSHIP_CACHE_MAX_ENTRIES, clock=time.monotonic):
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> (expires, Ownership), least recently used first
+        self.version = 0               # bumped by invalidations: a resolution that straddles one is not stored
+
+    def get(self, user_id: str) -> Ownership:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] <= self.clock():
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, ownership: Ownership, version: int) -> None:
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[ownership.user_id] = (self.clock() + self.ttl, ownership)
+            self._entries.move_to_end(ownership.user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self.version += 1
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+
+ownership_cache = OwnershipCache()
+
+
+async def resolve_ownership(db: AsyncSession, user_id: str) -> Ownership:
+    """ The user's file and classrooms, in one query."""
+    rows = (await db.execute(
+        select(UploadedFile.file_id, UploadedFile.file_name, UploadedFile.storage_path,
+               Classroom.classroom_id, Classroom.sheet_name)
+        .outerjoin(Classroom, Classroom.file_id == UploadedFile.file_id)
+        .where(UploadedFile.user_id == user_id)
+    )).all()
+    if not rows:
+        return Ownership(user_id=user_id)
+    return Ownership(
+        user_id=user_id,
+        file_id=rows[0].file_id,
+        file_name=rows[0].file_name,
+        storage_path=rows[0].storage_path,
+        classrooms={row.classroom_id: row.sheet_name for row in rows if row.classroom_id is not None},
+    )
+
+
+class RequestOwnership:
+    """ Ownership of the current user, resolved at most once per request."""
+    def __init__(self, db: AsyncSession, user_id: str, cache: OwnershipCache = ownership_cache):
+        self.db = db
+        self.user_id = user_id
+        self.cache = cache
+        self._ownership = None
+        self.verified = False  # the ownership was read from the database in this request
+
+    async def get(self, fresh: bool = False) -> Ownership:
+        if self._ownership is not None and not fresh:
+            return self._ownership
+        ownership = None if fresh else self.cache.get(self.user_id)
+        if ownership is None:
+            LOOKUPS.labels("fresh" if fresh else "miss").inc()
+            version = self.cache.version
+            ownership = await resolve_ownership(self.db, self.user_id)
+            self.cache.put(ownership, version)
+            self.verified = True
+        else:
+            LOOKUPS.labels("hit").inc()
+        self._ownership = ownership
+        return ownership
+
+    async def file(self, fresh: bool = False) -> Ownership:
+        """ The ownership, or 404 when the user has no uploaded file."""
+        ownership = await self.get(fresh)
+        if ownership.file_id is None and not self.verified:
+            ownership = await self.get(fresh=True)
+        if ownership.file_id is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No existing file. please upload file first"
+            )
+        return ownership
+
+    async def classroom(self, classroom_id: str, fresh: bool = False) -> Ownership:
+        """ The ownership, or 404 unless `classroom_id` is in the user's file."""
+        ownership = await self.file(fresh)
+        if classroom_id not in ownership.classrooms and not self.verified:
+            ownership = await self.file(fresh=True)
+        if classroom_id not in ownership.classrooms:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"No classroom with id {classroom_id} found for this user"
+            )
+        return ownership
+
+
+def get_ownership(db: AsyncSession = Depends(get_async_db),
+                  current_user: str = Depends(get_current_user)) -> RequestOwnership:
+    return RequestOwnership(db, current_user)
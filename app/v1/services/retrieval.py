@@ -0,0 +1,193 @@
+'''
+Retrieval for the assistant: fused search across the expanded queries, a local
+reranker and a token budget for the context.
+
+search() sends every expanded query in one query_batch_points call and gets
+the payloads with the hits, so no second round trip is needed; the HNSW and
+quantization rescoring parameters come from the vector profile.
+reciprocal_rank_fusion() merges the per-query rankings into one list of
+distinct points, and rerank() reorders the fused candidates by BM25 against
+the user's question (CPU only, computed over the candidates themselves).
+build_context() then keeps the best passages that fit in CONTEXT_TOKEN_BUDGET.
+
+plan_retrieval() does not wait for the query expansion: the raw query is
+searched at once while the expansion runs, and the expanded queries' rankings
+are fused in only if the expansion is done within EXPANSION_DEADLINE_MS of the
+start. A late expansion still finishes in the background, so it lands in the
+expansion cache for the next similar question.
+'''
+from app.v1.metrics import Counter, Histogram
+from app.v1.services.vector_profile import vector_profile
+from app.v1.telemetry import timed
+
+from collections import Counter as TermCounter
+from qdrant_client.models import QueryRequest
+
+import asyncio
+import logging
+import math
+import os
+import re
+import time
+
+
+logger = logging.getLogger("__services/retrieval.py__")
+
+CANDIDATES_PER_QUERY = int(os.getenv("RETRIEVAL_CANDIDATES_PER_QUERY", 8))
+RRF_K                = int(os.getenv("RETRIEVAL_RRF_K", 60))
+RERANK_FUSION_WEIGHT = float(os.getenv("RERANK_FUSION_WEIGHT", 0.3))   # share of the fused rank in the final score
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+EXPANSION_DEADLINE_MS = float(os.getenv("EXPANSION_DEADLINE_MS", 1500))
+CHARS_PER_TOKEN      = 4  # close enough for OpenAI tokenizers on French and English text
+
+BM25_K1, BM25_B = 1.2, 0.75
+TOKEN_RE = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a au aux avec ce ces dans de des du elle en est et il ils je la le les leur lui ma mais me mes mon "
+    "ne nos notre nous on ou par pas pour qu que qui sa se ses son sur ta te tes toi ton tu un une vos "
+    "votre vous y d l s n c j m t "
+    "the of and to in is it for on that this with as are be by an or at from what how"
+    .split()
+)
+
+SEARCH_LATENCY = Histogram("retrieval_search_seconds", "Duration of the batched vector search")
+RERANK_LATENCY = Histogram("retrieval_rerank_seconds", "Duration of the local reranking")
+PLANS          = Counter("retrieval_plans_total", "Retrievals by what became of the expansion", ("expansion",))
+
+_late_expansions = set()  # expansions past their deadline, left to finish
+
+
+def terms(text: str) -> list[str]:
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def count_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def page_content(point) -> str:
+    return (point.payload or {}).get("page_content") or ""
+
+
+async def search(client, collection_name: str, vectors, limit: int = CANDIDATES_PER_QUERY,
+                 params=None) -> list[list]:
+    """ One ranked list of ScoredPoint (payload included) per vector, in a single request."""
+    params = params or vector_profile.search_params()
+    start = time.perf_counter()
+    with timed("qdrant", "search"):
+        responses = await client.query_batch_points(
+            collection_name=collection_name,
+            requests=[QueryRequest(query=vector, limit=limit, params=params, with_payload=True) for vector in vectors],
+        )
+    SEARCH_LATENCY.observe(time.perf_counter() - start)
+    return [response.points for response in responses]
+
+
+def reciprocal_rank_fusion(rankings: list[list], k: int = RRF_K) -> list[tuple]:
+    """ [(point, fused score)] of the distinct points of `rankings`, best first."""
+    scores, points = {}, {}
+    for ranking in rankings:
+        for rank, point in enumerate(ranking):
+            scores[point.id] = scores.get(point.id, 0.0) + 1.0 / (k + rank + 1)
+            points.setdefault(point.id, point)
+    return [(points[point_id], score) for point_id, score in sorted(scores.items(), key=lambda item: -item[1])]
+
+
+def rerank(query: str, fused: list[tuple], fusion_weight: float = RERANK_FUSION_WEIGHT) -> list:
+    """
+    Reorder fused (point, score) candidates by BM25 of the query against their
+    text, blended with the fused score. Both are scaled to [0, 1] first.
+    """
+    if not fused:
+        return []
+    start = time.perf_counter()
+    documents = [TermCounter(terms(page_content(point))) for point, _ in fused]
+    lengths = [sum(document.values()) for document in documents]
+    average_length = sum(lengths) / len(lengths) or 1.0
+    query_terms = set(terms(query))
+    document_frequency = {term: sum(1 for document in documents if term in document) for term in query_terms}
+
+    bm25 = []
+    for document, length in zip(documents, lengths):
+        score = 0.0
+        for term in query_terms:
+            frequency = document.get(term, 0)
+            if frequency:
+                idf = math.log(1 + (len(documents) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+                score += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+        bm25.append(score)
+
+    top_bm25, top_fused = max(bm25) or 1.0, fused[0][1] or 1.0
+    scored = [
+        ((1 - fusion_weight) * lexical / top_bm25 + fusion_weight * fused_score / top_fused, rank, point)
+        for rank, (lexical, (point, fused_score)) in enumerate(zip(bm25, fused))
+    ]
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    RERANK_LATENCY.observe(time.perf_counter() - start)
+    return [point for _, _, point in scored]
+
+
+def build_context(points: list, token_budget: int = CONTEXT_TOKEN_BUDGET) -> list[str]:
+    """ The passages of `points`, in order, skipping duplicates and those that no longer fit the budget."""
+    passages, seen, used = [], set(), 0
+    for point in points:
+        text = page_content(point).strip()
+        if not text or text in seen:
+            continue
+        cost = count_tokens(text)
+        if used + cost > token_budget:
+            continue
+        passages.append(text)
+        seen.add(text)
+        used += cost
+    return passages
+
+
+def _finish_late(task: asyncio.Task) -> None:
+    _late_expansions.add(task)
+
+    def done(task):
+        _late_expansions.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Late query expansion failed: %s", task.exception())
+    task.add_done_callback(done)
+
+
+async def plan_retrieval(client, collection_name: str, query: str, query_vector, expansion, embed,
+                         deadline_ms: float = EXPANSION_DEADLINE_MS) -> list[tuple]:
+    """
+    Fused [(point, score)] for `query`: its own ranking, plus those of the
+    expanded queries if `expansion` (an awaitable of the query list) is done
+    within `deadline_ms`. `embed` is the coroutine function embedding them.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + deadline_ms / 1000
+    expansion = asyncio.ensure_future(expansion)
+    try:
+        rankings = await search(client, collection_name, [query_vector])
+        try:
+            queries = await asyncio.wait_for(asyncio.shield(expansion), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            PLANS.labels("late").inc()
+            logger.info("Query expansion missed its %.0f ms deadline, answering from the query alone", deadline_ms)
+            _finish_late(expansion)
+            return reciprocal_rank_fusion(rankings)
+        except Exception as e:
+            PLANS.labels("failed").inc()
+            logger.error("Query expansion failed, answering from the query alone: %s", e)
+            return reciprocal_rank_fusion(rankings)
+
+        expanded = [text for text in queries if text != query]
+        if not expanded:
+            PLANS.labels("none").inc()
+            return reciprocal_rank_fusion(rankings)
+        rankings += await search(client, collection_name, await embed(expanded))
+        PLANS.labels("merged").inc()
+        logger.info("Retrieved with the query and %s expansions", len(expanded))
+        return reciprocal_rank_fusion(rankings)
+    except BaseException:
+        # The client is gone or the search failed: so is the reason to expand
+        expansion.cancel()
+        if expansion.done() and not expansion.cancelled():
+            expansion.exception()  # already failed: retrieved, not reported as never retrieved
+        raise
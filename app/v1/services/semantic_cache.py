@@ -0,0 +1,105 @@
+'''
+Semantic cache of query expansions and assistant answers.
+
+Entries are stored against the embedding of the query that produced them. A
+new query whose embedding is within `threshold` cosine similarity of a live
+entry reuses its value, so a rephrased question skips the expansion round trip
+(and, when ANSWER_CACHE_ENABLED, the whole generation). Entries expire after
+SEMANTIC_CACHE_TTL_SECONDS and the least recently used one is evicted when the
+cache is full. Lookups are one matrix-vector product over the cached vectors.
+'''
+from app.v1.metrics import Counter
+
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+
+logger = logging.getLogger("__services/semantic_cache.py__")
+
+SEMANTIC_CACHE_TTL_SECONDS  = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", 3600))
+SEMANTIC_CACHE_MAX_ENTRIES  = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 1000))
+EXPANSION_CACHE_THRESHOLD   = float(os.getenv("EXPANSION_CACHE_THRESHOLD", 0.92))
+ANSWER_CACHE_THRESHOLD      = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.97))
+ANSWER_CACHE_ENABLED        = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+
+LOOKUPS   = Counter("semantic_cache_lookups_total", "Semantic cache lookups", ("cache", "result"))
+EVICTIONS = Counter("semantic_cache_evictions_total", "Live entries evicted to make room", ("cache",))
+
+
+class SemanticCache:
+    def __init__(self, name: str, threshold: float, ttl_seconds: float = SEMANTIC_CACHE_TTL_SECONDS,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES, enabled: bool = True, clock=time.monotonic):
+        self.name = name
+        self.threshold = threshold
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._vectors = None  # (max_entries, dim) float32, unit rows; allocated on the first put
+        self.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._vectors = None
+            self._values = [None] * self.max_entries
+            self._expires = np.zeros(self.max_entries)    # 0: free slot
+            self._last_used = np.zeros(self.max_entries)
+
+    def __len__(self) -> int:
+        return int((self._expires > self.clock()).sum())
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, vector):
+        """ The value of the closest live entry at least `threshold` similar to `vector`, else None."""
+        if not self.enabled:
+            return None
+        query = self._unit(vector)
+        with self._lock:
+            now = self.clock()
+            live = self._expires > now
+            if self._vectors is None or self._vectors.shape[1] != query.shape[0] or not live.any():
+                LOOKUPS.labels(self.name, "miss").inc()
+                return None
+            similarities = np.where(live, self._vectors @ query, -np.inf)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                LOOKUPS.labels(self.name, "miss").inc()
+                return None
+            self._last_used[best] = now
+            LOOKUPS.labels(self.name, "hit").inc()
+            return self._values[best]
+
+    def put(self, vector, value) -> None:
+        if not self.enabled:
+            return
+        entry = self._unit(vector)
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != entry.shape[0]:
+                # First entry, or the embedding model changed: the old vectors are not comparable
+                self._vectors = np.zeros((self.max_entries, entry.shape[0]), dtype=np.float32)
+                self._expires[:] = 0
+            now = self.clock()
+            free = self._expires <= now
+            if free.any():
+                slot = int(np.argmax(free))
+            else:
+                slot = int(np.argmin(self._last_used))
+                EVICTIONS.labels(self.name).inc()
+            self._vectors[slot] = entry
+            self._values[slot] = value
+            self._expires[slot] = now + self.ttl
+            self._last_used[slot] = now
+
+
+expansion_cache = SemanticCache("expansion", EXPANSION_CACHE_THRESHOLD)
+answer_cache = SemanticCache("answer", ANSWER_CACHE_THRESHOLD, enabled=ANSWER_CACHE_ENABLED)
@@ -0,0 +1,268 @@
+'''
+Write-behind synchronization of grade changes into the XLS files.
+
+Grade endpoints record the changed cells in `pending_sheet_writes` in the same
+transaction as the student rows and return as soon as it commits. A background
+worker applies the pending cells in batches per UploadedFile (one workbook save
+per batch) and deletes them once the file is saved.
+
+A write that cannot be applied must not block the file forever (and every
+download with it):
+  - a cell the workbook rejects (unknown sheet, value xlwt cannot write) is
+    left out of the save and its rows are dead-lettered at once;
+  - when the whole batch fails (file missing or unreadable, save error) each
+    row counts an attempt, and rows are dead-lettered after SYNC_MAX_ATTEMPTS.
+Dead-lettered rows keep their error and `failed_at`; they are skipped by the
+sync and reported by /status/sync until the file is deleted.
+'''
+from app.database.database import async_engine
+from app.database.models import UploadedFile, PendingSheetWrite
+from app.v1.services.workers import io_pool
+from app.v1.services.xls_writer import workbook_writer
+
+from fastapi import HTTPException
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from collections import defaultdict
+from datetime import datetime, timezone
+import asyncio
+import json
+import logging
+import os
+import weakref
+
+
+logger = logging.getLogger("__services/sheet_sync.py__")
+
+SYNC_INTERVAL_SECONDS = float(os.getenv("SHEET_SYNC_INTERVAL_SECONDS", 1.0))
+SYNC_BATCH_SIZE       = int(os.getenv("SHEET_SYNC_BATCH_SIZE", 5000))
+SYNC_MAX_ATTEMPTS     = int(os.getenv("SHEET_SYNC_MAX_ATTEMPTS", 5))
+DEAD_LETTER_REPORTED  = 100
+
+_pending = PendingSheetWrite.failed_at.is_(None)
+
+
+def enqueue_writes(db: AsyncSession, file_id, sheet_name: str, cells) -> None:
+    """ Record (row, col, value) cells to be written into `sheet_name`. The caller commits."""
+    db.add_all([
+        PendingSheetWrite(file_id=file_id, sheet_name=sheet_name, row=row, col=col, value=json.dumps(value))
+        for row, col, value in cells
+    ])
+
+
+async def sync_file(bind, file_id, wait: bool = False, batch_size: int = SYNC_BATCH_SIZE) -> int:
+    """
+    Apply one batch of pending writes of a file and delete them. The workbook
+    save itself runs in the io pool.
+
+    The file row is locked (FOR UPDATE) for the duration of the batch so that
+    two workers never apply batches of the same file out of order. With
+    wait=False a file locked by another worker is skipped.
+    Returns the number of pending writes handled (applied or dead-lettered).
+    """
+    async with AsyncSession(bind=bind) as db:
+        file = await db.scalar(
+            select(UploadedFile)
+            .where(UploadedFile.file_id == file_id)
+            .with_for_update(skip_locked=not wait)
+        )
+        if file is None:
+            return 0
+
+        writes = (await db.scalars(
+            select(PendingSheetWrite)
+            .where(PendingSheetWrite.file_id == file_id, _pending)
+            .order_by(PendingSheetWrite.id)
+            .limit(batch_size)
+        )).all()
+        if not writes:
+            await db.rollback()
+            return 0
+
+        # Later writes to the same cell win
+        cells, ids_by_cell = {}, defaultdict(list)
+        for w in writes:
+            cells[(w.sheet_name, w.row, w.col)] = json.loads(w.value)
+            ids_by_cell[(w.sheet_name, w.row, w.col)].append(w.id)
+
+        try:
+            rejected = await io_pool.run(workbook_writer.apply, file.storage_path, cells)
+        except HTTPException:
+            raise  # the io pool is saturated: not the writes' fault
+        except Exception as e:
+            # Nothing was written: one more failed attempt for each row of the batch
+            await _record_failure(db, [w.id for w in writes], f"{type(e).__name__}: {e}")
+            raise
+
+        for cell, error in rejected.items():
+            logger.error("Dead-lettering write of %s in file %s: %s", cell, file_id, error)
+            await _record_failure(db, ids_by_cell.pop(cell), error, dead=True)
+        await db.execute(
+            delete(PendingSheetWrite)
+            .where(PendingSheetWrite.id.in_([write_id for ids in ids_by_cell.values() for write_id in ids]))
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        return len(writes)
+
+
+async def _record_failure(db: AsyncSession, ids, error: str, dead: bool = False) -> None:
+    """ Count a failed attempt on the rows and dead-letter them when `dead` or out of attempts. Commits."""
+    values = {"attempts": PendingSheetWrite.attempts + 1, "error": error[:1000]}
+    if dead:
+        values["failed_at"] = func.now()
+    await db.execute(
+        update(PendingSheetWrite)
+        .where(PendingSheetWrite.id.in_(ids))
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    if not dead:
+        await db.execute(
+            update(PendingSheetWrite)
+            .where(PendingSheetWrite.id.in_(ids), PendingSheetWrite.attempts >= SYNC_MAX_ATTEMPTS)
+            .values(failed_at=func.now())
+            .execution_options(synchronize_session=False)
+        )
+    await db.commit()
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class SheetSyncWorker:
+    def __init__(self, bind=async_engine, interval: float = SYNC_INTERVAL_SECONDS):
+        self.bind = bind
+        self.interval = interval
+        self.errors = {}  # str(file_id) -> last error while syncing that file
+        # file_id -> asyncio.Lock, one sync of a file at a time in this process; an entry
+        # goes away once no sync holds or waits for its lock
+        self._locks = weakref.WeakValueDictionary()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def _lock(self, file_id) -> asyncio.Lock:
+        return self._locks.setdefault(str(file_id), asyncio.Lock())
+
+    async def _sync(self, file_id, bind, wait: bool) -> int:
+        async with self._lock(file_id):
+            try:
+                applied = await sync_file(bind, file_id, wait)
+            except Exception as e:
+                logger.error("Failed to sync pending writes of file %s: %s", file_id, e)
+                self.errors[str(file_id)] = str(e)
+                raise
+            self.errors.pop(str(file_id), None)
+            return applied
+
+    async def flush_file(self, file_id, bind=None) -> int:
+        """ Apply every pending write of a file, waiting for a sync already in progress."""
+        total = 0
+        while True:
+            applied = await self._sync(file_id, bind or self.bind, wait=True)
+            total += applied
+            if applied < SYNC_BATCH_SIZE:
+                return total
+
+    async def sync_once(self) -> int:
+        """ Apply one batch for every file that has pending writes."""
+        async with AsyncSession(bind=self.bind) as db:
+            file_ids = (await db.scalars(select(PendingSheetWrite.file_id).where(_pending).distinct())).all()
+
+        total = 0
+        for file_id in file_ids:
+            try:
+                total += await self._sync(file_id, self.bind, wait=False)
+            except Exception:
+                continue  # recorded in self.errors, retried on the next pass
+        return total
+
+    def wake(self) -> None:
+        """ Start the next pass now instead of at the end of the interval."""
+        self._wakeup.set()
+
+    async def run(self) -> None:
+        logger.info("Sheet sync worker started (interval %ss)", self.interval)
+        while True:
+            try:
+                await self.sync_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Sheet sync pass failed: %s", e)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Drain what is left so nothing waits for the next start
+        try:
+            await self.sync_once()
+        except Exception as e:
+            logger.error("Final sheet sync failed: %s", e)
+
+    async def lag(self, db: AsyncSession, file_id=None) -> list:
+        """ Pending writes and age of the oldest one, per file (or of one file)."""
+        now = datetime.now(timezone.utc)
+        query = (
+            select(
+                PendingSheetWrite.file_id,
+                func.count(PendingSheetWrite.id).label("pending"),
+                func.min(PendingSheetWrite.created_at).label("oldest"),
+            )
+            .where(_pending)
+            .group_by(PendingSheetWrite.file_id)
+        )
+        if file_id is not None:
+            query = query.where(PendingSheetWrite.file_id == file_id)
+        rows = (await db.execute(query)).all()
+        return [
+            {
+                "file_id": str(row.file_id),
+                "pending_writes": row.pending,
+                "oldest_pending_at": _as_utc(row.oldest).isoformat(),
+                "lag_seconds": round((now - _as_utc(row.oldest)).total_seconds(), 3),
+                "last_error": self.errors.get(str(row.file_id)),
+            }
+            for row in rows
+        ]
+
+    async def dead_letters(self, db: AsyncSession, file_id=None) -> list:
+        """ The writes given up on (newest first, at most DEAD_LETTER_REPORTED), of one file or all."""
+        query = select(PendingSheetWrite).where(PendingSheetWrite.failed_at.is_not(None))
+        if file_id is not None:
+            query = query.where(PendingSheetWrite.file_id == file_id)
+        writes = (await db.scalars(
+            query.order_by(PendingSheetWrite.failed_at.desc(), PendingSheetWrite.id.desc()).limit(DEAD_LETTER_REPORTED)
+        )).all()
+        return [
+            {
+                "file_id": str(w.file_id),
+                "sheet_name": w.sheet_name,
+                "row": w.row,
+                "col": w.col,
+                "value": json.loads(w.value),
+                "attempts": w.attempts,
+                "error": w.error,
+                "failed_at": _as_utc(w.failed_at).isoformat(),
+            }
+            for w in writes
+        ]
+
+
+sheet_sync = SheetSyncWorker()
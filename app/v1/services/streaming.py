@@ -0,0 +1,150 @@
+'''
+Server-sent events for the assistant.
+
+EventStream runs a producer coroutine (retrieval, then generation) in a task of
+its own and sends what it emits as framed SSE events, one JSON object each:
+
+    event: progress
+    data: {"stage": "retrieving"}
+
+The response starts as soon as the route returns, so the client sees the
+progress events while the query is expanded and the context retrieved, then
+`token` events as the model streams, then `done` (or `error`).
+
+- Tokens are coalesced for up to SSE_FLUSH_INTERVAL_MS into one event
+  (0: one event per token, flushed as it comes).
+- The queue between the producer and the response holds SSE_QUEUE_SIZE items:
+  a slow client pauses the reading of the model's stream instead of having
+  the whole answer buffered in memory.
+- After SSE_HEARTBEAT_SECONDS without an event a `: ping` comment is sent, so
+  proxies keep the connection open and a vanished client is noticed.
+- When the client disconnects, the response stops iterating and the producer
+  task is cancelled, and with it the model call it is awaiting.
+'''
+from app.v1.metrics import Counter, Histogram
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+
+logger = logging.getLogger("__services/streaming.py__")
+
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", 15))
+SSE_FLUSH_INTERVAL_MS = float(os.getenv("SSE_FLUSH_INTERVAL_MS", 0))
+SSE_QUEUE_SIZE        = int(os.getenv("SSE_QUEUE_SIZE", 64))
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}  # no proxy buffering: flush each event
+HEARTBEAT = ": ping\n\n"
+_END = object()
+
+STREAMS     = Counter("sse_streams_total", "Finished event streams", ("outcome",))  # done, error, disconnected
+FIRST_TOKEN = Histogram("sse_first_token_seconds", "Time from the start of a stream to its first token")
+
+
+def format_event(event: str, data) -> str:
+    # json.dumps escapes newlines: the payload always fits on one data line
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class EventStream:
+    def __init__(self, producer, heartbeat_seconds: float = SSE_HEARTBEAT_SECONDS,
+                 flush_interval_ms: float = SSE_FLUSH_INTERVAL_MS, queue_size: int = SSE_QUEUE_SIZE):
+        """ `producer(stream)` emits through the stream; what it returns is sent with the `done` event."""
+        self.producer = producer
+        self.heartbeat = heartbeat_seconds
+        self.flush_interval = flush_interval_ms / 1000
+        self.queue_size = queue_size
+        self._queue = None
+        self._task = None
+        self._started = None
+        self._first_token = True
+
+    # ---- producer side ----
+    async def emit(self, event: str, data) -> None:
+        await self._queue.put(format_event(event, data))
+
+    async def progress(self, stage: str, **details) -> None:
+        await self.emit("progress", {"stage": stage, **details})
+
+    async def token(self, text: str) -> None:
+        if text:
+            await self._queue.put((text,))
+
+    async def relay(self, chunks) -> str:
+        """ Send the content of a chat model's astream() as tokens. Returns the whole text."""
+        parts = []
+        async for chunk in chunks:
+            parts.append(chunk.content)
+            await self.token(chunk.content)
+        return "".join(parts)
+
+    async def _produce(self) -> None:
+        try:
+            done = await self.producer(self)
+            await self.emit("done", done or {})
+            STREAMS.labels("done").inc()
+        except Exception as e:
+            STREAMS.labels("error").inc()
+            if isinstance(e, HTTPException):
+                error = {"status": e.status_code, "detail": e.detail}
+            else:
+                logger.error("Event stream failed: %s", e)
+                error = {"status": 500, "detail": "The assistant failed to answer."}
+            await self.emit("error", error)
+        await self._queue.put(_END)
+
+    # ---- response side ----
+    def _token_event(self, parts: list[str]) -> str:
+        if self._first_token:
+            self._first_token = False
+            FIRST_TOKEN.observe(time.perf_counter() - self._started)
+        return format_event("token", {"text": "".join(parts)})
+
+    async def events(self):
+        """ The framed events, heartbeats included, until the producer is done."""
+        self._started = time.perf_counter()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.create_task(self._produce())
+        tokens, deadline = [], None
+        try:
+            while True:
+                wait = self.heartbeat if not tokens else max(deadline - time.monotonic(), 0)
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), wait)
+                except asyncio.TimeoutError:
+                    if tokens:
+                        yield self._token_event(tokens)
+                        tokens = []
+                    else:
+                        yield HEARTBEAT
+                    continue
+
+                if isinstance(item, tuple):
+                    if not tokens:
+                        deadline = time.monotonic() + self.flush_interval
+                    tokens.append(item[0])
+                    if time.monotonic() >= deadline:
+                        yield self._token_event(tokens)
+                        tokens = []
+                    continue
+                if tokens:
+                    yield self._token_event(tokens)
+                    tokens = []
+                if item is _END:
+                    return
+                yield item
+        finally:
+            if not self._task.done():
+                # The client went away: stop the model calls the producer is waiting on
+                self._task.cancel()
+                STREAMS.labels("disconnected").inc()
+                logger.info("Client disconnected, event stream cancelled")
+
+    def response(self) -> StreamingResponse:
+        return StreamingResponse(self.events(), media_type="text/event-stream", headers=SSE_HEADERS)
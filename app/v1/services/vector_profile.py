@@ -0,0 +1,113 @@
+'''
+Storage profile of the RAG collection: embedding dimensions, quantization and
+HNSW parameters, all from the environment.
+
+- EMBEDDING_DIMENSIONS truncates the embeddings (text-embedding-3 models are
+  trained so that a prefix of the vector is itself a usable embedding; OpenAI
+  truncates and renormalises server side with the `dimensions` parameter).
+- VECTOR_QUANTIZATION=scalar keeps int8 copies of the vectors in RAM (4x
+  smaller), =binary one bit per dimension (32x smaller). With
+  VECTOR_ON_DISK=true the float32 originals stay on disk and are only read to
+  rescore the SEARCH_OVERSAMPLING x limit candidates found with the quantized
+  ones.
+- HNSW_M / HNSW_EF_CONSTRUCT shape the index, HNSW_EF_SEARCH the search.
+
+The profile only applies when the collection is created: changing it means
+recreating (re-indexing) the collection.
+'''
+from dataclasses import dataclass
+from qdrant_client.models import (
+    BinaryQuantization, BinaryQuantizationConfig, Datatype, Distance, HnswConfigDiff, QuantizationSearchParams,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType, SearchParams, VectorParams,
+)
+
+import math
+import os
+
+
+def _bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+
+def _optional_int(name: str):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+QUANTIZATIONS = ("none", "scalar", "binary")
+DATATYPES = {"float32": 4, "float16": 2}  # bytes per dimension
+
+
+@dataclass(frozen=True)
+class VectorProfile:
+    dimensions: int = None          # None: the embedding model's own size
+    datatype: str = "float32"
+    quantization: str = "none"
+    quantization_always_ram: bool = True
+    on_disk: bool = False           # originals on disk (sensible only with quantization)
+    rescore: bool = True
+    oversampling: float = 2.0
+    hnsw_m: int = 16
+    hnsw_ef_construct: int = 100
+    hnsw_ef_search: int = 128
+
+    def __post_init__(self):
+        if self.quantization not in QUANTIZATIONS:
+            raise ValueError(f"VECTOR_QUANTIZATION must be one of {QUANTIZATIONS}, got {self.quantization!r}")
+        if self.datatype not in DATATYPES:
+            raise ValueError(f"VECTOR_DATATYPE must be one of {tuple(DATATYPES)}, got {self.datatype!r}")
+
+    @classmethod
+    def from_env(cls) -> "VectorProfile":
+        return cls(
+            dimensions=_optional_int("EMBEDDING_DIMENSIONS"),
+            datatype=os.getenv("VECTOR_DATATYPE", "float32"),
+            quantization=os.getenv("VECTOR_QUANTIZATION", "none"),
+            quantization_always_ram=_bool("VECTOR_QUANTIZATION_ALWAYS_RAM", True),
+            on_disk=_bool("VECTOR_ON_DISK", False),
+            rescore=_bool("SEARCH_RESCORE", True),
+            oversampling=float(os.getenv("SEARCH_OVERSAMPLING", 2.0)),
+            hnsw_m=int(os.getenv("HNSW_M", 16)),
+            hnsw_ef_construct=int(os.getenv("HNSW_EF_CONSTRUCT", 100)),
+            hnsw_ef_search=int(os.getenv("HNSW_EF_SEARCH", 128)),
+        )
+
+    # ---- collection creation ----
+    def vectors_config(self, size: int) -> VectorParams:
+        return VectorParams(
+            size=size,
+            distance=Distance.COSINE,
+            on_disk=self.on_disk,
+            datatype=Datatype.FLOAT16 if self.datatype == "float16" else Datatype.FLOAT32,
+            hnsw_config=HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct),
+        )
+
+    def quantization_config(self):
+        if self.quantization == "scalar":
+            return ScalarQuantization(scalar=ScalarQuantizationConfig(
+                type=ScalarType.INT8, quantile=0.99, always_ram=self.quantization_always_ram,
+            ))
+        if self.quantization == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=self.quantization_always_ram))
+        return None
+
+    # ---- search ----
+    def search_params(self) -> SearchParams:
+        quantization = None
+        if self.quantization != "none":
+            quantization = QuantizationSearchParams(rescore=self.rescore, oversampling=self.oversampling)
+        return SearchParams(hnsw_ef=self.hnsw_ef_search, quantization=quantization)
+
+    # ---- sizing ----
+    def ram_bytes_per_vector(self, size: int) -> int:
+        """ Approximate RAM per point: vectors held in memory plus HNSW links (payloads excluded)."""
+        size = self.dimensions or size
+        stored = 0 if self.on_disk and self.quantization != "none" else size * DATATYPES[self.datatype]
+        if self.quantization == "scalar":
+            stored += size
+        elif self.quantization == "binary":
+            stored += math.ceil(size / 8)
+        return stored + self.hnsw_m * 2 * 4  # layer-0 links, 4 bytes each
+
+
+vector_profile = VectorProfile.from_env()
@@ -0,0 +1,130 @@
+'''
+Worker pools that keep XLS parsing and blocking file I/O off the event loop.
+
+- cpu_pool: process based, for CPU-heavy work (parsing workbooks).
+- io_pool:  thread based, for file reads/writes and workbook saves.
+- hash_pool: thread based, for password hashing (argon2 releases the GIL), kept
+  apart so that a login storm cannot take the threads the file I/O needs.
+
+Each pool accepts at most `workers + queue_depth` jobs at a time. When it is
+saturated the request is rejected with 503 and a Retry-After header instead of
+piling up behind the other uploads.
+'''
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from fastapi import HTTPException, status
+from app.v1.metrics import Counter, Gauge, Histogram
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+
+
+logger = logging.getLogger("__services/workers.py__")
+
+CPU_WORKERS         = int(os.getenv("XLS_PROCESS_WORKERS", min(os.cpu_count() or 1, 4)))
+CPU_QUEUE_DEPTH     = int(os.getenv("XLS_PROCESS_QUEUE_DEPTH", 8))
+IO_WORKERS          = int(os.getenv("IO_THREAD_WORKERS", 8))
+IO_QUEUE_DEPTH      = int(os.getenv("IO_THREAD_QUEUE_DEPTH", 32))
+HASH_WORKERS        = int(os.getenv("HASH_THREAD_WORKERS", 2))
+HASH_QUEUE_DEPTH    = int(os.getenv("HASH_THREAD_QUEUE_DEPTH", 16))
+RETRY_AFTER_SECONDS = int(os.getenv("WORKER_RETRY_AFTER_SECONDS", 5))
+PROCESS_START_METHOD = os.getenv("XLS_PROCESS_START_METHOD", "spawn")
+
+
+QUEUE_WAIT = Histogram("worker_queue_wait_seconds", "Time a job waited before a worker picked it up", ["pool"])
+EXECUTION  = Histogram("worker_execution_seconds", "Time a worker spent executing a job", ["pool"])
+IN_FLIGHT  = Gauge("worker_jobs_in_flight", "Jobs queued or running in the pool", ["pool"])
+REJECTED   = Counter("worker_jobs_rejected_total", "Jobs rejected because the pool was saturated", ["pool"])
+
+
+def _timed_call(fn, args, kwargs):
+    """ Runs inside the worker: returns (start wall-clock, execution time, result)."""
+    started = time.time()
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return started, time.perf_counter() - t0, result
+
+
+class WorkerPool:
+    def __init__(self, name: str, kind: str, max_workers: int, queue_depth: int, retry_after: int = RETRY_AFTER_SECONDS,
+                 busy_detail: str = "Server is busy processing other files. Please retry shortly."):
+        if kind not in ("process", "thread"):
+            raise ValueError(f"Unknown pool kind: {kind}")
+        self.name = name
+        self.kind = kind
+        self.max_workers = max_workers
+        self.queue_depth = queue_depth
+        self.retry_after = retry_after
+        self.busy_detail = busy_detail
+        self.pending = 0
+        self._executor = None
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.queue_depth
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context(PROCESS_START_METHOD),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+            logger.info("Started %s pool '%s' with %s workers", self.kind, self.name, self.max_workers)
+        return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        """ Run `fn(*args, **kwargs)` in the pool, or fail fast with 503 when it is saturated."""
+        if self.pending >= self.capacity:
+            REJECTED.labels(self.name).inc()
+            logger.warning("Pool '%s' saturated (%s/%s), rejecting job", self.name, self.pending, self.capacity)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=self.busy_detail,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+
+        self.pending += 1
+        IN_FLIGHT.labels(self.name).inc()
+        submitted = time.time()
+        try:
+            loop = asyncio.get_running_loop()
+            started, elapsed, result = await loop.run_in_executor(
+                self._get_executor(), _timed_call, fn, args, kwargs
+            )
+        finally:
+            self.pending -= 1
+            IN_FLIGHT.labels(self.name).dec()
+
+        QUEUE_WAIT.labels(self.name).observe(max(started - submitted, 0.0))
+        EXECUTION.labels(self.name).observe(elapsed)
+        return result
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "workers": self.max_workers,
+            "queue_depth": self.queue_depth,
+            "pending": self.pending,
+        }
+
+
+cpu_pool = WorkerPool("cpu", "process", CPU_WORKERS, CPU_QUEUE_DEPTH)
+io_pool  = WorkerPool("io", "thread", IO_WORKERS, IO_QUEUE_DEPTH)
+hash_pool = WorkerPool("hash", "thread", HASH_WORKERS, HASH_QUEUE_DEPTH,
+                       busy_detail="Too many sign-in attempts in progress. Please retry shortly.")
+
+
+def shutdown_pools(wait: bool = True) -> None:
+    cpu_pool.shutdown(wait=wait)
+    io_pool.shutdown(wait=wait)
+    hash_pool.shutdown(wait=wait)
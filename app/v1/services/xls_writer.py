@@ -0,0 +1,116 @@
+'''
+Incremental write-back of grades into the uploaded XLS workbooks.
+
+Re-opening a workbook with formatting info and deep-copying it with
+xlutils.copy costs far more than the handful of cells a grade update changes.
+WorkbookWriter keeps the writable copy of recently edited workbooks in memory,
+applies only the dirty cells to it and saves it. The sheet sync worker
+(services/sheet_sync.py) batches the pending cells of a file into one apply().
+'''
+from app.v1.telemetry import timed
+from app.v1.utils import open_xls
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from xlutils.copy import copy
+
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger("__services/xls_writer.py__")
+
+CACHE_SIZE = int(os.getenv("XLS_WRITER_CACHE_SIZE", 32))
+
+
+@dataclass
+class _CachedWorkbook:
+    workbook: object       # xlwt.Workbook produced by xlutils.copy
+    signature: tuple       # (mtime_ns, size) of the file the copy matches
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class WorkbookWriter:
+    def __init__(self, cache_size: int = CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # path -> _CachedWorkbook
+        self._cache_lock = threading.Lock()
+        self._path_locks = {}        # path -> [lock serialising load/write/save of that file, users]
+
+    # ---- cache ----
+    @contextmanager
+    def _path_lock(self, path):
+        """ Hold the lock of `path`; it is dropped once no thread holds or waits for it."""
+        with self._cache_lock:
+            entry = self._path_locks.setdefault(path, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._cache_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._path_locks[path]
+
+    def _load(self, path) -> _CachedWorkbook:
+        """ Return an up-to-date writable copy of the workbook, opening it only on a miss."""
+        with self._cache_lock:
+            entry = self._cache.get(path)
+            if entry is not None:
+                self._cache.move_to_end(path)
+
+        if entry is None or entry.signature != _file_signature(path):
+            logger.info("Loading writable copy of %s", path)
+            with timed("xls", "load"):
+                entry = _CachedWorkbook(
+                    workbook=copy(open_xls(path=path, formatting_info=True)),
+                    signature=_file_signature(path),
+                )
+            with self._cache_lock:
+                self._cache[path] = entry
+                self._cache.move_to_end(path)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return entry
+
+    def invalidate(self, path) -> None:
+        """ Drop the cached copy, e.g. when the file is replaced or deleted."""
+        with self._cache_lock:
+            self._cache.pop(path, None)
+
+    # ---- writes ----
+    def apply(self, path, cells: dict) -> dict:
+        """
+        Write {(sheet_name, row, col): value} cells into the workbook at `path` and save it.
+        Cells that cannot be written (unknown sheet, value xlwt rejects) are left
+        out and returned as {cell: error}; the others are saved. Raises when the
+        file cannot be loaded or saved. Blocking: run it in the io pool.
+        """
+        rejected = {}
+        with self._path_lock(path):
+            entry = self._load(path)
+            try:
+                with timed("xls", "save"):
+                    for cell, value in cells.items():
+                        sheet_name, row, col = cell
+                        try:
+                            entry.workbook.get_sheet(sheet_name).write(row, col, value)
+                        except Exception as e:
+                            rejected[cell] = f"{type(e).__name__}: {e}"
+                    entry.workbook.save(path)
+                entry.signature = _file_signature(path)
+            except Exception:
+                # The in-memory copy may now differ from the file on disk
+                self.invalidate(path)
+                raise
+        return rejected
+
+
+workbook_writer = WorkbookWriter()
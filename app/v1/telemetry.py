@@ -0,0 +1,196 @@
+'''
+Per request telemetry, reported through the metrics registry (served on
+/metrics in the Prometheus text format).
+
+MetricsMiddleware is a plain ASGI middleware; BaseHTTPMiddleware would add a
+task and a pair of memory streams per request, more than the bookkeeping
+itself. For every HTTP request it records:
+  - http_request_duration_seconds{method, route, status}, up to the last
+    body chunk (for event streams: until the stream ends);
+  - http_requests_in_flight;
+  - http_response_size_bytes{method, route}.
+`route` is the path template of the matched route ("/me/classrooms/{classroom_id}"),
+or "unmatched", so that the label values stay bounded.
+
+While the request runs, a RequestStats sits in a context variable. The code
+running in the request's task, or in the tasks it starts, adds to it:
+  - instrument_engine() hooks the cursor events of an engine: db_query_seconds
+    (its _count is the number of statements), and per request
+    db_queries_per_request and db_time_per_request_seconds{route};
+  - timed(service, operation) around calls to Qdrant, OpenAI and the XLS files:
+    external_call_seconds{service, operation}, and the time spent per service
+    in the request's stats;
+  - phase(name) adds the time of a block to the request's stats only (auth).
+Worker threads and processes do not see the context variable: jobs sent to
+the pools are timed at the call site.
+
+With SERVER_TIMING on, the response carries what the request had spent when
+its headers were sent, as a Server-Timing header: auth, db, xls, vector
+(Qdrant), llm (OpenAI) and total, in milliseconds. For a streamed response
+the headers go out first: the phases cover the work done before the stream.
+
+The unlabelled series are resolved once, at import, and the middleware keeps
+the series of each (method, route, status): the per-request cost is a few
+perf_counter calls and histogram updates (benchmarks/bench_metrics.py).
+'''
+from app.v1.metrics import Gauge, Histogram
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from sqlalchemy import event
+
+import os
+import time
+
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() in ("1", "true", "yes")
+
+# Server-Timing name of each phase, in the order of the header
+SERVER_TIMING_NAMES = {"auth": "auth", "db": "db", "xls": "xls", "qdrant": "vector", "openai": "llm"}
+
+SIZE_BUCKETS  = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+HTTP_LATENCY   = Histogram("http_request_duration_seconds", "Duration of HTTP requests", ("method", "route", "status"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being served")
+HTTP_SIZE      = Histogram("http_response_size_bytes", "Size of HTTP response bodies", ("method", "route"), buckets=SIZE_BUCKETS)
+
+DB_QUERY_LATENCY       = Histogram("db_query_seconds", "Duration of one SQL statement")
+DB_QUERIES_PER_REQUEST = Histogram("db_queries_per_request", "SQL statements per HTTP request", ("route",), buckets=COUNT_BUCKETS)
+DB_TIME_PER_REQUEST    = Histogram("db_time_per_request_seconds", "Time spent in SQL statements per HTTP request", ("route",))
+
+EXTERNAL_CALLS = Histogram("external_call_seconds", "Duration of calls to Qdrant, OpenAI and the XLS files", ("service", "operation"))
+
+_in_flight = HTTP_IN_FLIGHT.labels()
+_query_latency = DB_QUERY_LATENCY.labels()
+
+
+@dataclass
+class RequestStats:
+    route: str = "unmatched"
+    db_queries: int = 0
+    db_seconds: float = 0.0
+    services: dict = field(default_factory=dict)  # service or phase -> seconds spent in it
+
+    def add(self, name: str, seconds: float) -> None:
+        self.services[name] = self.services.get(name, 0.0) + seconds
+
+    def server_timing(self, total: float) -> str:
+        spent = dict(self.services, db=self.db_seconds)
+        metrics = []
+        for name, label in SERVER_TIMING_NAMES.items():
+            if spent.get(name):
+                metric = f"{label};dur={spent[name] * 1000:.1f}"
+                if name == "db":
+                    metric += f';desc="{self.db_queries} queries"'
+                metrics.append(metric)
+        metrics.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+_current = ContextVar("request_stats", default=None)
+
+
+def current_request() -> RequestStats:
+    """ The stats of the request being served, None outside of a request."""
+    return _current.get()
+
+
+def stats_in(context) -> RequestStats:
+    """ The request stats held by a contextvars.Context, e.g. that of a task."""
+    return context.get(_current)
+
+
+@contextmanager
+def timed(service: str, operation: str):
+    """ Time the block into external_call_seconds and the current request's stats."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        EXTERNAL_CALLS.labels(service, operation).observe(elapsed)
+        stats = _current.get()
+        if stats is not None:
+            stats.add(service, elapsed)
+
+
+@contextmanager
+def phase(name: str):
+    """ Add the time of the block to the current request's stats."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _current.get()
+        if stats is not None:
+            stats.add(name, time.perf_counter() - start)
+
+
+def instrument_engine(engine) -> None:
+    """ Count the statements of `engine` (the sync_engine of an async engine) and time them."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._telemetry_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._telemetry_start
+        _query_latency.observe(elapsed)
+        stats = _current.get()
+        if stats is not None:
+            stats.db_queries += 1
+            stats.db_seconds += elapsed
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self._series = {}  # (method, route, status) -> the histograms of that request kind
+
+    def _series_for(self, method: str, route: str, status: int) -> tuple:
+        series = self._series.get((method, route, status))
+        if series is None:
+            series = self._series[(method, route, status)] = (
+                HTTP_LATENCY.labels(method, route, status),
+                HTTP_SIZE.labels(method, route),
+                DB_QUERIES_PER_REQUEST.labels(route),
+                DB_TIME_PER_REQUEST.labels(route),
+            )
+        return series
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        response = {"status": 500, "size": 0}
+
+        async def send_and_measure(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                if SERVER_TIMING:
+                    timing = stats.server_timing(time.perf_counter() - start).encode("latin-1")
+                    message["headers"] = [*message.get("headers", ()), (b"server-timing", timing)]
+            elif message["type"] == "http.response.body":
+                response["size"] += len(message.get("body", b""))
+            await send(message)
+
+        _in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_and_measure)
+        finally:
+            elapsed = time.perf_counter() - start
+            _in_flight.dec()
+            _current.reset(token)
+            # The router records the matched route in the scope
+            stats.route = getattr(scope.get("route"), "path", "unmatched")
+            latency, size, queries, db_time = self._series_for(scope["method"], stats.route, response["status"])
+            latency.observe(elapsed)
+            size.observe(response["size"])
+            queries.observe(stats.db_queries)
+            db_time.observe(stats.db_seconds)
@@ -4,81 +4,129 @@ This file contains utility functions and classes for the Niqatech backend applic
 
 # App packages
 from app.v1.schemas.schemas import  QueryExpantion
+from app.v1.metrics import Counter
+from app.v1.telemetry import timed
+from app.v1.services.retrieval import reciprocal_rank_fusion, search
+from app.v1.services.semantic_cache import expansion_cache
 
 # Langchain
-from langchain.chat_models import init_chat_model
 from langchain_core.prompts import ChatPromptTemplate
 
 
 from typing import List, Dict
 
 
+import os
 import re
 import xlrd
 from dotenv import load_dotenv
 import logging
 
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
 logger = logging.getLogger("__utils.py__")
 
 load_dotenv()
 
 
-def parse_xls(content):
-    """ Parse the content of an XLS file and extract structured data."""
+# Layout of the ministry grade sheets
+SCHOOL_NAME_ROW   = 3
+HEADER_ROW        = 4
+FIRST_STUDENT_ROW = 8
+STUDENT_COLUMNS   = ("id", "last_name", "first_name", "date_of_birth",
+                     "evaluation", "first_assignment", "final_exam", "observation")
 
+# Header regexes are compiled once instead of on every sheet
+TERM_RE    = re.compile(r"الفصل\s+(\S+)")
+YEAR_RE    = re.compile(r"السنة الدراسية\s*:\s*(\d{4}-\d{4})")
+LEVEL_RE   = re.compile(r"الفوج التربوي\s*:\s*([^\d\n\r]+?\d)")
+SUBJECT_RE = re.compile(r"مادة\s*:\s*(.+)")
+
+
+def open_xls(content=None, path=None, formatting_info=False, on_demand=False):
+    """ Open an XLS workbook from bytes or from a path.
+
+    Formatting info is expensive to load and is only needed when the workbook
+    is copied for a write-back (xlutils.copy), so it is off by default.
+    """
+    return xlrd.open_workbook(
+        filename=path,
+        file_contents=content,
+        ignore_workbook_corruption=True,
+        formatting_info=formatting_info,
+        on_demand=on_demand,
+    )
 
-    workbook = xlrd.open_workbook(file_contents=content, ignore_workbook_corruption=True, formatting_info=True)
-    
-    data = {"classrooms": []}  # Start with a dictionary containing a list of classrooms
 
-    for i in range(len(workbook.sheets()) - 1):
-        # Access the current sheet
-        sheet = workbook.sheet_by_index(i)
-        sheet_name = sheet.name
-        #print(f"Processing sheet: {sheet_name}")
-        
-        text   = sheet.row_values(4)[0]
-        term = re.search(r"الفصل\s+(\S+)", text).group(1)
-        year = re.search(r"السنة الدراسية\s*:\s*(\d{4}-\d{4})", text).group(1)
-        level = re.search(r"الفوج التربوي\s*:\s*([^\d\n\r]+?\d)", text).group(1).strip()
-        subject = re.search(r"مادة\s*:\s*(.+)", text).group(1).strip()
-
-        classroom = {
-            "school_name": sheet.row_values(3)[0],
-            "term": term,
-            "year": year,
-            "level": level,
-            "subject": subject,
-            "classroom_name": f"Sheet-{i}",
-            "sheet_name": sheet_name,
-            "number_of_students": sheet.nrows - 8,
-            "students": []  # Store students in a list
+def parse_sheet(sheet, index):
+    """ Parse a single grade sheet. Every column is read once with col_values."""
+
+    text = sheet.cell_value(HEADER_ROW, 0)
+    nrows = sheet.nrows
+    n_students = max(nrows - FIRST_STUDENT_ROW, 0)
+
+    columns = [
+        sheet.col_values(col, FIRST_STUDENT_ROW) if col < sheet.ncols else [""] * n_students
+        for col in range(len(STUDENT_COLUMNS))
+    ]
+
+    students = [
+        {
+            "id": int(student_id),
+            "row": row,
+            "last_name": last_name,
+            "first_name": first_name,
+            "date_of_birth": date_of_birth,
+            "evaluation": evaluation,
+            "first_assignment": first_assignment,
+            "final_exam": final_exam,
+            "observation": observation,
         }
+        for row, (student_id, last_name, first_name, date_of_birth,
+                  evaluation, first_assignment, final_exam, observation)
+        in enumerate(zip(*columns), start=FIRST_STUDENT_ROW)
+    ]
+
+    return {
+        "school_name": sheet.cell_value(SCHOOL_NAME_ROW, 0),
+        "term": TERM_RE.search(text).group(1),
+        "year": YEAR_RE.search(text).group(1),
+        "level": LEVEL_RE.search(text).group(1).strip(),
+        "subject": SUBJECT_RE.search(text).group(1).strip(),
+        "classroom_name": f"Sheet-{index}",
+        "sheet_name": sheet.name,
+        "number_of_students": nrows - FIRST_STUDENT_ROW,
+        "students": students,
+    }
+
+
+def parse_xls(content, formatting_info=False):
+    """ Parse the content of an XLS file and extract structured data.
+
+    Sheets are loaded on demand and released as soon as they are parsed, so
+    large multi-sheet workbooks are read in a single pass per sheet.
+    """
+    workbook = open_xls(content=content, formatting_info=formatting_info, on_demand=True)
 
-        for row in range(8, sheet.nrows):
-            student = {
-                "id": int(sheet.row_values(row)[0]),
-                "row": row,
-                "last_name": sheet.row_values(row)[1],
-                "first_name": sheet.row_values(row)[2],
-                "date_of_birth": sheet.row_values(row)[3],
-                "evaluation": sheet.row_values(row)[4],
-                "first_assignment": sheet.row_values(row)[5],
-                "final_exam": sheet.row_values(row)[6],
-                "observation": sheet.row_values(row)[7]
-            }
-            classroom["students"].append(student)
-
-        data["classrooms"].append(classroom)  # Add classroom to the list
+    data = {"classrooms": []}  # Start with a dictionary containing a list of classrooms
+    try:
+        # The last sheet of the ministry export is a summary, not a classroom
+        for i in range(workbook.nsheets - 1):
+            sheet = workbook.sheet_by_index(i)
+            data["classrooms"].append(parse_sheet(sheet, i))
+            workbook.unload_sheet(i)
+    finally:
+        workbook.release_resources()
 
     return data  # Return the dictionary
 
 
+def write_file(path, content) -> None:
+    """ Write bytes to `path`, creating the parent directory if needed."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
 def to_float_or_none(value):
     try:
         return float(value)
@@ -90,9 +138,10 @@ def parse_file():
 
 
 
-async def expand_query(query: str) -> List[str]:
+async def expand_query(query: str, query_expansion_model) -> List[str]:
     """
     Expand the given query into a list of similar queries using a language model.
+    `query_expansion_model` is the shared chat model with structured QueryExpantion output.
     """
     
     query_template = (
@@ -102,20 +151,17 @@ async def expand_query(query: str) -> List[str]:
     "Provide 4 different expanded queries in a list format."
     )
 
-    query_expansion_model = init_chat_model(model="gpt-4.1",
-                                            model_provider="openai"
-                                            ).with_structured_output(QueryExpantion)
-
     prompt_template = ChatPromptTemplate([
         ("system", query_template),
         ("human", f"{query}"),
     ])
 
     messages = prompt_template.invoke({"query": query})
-    queries = await query_expansion_model.ainvoke(messages)
+    with timed("openai", "expansion"):
+        queries = await query_expansion_model.ainvoke(messages)
 
     queries = list(queries.queries)
-    logger.info(f"Queries after expantion:\n {queries}")
+    logger.debug("Queries after expantion:\n %s", queries)
 
     if isinstance(queries, list):
         queries.append(query)
@@ -125,44 +171,70 @@ async def expand_query(query: str) -> List[str]:
     
     return queries
 
-from qdrant_client.http.models import SearchRequest
+# Expansion is skipped for queries of at most EXPANSION_MIN_WORDS words, and for
+# queries whose own best match scores at least EXPANSION_SKIP_SCORE (0: off)
+EXPANSION_MIN_WORDS  = int(os.getenv("EXPANSION_MIN_WORDS", 3))
+EXPANSION_SKIP_SCORE = float(os.getenv("EXPANSION_SKIP_SCORE", 0))
 
+EXPANSIONS = Counter("query_expansions_total", "Queries by how their expansion was obtained", ("source",))
 
-async def retrieve_from_qdrant(embedding_queries, collection_name, client):
+
+async def expand_query_cached(query: str, query_vector, query_expansion_model, client, collection_name) -> List[str]:
     """
-    Retrieve documents from Qdrant based on the provided embedding queries.
+    expand_query, reusing the expansion of a semantically close earlier query
+    (expansion_cache) and skipping it for short or high-confidence queries.
     """
-    scored_points = await client.search_batch(
-      collection_name=collection_name,
-      requests=[SearchRequest(vector=vector, limit=2) for vector in embedding_queries],
-   )
-    
-    logger.info(f"Results type: {type(scored_points)}")
-    logger.info(f"Number of results: {len(scored_points)}")
-    
-    scored_points = [item for sublist in scored_points for item in sublist]  # Flatten the list of lists
-    logger.info(f"Number of scored points after flattening: {len(scored_points)}")
-
-    # Get content from ids 
-    ids = [score_point.id for score_point in scored_points]
-    logger.info(f"Number of unique ids: {len(ids)}")
+    if len(query.split()) <= EXPANSION_MIN_WORDS:
+        EXPANSIONS.labels("skipped_short").inc()
+        return [query]
+
+    expansions = expansion_cache.get(query_vector)
+    if expansions is not None:
+        EXPANSIONS.labels("cache").inc()
+        return [*expansions, query]
+
+    if EXPANSION_SKIP_SCORE:
+        with timed("qdrant", "query"):
+            best = await client.query_points(collection_name=collection_name, query=query_vector, limit=1)
+        if best.points and best.points[0].score >= EXPANSION_SKIP_SCORE:
+            EXPANSIONS.labels("skipped_confident").inc()
+            return [query]
+
+    queries = await expand_query(query, query_expansion_model)
+    EXPANSIONS.labels("model").inc()
+    expansion_cache.put(query_vector, queries[:-1])  # without the query itself, see expand_query
+    return queries
 
-    results = await client.retrieve(
-        collection_name=collection_name,
-        ids=ids,
-        )
 
-    return results
+async def retrieve_from_qdrant(embedding_queries, collection_name, client):
+    """
+    Retrieve documents from Qdrant based on the provided embedding queries.
+    All queries go in one request with their payloads; the rankings are fused
+    (reciprocal rank fusion) into [(point, fused score)] of distinct points.
+    """
+    rankings = await search(client, collection_name, embedding_queries)
+    fused = reciprocal_rank_fusion(rankings)
+    logger.info("Retrieved %s hits, %s distinct points", sum(len(ranking) for ranking in rankings), len(fused))
+    return fused
 
 
 
 
 from passlib.context import CryptContext
 from pwdlib import PasswordHash
+from pwdlib.hashers.argon2 import Argon2Hasher
+
+# Argon2 cost parameters, memory in KiB. Hashes made with other parameters
+# still verify and are upgraded on the next successful login.
+ARGON2_TIME_COST   = int(os.getenv("ARGON2_TIME_COST", 3))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", 65536))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", 4))
 
 #PIPPER = "mysecretpepper"
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-password_hash = PasswordHash.recommended()
+password_hash = PasswordHash((
+    Argon2Hasher(time_cost=ARGON2_TIME_COST, memory_cost=ARGON2_MEMORY_COST, parallelism=ARGON2_PARALLELISM),
+))
 
 
 
@@ -174,3 +246,10 @@ def get_password_hash(password):
 
 def verify_password(plain_password:str, hashed_password:str):
     return password_hash.verify(plain_password, hashed_password)
+
+
+def verify_and_update_password(plain_password:str, hashed_password:str):
+    """ (valid, new_hash): new_hash is set when the hash uses outdated parameters."""
+    if not hashed_password:
+        return False, None
+    return password_hash.verify_and_update(plain_password, hashed_password)
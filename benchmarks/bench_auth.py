@@ -0,0 +1,112 @@
+'''
+Authentication overhead per request: the original get_current_user (a sync
+dependency, run in the thread pool, verifying the HS256 token every time) vs
+the cached claims + revocation list fast path.
+
+    python -m benchmarks.bench_auth
+
+First the dependency alone (microseconds per call), then a minimal FastAPI
+app with one authenticated route, driven through httpx's ASGITransport, so the
+thread pool hop of the sync dependency is included. The revocation list holds
+BENCH_REVOKED revoked tokens; the Bloom filter is compared with a plain dict
+lookup of the digest. Logging is disabled, so the original's two log calls
+cost only the call.
+'''
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+import httpx
+from fastapi import Depends, FastAPI, Request
+from jose import jwt
+
+from app.v1.auth import dependencies, jwt_utils
+from app.v1.auth.token_cache import ClaimsCache, RevocationList
+
+
+N_CALLS = int(os.getenv("BENCH_CALLS", 20000))
+N_REQUESTS = int(os.getenv("BENCH_REQUESTS", 2000))
+N_REVOKED = int(os.getenv("BENCH_REVOKED", 10000))
+SECRET = "bench-secret"
+
+
+def original_get_current_user(request: Request):
+    """ The dependency as it was: header logged, token verified on every call."""
+    dependencies.logger.info(f"Authorization Header: {request.headers.get('Authorization')}")
+    token = request.headers.get("Authorization").split(" ")[1]
+    payload = jwt.decode(token, SECRET, algorithms=["HS256"])
+    dependencies.logger.info(f"Payload! {payload}")
+    return payload.get("user_id")
+
+
+def make_request(token: str) -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "query_string": b"",
+                    "headers": [(b"authorization", f"Bearer {token}".encode())]})
+
+
+def per_call(function, request, n=N_CALLS) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        function(request)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+async def per_call_async(function, request, n=N_CALLS) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        await function(request)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+async def per_request(dependency, token) -> float:
+    app = FastAPI()
+
+    @app.get("/whoami")
+    async def whoami(user=Depends(dependency)):
+        return {"user_id": user}
+
+    headers = {"Authorization": f"Bearer {token}"}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for _ in range(100):  # warm up
+            await client.get("/whoami", headers=headers)
+        start = time.perf_counter()
+        for _ in range(N_REQUESTS):
+            response = await client.get("/whoami", headers=headers)
+        assert response.status_code == 200
+    return (time.perf_counter() - start) / N_REQUESTS * 1e6
+
+
+async def run():
+    jwt_utils.SECRET_KEY, jwt_utils.ALGORITHM = SECRET, "HS256"
+    revoked = RevocationList(path="")
+    for i in range(N_REVOKED):
+        revoked.revoke(hashlib.sha256(f"revoked-{i}".encode()).digest(), None)
+    dependencies.revoked_tokens, dependencies.claims_cache = revoked, ClaimsCache()
+
+    token = await jwt_utils.create_access_token({"user_id": "teacher-1", "email": "teacher@example.com"})
+    request = make_request(token)
+    digest = dependencies.token_digest(token)
+    plain = dict(revoked._revoked)
+
+    print(f"{N_REVOKED} revoked tokens, {revoked.bloom_bits} Bloom filter bits")
+    print(f"{'dependency alone':>34} {'us/call':>8}")
+    print(f"{'original (verify every call)':>34} {per_call(original_get_current_user, request):>8.2f}")
+    print(f"{'token digest':>34} {per_call(lambda r: dependencies.token_digest(token), request):>8.2f}")
+    print(f"{'revocation, dict lookup':>34} {per_call(lambda r: digest in plain, request):>8.2f}")
+    print(f"{'revocation, Bloom filter':>34} {per_call(lambda r: revoked.is_revoked(digest), request):>8.2f}")
+    print(f"{'fast path (cached claims)':>34} {await per_call_async(dependencies.get_current_user, request):>8.2f}")
+
+    print(f"{'one authenticated request':>34} {'us/req':>8}")
+    print(f"{'original (sync, thread pool)':>34} {await per_request(original_get_current_user, token):>8.1f}")
+    print(f"{'fast path':>34} {await per_request(dependencies.get_current_user, token):>8.1f}")
+
+
+def main():
+    logging.disable(logging.INFO)
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+'''
+Query embedding under concurrent chats: one aembed_documents call per chat vs
+EmbeddingBatcher.
+
+    python -m benchmarks.bench_embedding_batcher
+
+The model is HashingEmbeddings behind a simulated remote API: every call costs
+BENCH_EMBED_RTT_MS plus BENCH_EMBED_MS_PER_TEXT per text, and at most
+BENCH_EMBED_CONCURRENCY calls run at once (the provider's connection and rate
+limits). N_CHATS chats each embed 4 expanded queries, a quarter of which are
+shared with other chats.
+'''
+import asyncio
+import os
+import random
+import time
+
+from app.v1.services.embeddings import BATCH_SIZE, EmbeddingBatcher, HashingEmbeddings
+
+
+N_CHATS = int(os.getenv("BENCH_CHATS", 200))
+RTT_MS = float(os.getenv("BENCH_EMBED_RTT_MS", 80))
+MS_PER_TEXT = float(os.getenv("BENCH_EMBED_MS_PER_TEXT", 0.2))
+CONCURRENCY = int(os.getenv("BENCH_EMBED_CONCURRENCY", 8))
+ARRIVAL_SPREAD_MS = 200  # chats arrive uniformly over this interval
+
+
+class RemoteEmbeddings(HashingEmbeddings):
+    def __init__(self):
+        super().__init__(size=256)
+        self.calls = 0
+        self.texts = 0
+        self._slots = None
+
+    async def aembed_documents(self, texts):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(CONCURRENCY)
+        async with self._slots:
+            self.calls += 1
+            self.texts += len(texts)
+            await asyncio.sleep((RTT_MS + MS_PER_TEXT * len(texts)) / 1000)
+            return self.embed_documents(texts)
+
+
+def chat_queries(rng) -> list:
+    common = [f"comment calculer la moyenne {i}" for i in range(20)]
+    return [rng.choice(common)] + [f"question {rng.random()} sur les notes" for _ in range(3)]
+
+
+async def run(embed) -> list:
+    rng = random.Random(0)
+    workload = [(rng.uniform(0, ARRIVAL_SPREAD_MS) / 1000, chat_queries(rng)) for _ in range(N_CHATS)]
+    latencies = []
+
+    async def chat(delay, queries):
+        await asyncio.sleep(delay)
+        start = time.perf_counter()
+        vectors = await embed(queries)
+        assert len(vectors) == len(queries)
+        latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(chat(delay, queries) for delay, queries in workload))
+    return sorted(latencies)
+
+
+def report(name, model, latencies, elapsed):
+    p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+    print(f"{name:>10} {model.calls:>6} {model.texts:>6} {elapsed:>8.2f}s {p(0.5):>8.1f}ms {p(0.99):>8.1f}ms")
+
+
+def main():
+    print(f"{N_CHATS} chats x 4 queries over {ARRIVAL_SPREAD_MS} ms, {RTT_MS:.0f} ms per call, {CONCURRENCY} concurrent calls max")
+    print(f"{'setup':>10} {'calls':>6} {'texts':>6} {'total':>9} {'p50':>10} {'p99':>10}")
+
+    model = RemoteEmbeddings()
+    start = time.perf_counter()
+    latencies = asyncio.run(run(model.aembed_documents))
+    report("per chat", model, latencies, time.perf_counter() - start)
+
+    model = RemoteEmbeddings()
+    batcher = EmbeddingBatcher(model)
+    start = time.perf_counter()
+    latencies = asyncio.run(run(batcher.embed))
+    report("batched", model, latencies, time.perf_counter() - start)
+
+    sizes = BATCH_SIZE.labels().snapshot()
+    print(f"mean batch size: {sizes['sum'] / sizes['count']:.1f} texts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+'''
+Request overhead of logging: disabled vs the original per-module setup vs the
+queue pipeline of app/v1/logs.py.
+
+    python -m benchmarks.bench_logging
+
+A minimal FastAPI app with one route that logs like grade_classroom for a
+classroom of BENCH_STUDENTS students: a message before and after, one per
+student and a dump of the request payload. It is driven through httpx's
+ASGITransport and the log goes to a file.
+
+  disabled          logging.disable()
+  original          basicConfig handler, written and formatted on the event
+                    loop, f-strings, every message at INFO
+  queue, all INFO   the same messages through the queue handler (JSON lines
+                    written by the listener thread), %-style arguments
+  queue             as the code logs now: per-student and payload at DEBUG
+'''
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from app.v1 import logs
+
+
+N_REQUESTS = int(os.getenv("BENCH_REQUESTS", 500))
+N_STUDENTS = int(os.getenv("BENCH_STUDENTS", 35))
+
+logger = logging.getLogger("__routers/classrooms.py__")
+
+
+def original(classroom_id, grades):
+    logger.info(f"Updating grades for classroom '{classroom_id}' by user 'teacher-1'")
+    logger.info(f"New student's grades: {grades}")
+    for update in grades:
+        logger.info(f'Updated grades for student {update["student_id"]}')
+    logger.info(f"Committed updates to the database for {len(grades)} students")
+
+
+def lazy(classroom_id, grades, hot_level=logging.INFO):
+    logger.info("Updating grades for classroom '%s' by user '%s'", classroom_id, "teacher-1")
+    logger.log(hot_level, "New student's grades: %s", grades)
+    for update in grades:
+        logger.log(hot_level, "Updated grades for student %s", update["student_id"])
+    logger.info("Committed updates to the database for %s students", len(grades))
+
+
+async def per_request(log_request) -> float:
+    app = FastAPI()
+
+    @app.put("/classrooms/{classroom_id}/grades")
+    async def grade_classroom(classroom_id: str, grades: list[dict]):
+        log_request(classroom_id, grades)
+        return {"message": f"Updated grades for {len(grades)} students"}
+
+    grades = [{"student_id": i, "new_evaluation": 12.5, "new_first_assignment": 14.0,
+               "new_final_exam": 11.0, "new_observation": "ok"} for i in range(N_STUDENTS)]
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for _ in range(50):  # warm up
+            await client.put("/classrooms/2100007/grades", json=grades)
+        start = time.perf_counter()
+        for _ in range(N_REQUESTS):
+            response = await client.put("/classrooms/2100007/grades", json=grades)
+        assert response.status_code == 200
+    return (time.perf_counter() - start) / N_REQUESTS * 1e6
+
+
+def reset_root():
+    logs.shutdown_logging()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    logging.disable(logging.NOTSET)
+
+
+async def run():
+    path = os.path.join(tempfile.mkdtemp(), "app.log")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    results = []
+
+    logging.disable(logging.CRITICAL)
+    results.append(("disabled", await per_request(original), 0))
+    reset_root()
+
+    logging.basicConfig(filename=path, level=logging.INFO,
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    results.append(("original", await per_request(original), os.path.getsize(path)))
+    reset_root()
+
+    for name, hot_level in (("queue, all INFO", logging.INFO), ("queue", logging.DEBUG)):
+        os.remove(path)
+        with open(path, "a", encoding="utf-8") as f:
+            logs.configure_logging(stream=f, rate_limit=0)
+            results.append((name, await per_request(lambda c, g: lazy(c, g, hot_level)), 0))
+            logs.shutdown_logging()  # waits for the listener to write everything out
+        results[-1] = results[-1][:2] + (os.path.getsize(path),)
+
+    print(f"{N_REQUESTS} requests, {N_STUDENTS} students each")
+    print(f"{'':>16} {'us/req':>8} {'log KB':>8}")
+    for name, us, size in results:
+        print(f"{name:>16} {us:>8.1f} {size // 1024:>8}")
+    print("(the listener formats and writes in its own thread but shares the GIL: under saturation it\n"
+          " still competes with the requests, what the queue removes is the write blocking the loop)")
+
+
+def main():
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+'''
+Login throughput and latency of the rest of the API during a login flood.
+
+    python -m benchmarks.bench_login_flood
+
+The API runs under uvicorn in its own process. A second process keeps
+FLOOD_CLIENTS connections sending POST /auth/login for DURATION seconds while
+this process sends GET /status/ every PROBE_INTERVAL and records its latency.
+Three setups:
+
+- inline:     the original handler, argon2 verification on the event loop
+- hash pool:  the real router, verification in hash_pool (rate limits lifted)
+- rate limit: the real router with the default per-client/email limits
+'''
+import asyncio
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.database.database import Base
+from app.database.models import User
+from app.v1.schemas.schemas import AcademicLevelEnum
+from app.v1.utils import get_password_hash
+
+
+FLOOD_CLIENTS = 32
+DURATION = float(os.getenv("BENCH_DURATION_SECONDS", 5))
+PROBE_INTERVAL = 0.05
+EMAIL, PASSWORD = "flood@example.com", "correct-horse-battery"
+
+
+def seed(url) -> None:
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        db.add(User(id="flood", email=EMAIL, auth_provider="local", hash_password=get_password_hash(PASSWORD),
+                    first_name="A", last_name="B", school_name="S", academic_level=AcademicLevelEnum.secondary,
+                    city="C", subject="M"))
+        db.commit()
+    engine.dispose()
+
+
+def serve(setup: str, url: str, port: int) -> None:
+    """ Server process: the API configured for `setup`."""
+    import logging
+    import uvicorn
+    from fastapi import FastAPI
+
+    from app.main import app
+    from app.v1.auth import jwt_utils, rate_limit
+    from app.v1.routers import status as status_router
+    from app.v1.utils import verify_password
+
+    logging.disable(logging.WARNING)
+    jwt_utils.SECRET_KEY, jwt_utils.ALGORITHM = "bench-secret", "HS256"
+
+    if setup == "inline":
+        # The original shape: hash verification inside the async handler
+        asgi_app = FastAPI()
+        hashed = get_password_hash(PASSWORD)
+
+        @asgi_app.post("/auth/login")
+        async def local_login(data: dict):
+            if data["email"] != EMAIL or not verify_password(data["password"], hashed):
+                return {"message": "Invalid email or password"}
+            return {"message": "User logged in successfully"}
+
+        asgi_app.include_router(status_router.router)
+    else:
+        if setup == "hash pool":
+            rate_limit.client_limiter = rate_limit.email_limiter = rate_limit.SlidingWindowLimiter(10**9, 60)
+        asgi_app = app
+
+    uvicorn.run(asgi_app, host="127.0.0.1", port=port, log_level="error")
+
+
+def attack(base_url: str, results) -> None:
+    """ Flood process: FLOOD_CLIENTS login loops, status code counts put in `results`."""
+    async def run():
+        codes = {}
+        deadline = time.perf_counter() + DURATION
+        limits = httpx.Limits(max_connections=FLOOD_CLIENTS)
+        async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+            async def attacker():
+                while time.perf_counter() < deadline:
+                    response = await client.post("/auth/login", json={"email": EMAIL, "password": PASSWORD})
+                    codes[response.status_code] = codes.get(response.status_code, 0) + 1
+
+            await asyncio.gather(*(attacker() for _ in range(FLOOD_CLIENTS)))
+        return codes
+
+    results.put(asyncio.run(run()))
+
+
+async def probe(base_url: str) -> list:
+    # Latency is measured from the scheduled send time, so time spent waiting
+    # for a blocked server counts too
+    latencies = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        scheduled = time.perf_counter()
+        deadline = scheduled + DURATION
+        while scheduled < deadline:
+            await asyncio.sleep(max(scheduled - time.perf_counter(), 0))
+            await client.get("/status/")
+            latencies.append(time.perf_counter() - scheduled)
+            scheduled += PROBE_INTERVAL
+    return latencies
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(base_url: str) -> None:
+    for _ in range(200):
+        try:
+            httpx.get(f"{base_url}/status/")
+            return
+        except httpx.TransportError:
+            time.sleep(0.05)
+    raise RuntimeError("server did not start")
+
+
+def run_setup(ctx, setup: str, url: str) -> dict:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = ctx.Process(target=serve, args=(setup, url, port), daemon=True)
+    server.start()
+    try:
+        wait_until_up(base_url)
+        results = ctx.Queue()
+        attacker = ctx.Process(target=attack, args=(base_url, results), daemon=True)
+        attacker.start()
+        latencies = asyncio.run(probe(base_url))
+        codes = results.get()
+        attacker.join()
+    finally:
+        server.terminate()
+        server.join()
+
+    return {
+        "logins_per_sec": codes.get(200, 0) / DURATION,
+        "rejected": sum(n for code, n in codes.items() if code != 200),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    seed(url)
+    # Inherited by the server process, which reads it when importing app.database.database
+    os.environ["DATABASE_URL"] = url
+    os.environ["DB_POOL_SIZE"] = str(FLOOD_CLIENTS)
+    ctx = multiprocessing.get_context("spawn")
+
+    print(f"{FLOOD_CLIENTS} clients flooding POST /auth/login for {DURATION:.0f}s, probing GET /status/")
+    print(f"{'setup':>11} {'logins/s':>9} {'rejected':>9} {'status p50':>11} {'status p99':>11}")
+    for setup in ("inline", "hash pool", "rate limit"):
+        r = run_setup(ctx, setup, url)
+        print(f"{setup:>11} {r['logins_per_sec']:>9.1f} {r['rejected']:>9} {r['p50_ms']:>9.1f}ms {r['p99_ms']:>9.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
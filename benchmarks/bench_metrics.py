@@ -0,0 +1,118 @@
+'''
+Overhead of the request telemetry against its budget.
+
+    python -m benchmarks.bench_metrics
+
+Two identical FastAPI apps behind httpx's ASGITransport differ by more than
+the budget from run to run on a shared machine, so the cost is measured part
+by part, each against the same code without it:
+  - MetricsMiddleware around a do-nothing ASGI app;
+  - the SQL cursor hooks, per statement (SELECT 1 on in-memory SQLite);
+  - one timed() block.
+A request of BENCH_QUERIES statements and BENCH_TIMED timed() calls costs
+middleware + statements x hooks + calls x timed(), checked against
+BENCH_BUDGET_US microseconds. About 9 us of the hooks' cost per statement is
+SQLAlchemy dispatching the two cursor events, with empty listeners. Then the
+time to render /metrics.
+'''
+import asyncio
+import os
+import time
+
+from sqlalchemy import create_engine, text
+
+from app.v1.metrics import exposition
+from app.v1.telemetry import MetricsMiddleware, RequestStats, _current, instrument_engine, timed
+
+
+N = int(os.getenv("BENCH_CALLS", 20000))
+QUERIES = int(os.getenv("BENCH_QUERIES", 5))
+TIMED_CALLS = int(os.getenv("BENCH_TIMED", 2))
+BUDGET_US = float(os.getenv("BENCH_BUDGET_US", 100))  # ~10% of a 5-statement request
+
+
+def best_of(measure, repeat=5) -> float:
+    return min(measure() for _ in range(repeat))
+
+
+async def middleware_cost() -> float:
+    class Route:
+        path = "/me/classrooms/{classroom_id}"
+
+    async def app(scope, receive, send):
+        scope["route"] = Route
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        pass
+
+    async def per_call(target) -> float:
+        start = time.perf_counter()
+        for _ in range(N):
+            await target({"type": "http", "method": "GET"}, receive, send)
+        return (time.perf_counter() - start) / N * 1e6
+
+    bare, wrapped = [], []
+    for _ in range(5):
+        bare.append(await per_call(app))
+        wrapped.append(await per_call(MetricsMiddleware(app)))
+    return min(wrapped) - min(bare)
+
+
+def statement_cost() -> float:
+    def per_statement(engine) -> float:
+        with engine.connect() as conn:
+            statement = text("SELECT 1")
+            start = time.perf_counter()
+            for _ in range(N):
+                conn.execute(statement)
+            return (time.perf_counter() - start) / N * 1e6
+
+    plain, hooked = create_engine("sqlite://"), create_engine("sqlite://")
+    instrument_engine(hooked)
+    token = _current.set(RequestStats())
+    try:
+        return best_of(lambda: per_statement(hooked)) - best_of(lambda: per_statement(plain))
+    finally:
+        _current.reset(token)
+
+
+def timed_cost() -> float:
+    def per_call() -> float:
+        start = time.perf_counter()
+        for _ in range(N):
+            with timed("xls", "parse"):
+                pass
+        return (time.perf_counter() - start) / N * 1e6
+
+    token = _current.set(RequestStats())
+    try:
+        return best_of(per_call)
+    finally:
+        _current.reset(token)
+
+
+def main():
+    middleware = asyncio.run(middleware_cost())
+    statement, block = statement_cost(), timed_cost()
+    total = middleware + QUERIES * statement + TIMED_CALLS * block
+
+    print(f"{'':>28} {'us':>8}")
+    print(f"{'middleware, per request':>28} {middleware:>8.1f}")
+    print(f"{'SQL hooks, per statement':>28} {statement:>8.1f}")
+    print(f"{'timed(), per call':>28} {block:>8.1f}")
+    print(f"{f'request ({QUERIES} SQL, {TIMED_CALLS} timed)':>28} {total:>8.1f}  "
+          f"budget {BUDGET_US:.0f} us: {'within' if total <= BUDGET_US else 'OVER'}")
+
+    start = time.perf_counter()
+    for _ in range(100):
+        body = exposition()
+    print(f"/metrics render {(time.perf_counter() - start) / 100 * 1e3:.2f} ms for {len(body) // 1024} KB")
+
+
+if __name__ == "__main__":
+    main()
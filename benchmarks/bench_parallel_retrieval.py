@@ -0,0 +1,128 @@
+'''
+Time to context of a chat: expansion, then embedding and search (the original
+order) vs plan_retrieval, which searches with the query while it is expanded
+and merges the expansions only if they meet a deadline.
+
+    python -m benchmarks.bench_parallel_retrieval
+
+The corpus and expansions come from benchmarks.fixtures.build_corpus and
+Qdrant runs in memory; the models are stubs with injected delays: the
+expansion takes a log-normal time of median BENCH_EXPANSION_MS, an embedding
+call BENCH_EMBED_MS and a search round trip BENCH_SEARCH_MS. The question's
+own embedding is done before the timer starts, as the route needs it for the
+semantic caches anyway. Reported: latency percentiles, how often the relevant
+passage makes it into the context, and how often the expansion was merged.
+'''
+import asyncio
+import logging
+import math
+import os
+import random
+import time
+
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import Distance, PointStruct, VectorParams
+
+from app.v1.services.embeddings import HashingEmbeddings
+from app.v1.services.retrieval import (
+    EXPANSION_DEADLINE_MS, build_context, plan_retrieval, reciprocal_rank_fusion, rerank, search,
+)
+from benchmarks.fixtures import build_corpus
+
+
+EXPANSION_MS = float(os.getenv("BENCH_EXPANSION_MS", 700))
+EMBED_MS = float(os.getenv("BENCH_EMBED_MS", 80))
+SEARCH_MS = float(os.getenv("BENCH_SEARCH_MS", 20))
+N_CHATS = int(os.getenv("BENCH_CHATS", 200))
+EMBEDDING_SIZE = 64
+COLLECTION = "rag_collection"
+
+
+class SlowQdrant:
+    """ The in-memory client with a network round trip added to each search."""
+    def __init__(self, client):
+        self.client = client
+
+    async def query_batch_points(self, **kwargs):
+        await asyncio.sleep(SEARCH_MS / 1000)
+        return await self.client.query_batch_points(**kwargs)
+
+
+def stubs(embeddings):
+    async def expand(expansions, delay):
+        await asyncio.sleep(delay)
+        return expansions
+
+    async def embed(texts):
+        await asyncio.sleep(EMBED_MS / 1000)
+        return embeddings.embed_documents(texts)
+    return expand, embed
+
+
+def sequential(client, expand, embed):
+    async def retrieve(question, vector, expansions, delay):
+        queries = await expand(expansions + [question], delay)
+        rankings = await search(client, COLLECTION, await embed(queries))
+        return reciprocal_rank_fusion(rankings)
+    return retrieve
+
+
+def planned(client, expand, embed, deadline_ms):
+    async def retrieve(question, vector, expansions, delay):
+        return await plan_retrieval(client, COLLECTION, question, vector, expand(expansions + [question], delay),
+                                    embed, deadline_ms=deadline_ms)
+    return retrieve
+
+
+async def evaluate(passages, queries, delays, embeddings, retrieve, deadline_ms) -> dict:
+    slots = asyncio.Semaphore(50)
+
+    async def chat(question, expansions, target, delay):
+        vector = embeddings.embed_query(question)
+        async with slots:
+            start = time.perf_counter()
+            fused = await retrieve(question, vector, expansions, delay)
+            context = build_context(rerank(question, fused))
+            return time.perf_counter() - start, passages[target] in context, delay * 1000 <= deadline_ms
+
+    results = await asyncio.gather(*(chat(*query, delay) for query, delay in zip(queries, delays)))
+    timings = sorted(elapsed for elapsed, _, _ in results)
+    p = lambda q: timings[min(len(timings) - 1, int(len(timings) * q))] * 1000
+    return {"p50": p(0.5), "p90": p(0.9), "recall": sum(found for _, found, _ in results) / len(results),
+            "merged": sum(merged for _, _, merged in results) / len(results)}
+
+
+async def run():
+    passages, queries = build_corpus(n_queries=N_CHATS)
+    rng = random.Random(0)
+    delays = [EXPANSION_MS / 1000 * math.exp(rng.gauss(0, 0.5)) for _ in queries]
+    embeddings = HashingEmbeddings(size=EMBEDDING_SIZE)
+    local = AsyncQdrantClient(location=":memory:")
+    await local.create_collection(COLLECTION, vectors_config=VectorParams(size=EMBEDDING_SIZE, distance=Distance.COSINE))
+    await local.upsert(COLLECTION, points=[
+        PointStruct(id=i, vector=vector, payload={"page_content": text})
+        for i, (text, vector) in enumerate(zip(passages, embeddings.embed_documents(passages)))
+    ])
+    client = SlowQdrant(local)
+    expand, embed = stubs(embeddings)
+
+    print(f"{N_CHATS} chats, expansion median {EXPANSION_MS:.0f} ms, embedding {EMBED_MS:.0f} ms, "
+          f"search {SEARCH_MS:.0f} ms")
+    print(f"{'retrieval':>22} {'p50':>8} {'p90':>8} {'in context':>11} {'expanded':>9}")
+    setups = [("expand, then search", sequential(client, expand, embed), math.inf)]
+    for deadline_ms in (math.inf, EXPANSION_DEADLINE_MS, EXPANSION_MS):
+        name = f"planned, {deadline_ms:.0f} ms" if deadline_ms != math.inf else "planned, no deadline"
+        setups.append((name, planned(client, expand, embed, deadline_ms), deadline_ms))
+    for name, retrieve, deadline_ms in setups:
+        r = await evaluate(passages, queries, delays, embeddings, retrieve, deadline_ms)
+        print(f"{name:>22} {r['p50']:>6.0f}ms {r['p90']:>6.0f}ms {r['recall']:>10.0%} {r['merged']:>8.0%}")
+    await local.close()
+
+
+def main():
+    logging.disable(logging.INFO)
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+'''
+Compare the single-pass `parse_xls` with the previous row-by-row implementation.
+
+    python -m benchmarks.bench_parse_xls
+'''
+import re
+import time
+
+import xlrd
+
+from app.v1.utils import parse_xls
+from benchmarks.fixtures import build_grade_workbook
+
+
+def parse_xls_legacy(content):
+    """ The original implementation, kept here as the baseline."""
+    workbook = xlrd.open_workbook(file_contents=content, ignore_workbook_corruption=True, formatting_info=True)
+    data = {"classrooms": []}
+
+    for i in range(len(workbook.sheets()) - 1):
+        sheet = workbook.sheet_by_index(i)
+        text = sheet.row_values(4)[0]
+        term = re.search(r"الفصل\s+(\S+)", text).group(1)
+        year = re.search(r"السنة الدراسية\s*:\s*(\d{4}-\d{4})", text).group(1)
+        level = re.search(r"الفوج التربوي\s*:\s*([^\d\n\r]+?\d)", text).group(1).strip()
+        subject = re.search(r"مادة\s*:\s*(.+)", text).group(1).strip()
+
+        classroom = {
+            "school_name": sheet.row_values(3)[0],
+            "term": term,
+            "year": year,
+            "level": level,
+            "subject": subject,
+            "classroom_name": f"Sheet-{i}",
+            "sheet_name": sheet.name,
+            "number_of_students": sheet.nrows - 8,
+            "students": []
+        }
+        for row in range(8, sheet.nrows):
+            classroom["students"].append({
+                "id": int(sheet.row_values(row)[0]),
+                "row": row,
+                "last_name": sheet.row_values(row)[1],
+                "first_name": sheet.row_values(row)[2],
+                "date_of_birth": sheet.row_values(row)[3],
+                "evaluation": sheet.row_values(row)[4],
+                "first_assignment": sheet.row_values(row)[5],
+                "final_exam": sheet.row_values(row)[6],
+                "observation": sheet.row_values(row)[7]
+            })
+        data["classrooms"].append(classroom)
+    return data
+
+
+def best_of(fn, content, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(content)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    print(f"{'rows':>8} {'size':>10} {'legacy (s)':>12} {'single-pass (s)':>16} {'speedup':>8}")
+    for n_rows in (1_000, 10_000, 50_000):
+        content = build_grade_workbook(n_rows)
+        assert parse_xls(content) == parse_xls_legacy(content)
+
+        repeat = 5 if n_rows <= 10_000 else 3
+        legacy = best_of(parse_xls_legacy, content, repeat)
+        current = best_of(parse_xls, content, repeat)
+        print(f"{n_rows:>8} {len(content) // 1024:>8}KB {legacy:>12.3f} {current:>16.3f} {legacy / current:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+'''
+Cost of the Server-Timing header and of ProfilingMiddleware.
+
+    python -m benchmarks.bench_profiling
+
+Each part against the same code without it, around a do-nothing ASGI app (as
+in bench_metrics):
+  - MetricsMiddleware with SERVER_TIMING on vs off, per request;
+  - ProfilingMiddleware on a request that is not profiled (token set, no
+    header), per request: what every request pays;
+  - a profiled request whose handler does BENCH_WORK_MS of CPU work, against
+    the same request unprofiled: the sampler thread takes the GIL every
+    PROFILE_INTERVAL_MS, and the report is written in the io pool.
+'''
+import asyncio
+import os
+import tempfile
+import time
+
+from app.v1 import profiling, telemetry
+from app.v1.profiling import ProfilingMiddleware
+from app.v1.telemetry import MetricsMiddleware
+
+
+N = int(os.getenv("BENCH_CALLS", 20000))
+PROFILED = int(os.getenv("BENCH_PROFILED", 20))
+WORK_MS = float(os.getenv("BENCH_WORK_MS", 50))
+
+
+class Route:
+    path = "/me/classrooms"
+
+
+async def receive():
+    return {"type": "http.request"}
+
+
+async def send(message):
+    pass
+
+
+def scope(headers=()) -> dict:
+    return {"type": "http", "method": "GET", "path": "/me/classrooms", "query_string": b"", "headers": list(headers)}
+
+
+async def empty_app(scope, receive, send):
+    scope["route"] = Route
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def busy_app(scope, receive, send):
+    start = time.perf_counter()
+    while time.perf_counter() - start < WORK_MS / 1000:
+        pass
+    await empty_app(scope, receive, send)
+
+
+async def per_call(target, n=N, headers=()) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        await target(scope(headers), receive, send)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+async def best_of(target, n=N, headers=(), repeat=5) -> float:
+    return min([await per_call(target, n, headers) for _ in range(repeat)])
+
+
+async def run():
+    profiling.PROFILE_TOKEN = "bench"
+    profiling.PROFILE_DIR = tempfile.mkdtemp()
+
+    telemetry.SERVER_TIMING = False
+    without_header = await best_of(MetricsMiddleware(empty_app))
+    telemetry.SERVER_TIMING = True
+    with_header = await best_of(MetricsMiddleware(empty_app))
+
+    metrics_only = await best_of(MetricsMiddleware(empty_app))
+    unprofiled = await best_of(MetricsMiddleware(ProfilingMiddleware(empty_app)))
+
+    plain = await best_of(MetricsMiddleware(ProfilingMiddleware(busy_app)), PROFILED, repeat=1)
+    profiled = await best_of(MetricsMiddleware(ProfilingMiddleware(busy_app)), PROFILED,
+                             headers=[(b"x-profile", b"bench")], repeat=1)
+
+    print(f"{'':>36} {'us':>8}")
+    print(f"{'Server-Timing header, per request':>36} {with_header - without_header:>8.1f}")
+    print(f"{'profiling middleware, not profiled':>36} {unprofiled - metrics_only:>8.1f}")
+    print(f"{f'profiled {WORK_MS:.0f} ms request, extra':>36} {profiled - plain:>8.1f}  "
+          f"({(profiled - plain) / plain * 100:.1f}%, sampling every {profiling.PROFILE_INTERVAL_MS:g} ms)")
+
+
+def main():
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+'''
+Retrieval quality and latency: the original retrieve_from_qdrant (search_batch
+with limit=2 per expanded query, then a retrieve round trip for the payloads,
+every hit in the context) vs fused search + local reranking + token budget.
+
+    python -m benchmarks.bench_retrieval
+
+The corpus comes from benchmarks.fixtures.build_corpus. Qdrant runs in memory.
+Embeddings are HashingEmbeddings with only BENCH_EMBEDDING_SIZE dimensions, so
+that, like a real dense model, the vector ranking is only approximately right.
+Reported: how often the relevant passage is in the context and first in it,
+context size, and retrieval time per chat.
+'''
+import asyncio
+import logging
+import os
+import time
+import warnings
+
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.models import SearchRequest
+from qdrant_client.models import Distance, PointStruct, VectorParams
+
+from app.v1.services.embeddings import HashingEmbeddings
+from app.v1.services.retrieval import CONTEXT_TOKEN_BUDGET, build_context, count_tokens, rerank
+from app.v1.utils import retrieve_from_qdrant
+from benchmarks.fixtures import build_corpus
+
+
+EMBEDDING_SIZE = int(os.getenv("BENCH_EMBEDDING_SIZE", 64))
+COLLECTION = "rag_collection"
+
+
+async def legacy_context(client, vectors, question) -> list[str]:
+    scored_points = await client.search_batch(
+        collection_name=COLLECTION,
+        requests=[SearchRequest(vector=vector, limit=2) for vector in vectors],
+    )
+    ids = [point.id for points in scored_points for point in points]
+    results = await client.retrieve(collection_name=COLLECTION, ids=ids)
+    return [result.payload["page_content"] for result in results]
+
+
+def fused_context(token_budget):
+    async def retrieve(client, vectors, question) -> list[str]:
+        fused = await retrieve_from_qdrant(vectors, COLLECTION, client)
+        return build_context(rerank(question, fused), token_budget)
+    return retrieve
+
+
+async def evaluate(client, embeddings, passages, queries, retrieve) -> dict:
+    found = first = tokens = 0
+    elapsed = 0.0
+    for question, expansions, target in queries:
+        vectors = embeddings.embed_documents(expansions + [question])
+        start = time.perf_counter()
+        context = await retrieve(client, vectors, question)
+        elapsed += time.perf_counter() - start
+        found += passages[target] in context
+        first += bool(context) and context[0] == passages[target]
+        tokens += sum(count_tokens(passage) for passage in context)
+    n = len(queries)
+    return {"recall": found / n, "first": first / n, "tokens": tokens / n, "ms": elapsed / n * 1000}
+
+
+async def run():
+    passages, queries = build_corpus()
+    embeddings = HashingEmbeddings(size=EMBEDDING_SIZE)
+    client = AsyncQdrantClient(location=":memory:")
+    await client.create_collection(COLLECTION, vectors_config=VectorParams(size=EMBEDDING_SIZE, distance=Distance.COSINE))
+    await client.upsert(COLLECTION, points=[
+        PointStruct(id=i, vector=vector, payload={"page_content": text})
+        for i, (text, vector) in enumerate(zip(passages, embeddings.embed_documents(passages)))
+    ])
+
+    print(f"{len(passages)} passages, {len(queries)} questions with 3 expansions each, {EMBEDDING_SIZE}-d embeddings")
+    print(f"{'pipeline':>16} {'in context':>11} {'ranked 1st':>11} {'tokens':>7} {'ms/chat':>8}")
+    setups = (
+        ("original", legacy_context),
+        ("fused, 500 tok", fused_context(500)),
+        (f"fused, {CONTEXT_TOKEN_BUDGET} tok", fused_context(CONTEXT_TOKEN_BUDGET)),
+    )
+    for name, retrieve in setups:
+        r = await evaluate(client, embeddings, passages, queries, retrieve)
+        print(f"{name:>16} {r['recall']:>10.0%} {r['first']:>10.0%} {r['tokens']:>7.0f} {r['ms']:>7.2f}")
+    await client.close()
+
+
+def main():
+    logging.disable(logging.INFO)
+    warnings.simplefilter("ignore", DeprecationWarning)  # search_batch, kept for the original pipeline
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+'''
+Latency of POST /assistant/chat/reponse with stubbed models: no semantic cache
+vs cached expansions vs cached expansions and answers.
+
+    python -m benchmarks.bench_semantic_cache
+
+The expansion model answers after BENCH_EXPANSION_MS, the chat model sends its
+first token after BENCH_FIRST_TOKEN_MS. Embeddings are HashingEmbeddings and
+Qdrant runs in memory. Teachers ask QUESTIONS, each in several wordings, in a
+shuffled order. httpx's ASGITransport buffers the body, so the latency is to
+the last byte of the streamed answer.
+'''
+import asyncio
+import logging
+import os
+import random
+import time
+
+import httpx
+from langchain_core.messages import AIMessageChunk
+from langchain_core.runnables import RunnableLambda
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import Distance, PointStruct, VectorParams
+
+from app.main import app
+from app.v1.auth.dependencies import get_current_user
+from app.v1.schemas.schemas import QueryExpantion
+from app.v1.services.clients import ClientRegistry
+from app.v1.services.embeddings import HashingEmbeddings
+from app.v1.services.semantic_cache import answer_cache, expansion_cache
+
+
+EXPANSION_MS = float(os.getenv("BENCH_EXPANSION_MS", 700))
+FIRST_TOKEN_MS = float(os.getenv("BENCH_FIRST_TOKEN_MS", 400))
+TOKEN_MS = 5
+DIM = 256
+
+QUESTIONS = [
+    "comment calculer la moyenne du premier trimestre",
+    "quand a lieu le conseil de classe de fin d'annee",
+    "comment saisir les notes d'un eleve absent",
+    "quel est le bareme de l'evaluation continue",
+    "comment exporter le bulletin d'une classe",
+]
+WORDINGS = ["{}", "{} ?", "{} svp", "Bonjour, {}"]
+
+
+async def expand(messages):
+    await asyncio.sleep(EXPANSION_MS / 1000)
+    return QueryExpantion(queries=["requete reformulee une", "requete reformulee deux"])
+
+
+class SlowChatModel:
+    async def _stream(self):
+        await asyncio.sleep(FIRST_TOKEN_MS / 1000)
+        for word in "La moyenne est la somme des notes divisee par leur nombre .".split():
+            yield AIMessageChunk(content=word + " ")
+            await asyncio.sleep(TOKEN_MS / 1000)
+
+    def astream(self, input):
+        return self._stream()
+
+
+async def make_clients(embeddings) -> ClientRegistry:
+    registry = ClientRegistry(qdrant=AsyncQdrantClient(location=":memory:"),
+                              chat_model=SlowChatModel(), query_expansion_model=RunnableLambda(expand))
+    registry.use_embeddings(embeddings)
+    await registry.qdrant.create_collection("rag_collection", vectors_config=VectorParams(size=DIM, distance=Distance.COSINE))
+    texts = [f"Document {i} sur les notes, moyennes et conseils de classe." for i in range(50)]
+    await registry.qdrant.upsert("rag_collection", points=[
+        PointStruct(id=i, vector=vector, payload={"page_content": text})
+        for i, (text, vector) in enumerate(zip(texts, embeddings.embed_documents(texts)))
+    ])
+    return registry
+
+
+async def run(setup: str) -> list:
+    expansion_cache.clear(), answer_cache.clear()
+    expansion_cache.enabled = setup != "no cache"
+    answer_cache.enabled = setup == "expansion + answer"
+    app.state.clients = await make_clients(HashingEmbeddings(size=DIM))
+    app.dependency_overrides[get_current_user] = lambda: "teacher-1"
+
+    workload = [wording.format(question) for question in QUESTIONS for wording in WORDINGS]
+    random.Random(0).shuffle(workload)
+    timings = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        for query in workload:
+            start = time.perf_counter()
+            response = await client.post("/assistant/chat/reponse", json={"query": query})
+            assert response.status_code == 200, response.text
+            timings.append(time.perf_counter() - start)
+    return sorted(timings)
+
+
+def main():
+    logging.disable(logging.INFO)
+    print(f"{len(QUESTIONS) * len(WORDINGS)} chats, expansion {EXPANSION_MS:.0f} ms, first token {FIRST_TOKEN_MS:.0f} ms")
+    print(f"{'setup':>20} {'mean':>8} {'p50':>8} {'p90':>8}")
+    for setup in ("no cache", "expansion", "expansion + answer"):
+        timings = asyncio.run(run(setup))
+        p = lambda q: timings[min(len(timings) - 1, int(len(timings) * q))] * 1000
+        print(f"{setup:>20} {sum(timings) / len(timings) * 1000:>6.0f}ms {p(0.5):>6.0f}ms {p(0.9):>6.0f}ms")
+    app.dependency_overrides.clear()
+    expansion_cache.enabled, answer_cache.enabled = True, False
+
+
+if __name__ == "__main__":
+    main()
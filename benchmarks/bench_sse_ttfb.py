@@ -0,0 +1,102 @@
+'''
+Time to first byte and to first token of POST /assistant/chat/reponse with
+stubbed models.
+
+    python -m benchmarks.bench_sse_ttfb
+
+The expansion model answers after BENCH_EXPANSION_MS, the chat model sends its
+first token after BENCH_FIRST_TOKEN_MS and the next ones every BENCH_TOKEN_MS.
+Embeddings are HashingEmbeddings and Qdrant runs in memory. The requests are
+sent straight to the ASGI app (benchmarks.fixtures.stream_post) so each body
+chunk is timed as it is sent. Before the SSE stream, the first byte was the
+first token: the "first token" column is what the first byte used to be.
+'''
+import asyncio
+import functools
+import logging
+import os
+
+from langchain_core.messages import AIMessageChunk
+from langchain_core.runnables import RunnableLambda
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import Distance, PointStruct, VectorParams
+
+from app.main import app
+from app.v1.auth.dependencies import get_current_user
+from app.v1.schemas.schemas import QueryExpantion
+from app.v1.routers import assistant
+from app.v1.services.clients import ClientRegistry
+from app.v1.services.embeddings import HashingEmbeddings
+from app.v1.services.semantic_cache import expansion_cache
+from app.v1.services.streaming import EventStream
+from benchmarks.fixtures import sse_events, stream_post
+
+
+EXPANSION_MS = float(os.getenv("BENCH_EXPANSION_MS", 700))
+FIRST_TOKEN_MS = float(os.getenv("BENCH_FIRST_TOKEN_MS", 400))
+TOKEN_MS = float(os.getenv("BENCH_TOKEN_MS", 5))
+N_CHATS = int(os.getenv("BENCH_CHATS", 20))
+DIM = 256
+
+
+async def expand(messages):
+    await asyncio.sleep(EXPANSION_MS / 1000)
+    return QueryExpantion(queries=["requete reformulee une", "requete reformulee deux"])
+
+
+class SlowChatModel:
+    async def _stream(self):
+        await asyncio.sleep(FIRST_TOKEN_MS / 1000)
+        for word in ("La moyenne est la somme des notes divisee par leur nombre . " * 5).split():
+            yield AIMessageChunk(content=word + " ")
+            await asyncio.sleep(TOKEN_MS / 1000)
+
+    def astream(self, input):
+        return self._stream()
+
+
+async def make_clients(embeddings) -> ClientRegistry:
+    registry = ClientRegistry(qdrant=AsyncQdrantClient(location=":memory:"),
+                              chat_model=SlowChatModel(), query_expansion_model=RunnableLambda(expand))
+    registry.use_embeddings(embeddings)
+    await registry.qdrant.create_collection("rag_collection", vectors_config=VectorParams(size=DIM, distance=Distance.COSINE))
+    texts = [f"Document {i} sur les notes, moyennes et conseils de classe." for i in range(50)]
+    await registry.qdrant.upsert("rag_collection", points=[
+        PointStruct(id=i, vector=vector, payload={"page_content": text})
+        for i, (text, vector) in enumerate(zip(texts, embeddings.embed_documents(texts)))
+    ])
+    return registry
+
+
+async def run(flush_interval_ms: float) -> list:
+    assistant.EventStream = functools.partial(EventStream, flush_interval_ms=flush_interval_ms)
+    app.state.clients = await make_clients(HashingEmbeddings(size=DIM))
+    rows = []
+    for i in range(N_CHATS):
+        expansion_cache.clear()
+        status, chunks = await stream_post(app, "/assistant/chat/reponse",
+                                           {"query": f"comment calculer la moyenne du trimestre {i}"})
+        assert status == 200
+        first_token = next(at for at, chunk in chunks if "event: token" in chunk)
+        events = sse_events("".join(chunk for _, chunk in chunks))
+        rows.append((chunks[0][0], first_token, chunks[-1][0], len(events)))
+    return rows
+
+
+def main():
+    logging.disable(logging.INFO)
+    app.dependency_overrides[get_current_user] = lambda: "teacher-1"
+    print(f"{N_CHATS} chats, expansion {EXPANSION_MS:.0f} ms, first token {FIRST_TOKEN_MS:.0f} ms, "
+          f"{TOKEN_MS:.0f} ms per token")
+    print(f"{'flush interval':>15} {'first byte':>11} {'first token':>12} {'last byte':>10} {'events':>7}")
+    for flush_interval_ms in (0, 50):
+        rows = asyncio.run(run(flush_interval_ms))
+        mean = [sum(column) / len(column) for column in zip(*rows)]
+        print(f"{flush_interval_ms:>12.0f} ms {mean[0] * 1000:>8.1f} ms {mean[1] * 1000:>9.1f} ms "
+              f"{mean[2] * 1000:>7.0f} ms {mean[3]:>7.0f}")
+    app.dependency_overrides.clear()
+    assistant.EventStream = EventStream
+
+
+if __name__ == "__main__":
+    main()
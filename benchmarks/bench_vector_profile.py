@@ -0,0 +1,117 @@
+'''
+Recall@10 vs RAM of the vector profiles (EMBEDDING_DIMENSIONS,
+VECTOR_QUANTIZATION, SEARCH_RESCORE / SEARCH_OVERSAMPLING).
+
+    python -m benchmarks.bench_vector_profile
+
+Qdrant's local mode implements neither quantization nor HNSW, so the search is
+an exact numpy stand-in: what is measured is the ranking lost by storing fewer
+or coarser dimensions, and the RAM per point as VectorProfile estimates it.
+The documents are BENCH_VECTORS synthetic 3072-d unit vectors whose variance
+decays along the dimensions like Matryoshka embeddings; each query is a
+document plus noise. Recall is against the exact float32 top 10.
+'''
+import os
+import time
+
+import numpy as np
+
+from app.v1.services.vector_profile import VectorProfile
+
+
+N_VECTORS = int(os.getenv("BENCH_VECTORS", 10000))
+N_QUERIES = int(os.getenv("BENCH_QUERIES", 200))
+OVERSAMPLING = float(os.getenv("SEARCH_OVERSAMPLING", 2.0))
+DIM, K = 3072, 10
+
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+
+def unit(x):
+    return x / np.linalg.norm(x, axis=-1, keepdims=True)
+
+
+def dataset(rng):
+    scale = (1.0 / np.sqrt(1 + np.arange(DIM) / 64)).astype(np.float32)
+    documents = unit(rng.standard_normal((N_VECTORS, DIM), dtype=np.float32) * scale)
+    picked = documents[rng.integers(0, N_VECTORS, N_QUERIES)]
+    queries = unit(picked + 0.8 * unit(rng.standard_normal((N_QUERIES, DIM), dtype=np.float32) * scale))
+    return documents, queries
+
+
+def top(scores, k):
+    best = np.argpartition(-scores, k, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1)
+    return np.take_along_axis(best, order, axis=1)
+
+
+def rescored(candidates, documents, queries):
+    """ Exact float32 scores of the candidates, as Qdrant rescores with the originals."""
+    scores = np.einsum("qcd,qd->qc", documents[candidates], queries)
+    return np.take_along_axis(candidates, top(scores, K), axis=1)
+
+
+def truncated(dims):
+    def index(documents):
+        return unit(documents[:, :dims])
+
+    def search(stored, queries, k):
+        return top(unit(queries[:, :dims]) @ stored.T, k)
+    return index, search
+
+
+def scalar_int8(documents):
+    low, high = np.quantile(documents, 0.005, axis=0), np.quantile(documents, 0.995, axis=0)
+    step = (high - low) / 255
+    codes = np.clip(np.round((documents - low) / step) - 128, -128, 127).astype(np.int8)
+    return codes, step
+
+
+def scalar_search(stored, queries, k):
+    codes, step = stored
+    # the offset terms are the same for every document of a query: only the codes rank
+    return top((queries * step) @ codes.T.astype(np.float32), k)
+
+
+def binary(documents):
+    return np.packbits(documents > 0, axis=1)
+
+
+def binary_search(stored, queries, k):
+    bits = np.packbits(queries > 0, axis=1)
+    distances = np.stack([POPCOUNT[np.bitwise_xor(stored, query)].sum(axis=1) for query in bits])
+    return top(-distances.astype(np.float32), k)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    documents, queries = dataset(rng)
+    exact = top(queries @ documents.T, K)
+
+    setups = [("float32", VectorProfile(), lambda d: d, lambda s, q, k: top(q @ s.T, k))]
+    for dims in (1024, 512, 256):
+        setups.append((f"truncate {dims}", VectorProfile(dimensions=dims), *truncated(dims)))
+    setups.append(("scalar int8", VectorProfile(quantization="scalar", on_disk=True), scalar_int8, scalar_search))
+    setups.append(("binary", VectorProfile(quantization="binary", on_disk=True), binary, binary_search))
+
+    print(f"{N_VECTORS} vectors x {DIM} dims, {N_QUERIES} queries, recall@{K}, rescoring oversampling {OVERSAMPLING}")
+    print(f"{'profile':>16} {'RAM/vector':>11} {'recall':>7} {'ms/query':>9} {'+rescore':>9} {'ms/query':>9}")
+    for name, profile, index, search in setups:
+        stored = index(documents)
+        start = time.perf_counter()
+        found = search(stored, queries, K)
+        elapsed = (time.perf_counter() - start) / N_QUERIES * 1000
+        recall = np.mean([len(set(f) & set(e)) / K for f, e in zip(found, exact)])
+
+        line = f"{name:>16} {profile.ram_bytes_per_vector(DIM):>9} B {recall:>7.3f} {elapsed:>9.2f}"
+        if name != "float32":
+            start = time.perf_counter()
+            found = rescored(search(stored, queries, int(K * OVERSAMPLING)), documents, queries)
+            elapsed = (time.perf_counter() - start) / N_QUERIES * 1000
+            recall = np.mean([len(set(f) & set(e)) / K for f, e in zip(found, exact)])
+            line += f" {recall:>9.3f} {elapsed:>9.2f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
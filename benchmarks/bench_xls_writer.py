@@ -0,0 +1,70 @@
+'''
+p50/p99 latency of a 1-student grade update on a 40-sheet workbook:
+full open + xlutils.copy + save per update vs the cached WorkbookWriter.
+
+    python -m benchmarks.bench_xls_writer
+'''
+import os
+import statistics
+import tempfile
+import time
+
+from xlutils.copy import copy
+
+from app.v1.services.xls_writer import WorkbookWriter
+from app.v1.utils import open_xls
+from benchmarks.fixtures import build_grade_workbook
+
+N_SHEETS = 40
+N_STUDENTS = 40 * 35
+ITERATIONS = 100
+
+
+def write_cells_full_copy(storage_path, sheet_name, cells):
+    """ The original write-back: re-open, deep copy and rewrite the whole workbook."""
+    workbook_copy = copy(open_xls(path=storage_path, formatting_info=True))
+    sheet_wt = workbook_copy.get_sheet(sheet_name)
+    for row, col, value in cells:
+        sheet_wt.write(row, col, value)
+    workbook_copy.save(storage_path)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    p50 = statistics.median(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return p50 * 1000, p99 * 1000
+
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(), "grades.xls")
+    with open(path, "wb") as f:
+        f.write(build_grade_workbook(N_STUDENTS, n_sheets=N_SHEETS))
+    sheet_name = "2100007_1"
+
+    def update(i):
+        return [(8, 4, i % 20), (8, 5, 12.5), (8, 6, 14.0), (8, 7, "ok")]
+
+    full = []
+    for i in range(ITERATIONS):
+        start = time.perf_counter()
+        write_cells_full_copy(path, sheet_name, update(i))
+        full.append(time.perf_counter() - start)
+
+    writer = WorkbookWriter()
+    cached = []
+    for i in range(ITERATIONS):
+        cells = {(sheet_name, row, col): value for row, col, value in update(i)}
+        start = time.perf_counter()
+        writer.apply(path, cells)
+        cached.append(time.perf_counter() - start)
+
+    print(f"{N_SHEETS} sheets, {N_STUDENTS} students, {os.path.getsize(path) // 1024}KB, {ITERATIONS} updates")
+    print(f"{'':>12} {'p50 (ms)':>10} {'p99 (ms)':>10}")
+    print(f"{'full copy':>12} {percentiles(full)[0]:>10.1f} {percentiles(full)[1]:>10.1f}")
+    print(f"{'cached':>12} {percentiles(cached)[0]:>10.1f} {percentiles(cached)[1]:>10.1f}")
+    print("(the first cached update includes loading the workbook and shows up in p99)")
+
+
+if __name__ == "__main__":
+    main()
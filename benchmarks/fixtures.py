@@ -0,0 +1,182 @@
+'''
+Synthetic fixtures shared by the benchmarks.
+'''
+import asyncio
+import io
+import json
+import random
+import time
+
+import xlwt
+
+
+HEADER_TEXT = (
+    "الفصل الأول    السنة الدراسية : 2020-2021    "
+    "الفوج التربوي : أولى  متوسط    1    مادة : المعلوماتية"
+)
+SCHOOL_NAME = "متوسطة مرزقان محمد المدعو معمر (قصر الصباحي)"
+
+
+def build_grade_workbook(n_students: int, n_sheets: int = 30, seed: int = 0) -> bytes:
+    """
+    Build an XLS workbook laid out like the ministry grade export.
+    Students are spread evenly over `n_sheets` classroom sheets, followed by
+    the trailing summary sheet that the parser skips.
+    """
+    rng = random.Random(seed)
+    workbook = xlwt.Workbook(encoding="utf-8")
+    per_sheet, remainder = divmod(n_students, n_sheets)
+    student_id = 1
+
+    for i in range(n_sheets):
+        sheet = workbook.add_sheet(f"21000{i:02d}_1")
+        sheet.write(3, 0, SCHOOL_NAME)
+        sheet.write(4, 0, HEADER_TEXT)
+        for col, title in enumerate(["الرقم", "اللقب", "الاسم", "تاريخ الميلاد",
+                                     "التقويم", "الفرض", "الاختبار", "الملاحظة"]):
+            sheet.write(7, col, title)
+
+        for row in range(8, 8 + per_sheet + (1 if i < remainder else 0)):
+            sheet.write(row, 0, student_id)
+            sheet.write(row, 1, f"Nom{student_id}")
+            sheet.write(row, 2, f"Prenom{student_id}")
+            sheet.write(row, 3, "2010-01-01")
+            sheet.write(row, 4, round(rng.uniform(0, 20), 2))
+            sheet.write(row, 5, round(rng.uniform(0, 20), 2))
+            sheet.write(row, 6, round(rng.uniform(0, 20), 2))
+            sheet.write(row, 7, "")
+            student_id += 1
+
+    workbook.add_sheet("summary")
+
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def build_parsed_data(n_students: int, n_sheets: int = 30, seed: int = 0) -> dict:
+    """ The dict `parse_xls` would return for a workbook of `n_students` students."""
+    rng = random.Random(seed)
+    per_sheet, remainder = divmod(n_students, n_sheets)
+    data = {"classrooms": []}
+    student_id = 1
+
+    for i in range(n_sheets):
+        size = per_sheet + (1 if i < remainder else 0)
+        students = []
+        for row in range(8, 8 + size):
+            students.append({
+                "id": student_id,
+                "row": row,
+                "last_name": f"Nom{student_id}",
+                "first_name": f"Prenom{student_id}",
+                "date_of_birth": "2010-01-01",
+                "evaluation": round(rng.uniform(0, 20), 2),
+                "first_assignment": round(rng.uniform(0, 20), 2),
+                "final_exam": round(rng.uniform(0, 20), 2),
+                "observation": "",
+            })
+            student_id += 1
+        data["classrooms"].append({
+            "school_name": SCHOOL_NAME,
+            "term": "الأول",
+            "year": "2020-2021",
+            "level": "أولى  متوسط    1",
+            "subject": "المعلوماتية",
+            "classroom_name": f"Sheet-{i}",
+            "sheet_name": f"21000{i:02d}_1",
+            "number_of_students": size,
+            "students": students,
+        })
+    return data
+
+
+def _pseudo_word(rng) -> str:
+    syllables = ["ba", "ce", "di", "fo", "gu", "la", "me", "ni", "po", "ra", "si", "tu", "vo", "za", "on", "ex"]
+    return "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+
+
+def build_corpus(n_topics: int = 40, passages_per_topic: int = 10, n_queries: int = 200, seed: int = 0):
+    """
+    A retrieval fixture: passages made of topic words, words unique to the
+    passage and filler, and queries each aimed at one passage.
+
+    Returns (passages, queries) where queries are (question, expansions, index
+    of the relevant passage). Expansions, like a query expansion model's, share
+    the question's topic words but only part of its specific ones.
+    """
+    rng = random.Random(seed)
+    vocabulary = list(dict.fromkeys(_pseudo_word(rng) for _ in range(5000)))
+    rng.shuffle(vocabulary)
+    filler, vocabulary = vocabulary[:300], vocabulary[300:]
+    topics = [vocabulary[i * 6:(i + 1) * 6] for i in range(n_topics)]
+    vocabulary = vocabulary[n_topics * 6:]
+
+    passages, specifics = [], []
+    for topic in topics:
+        for _ in range(passages_per_topic):
+            specific = [vocabulary.pop() for _ in range(2)]
+            words = rng.sample(topic, 4) + specific + rng.choices(filler, k=25)
+            rng.shuffle(words)
+            passages.append((" ".join(words) + ".", topic))
+            specifics.append(specific)
+
+    queries = []
+    for _ in range(n_queries):
+        target = rng.randrange(len(passages))
+        topic, specific = passages[target][1], specifics[target]
+        question = " ".join(specific + rng.sample(topic, 2))
+        expansions = [" ".join([rng.choice(specific)] + rng.sample(topic, 2) + [rng.choice(filler)]) for _ in range(3)]
+        queries.append((question, expansions, target))
+    return [text for text, _ in passages], queries
+
+
+async def stream_post(app, path: str, payload: dict, disconnect_after: int = None):
+    """
+    POST `payload` as JSON straight to the ASGI `app`, recording when each body
+    chunk arrives (httpx's ASGITransport only returns the body once complete).
+    With `disconnect_after`, the client goes away after that many chunks.
+
+    Returns (status, [(seconds since the request, chunk text)]).
+    """
+    body = json.dumps(payload).encode()
+    status, chunks, sent = None, [], False
+    disconnected = asyncio.Event()
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and message.get("body"):
+            chunks.append((time.perf_counter() - start, message["body"].decode()))
+            if disconnect_after is not None and len(chunks) >= disconnect_after:
+                disconnected.set()
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.3"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+        "headers": [(b"host", b"bench"), (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())],
+    }
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    return status, chunks
+
+
+def sse_events(text: str) -> list[tuple]:
+    """ [(event, data)] of a text/event-stream body, comments (heartbeats) left out."""
+    events = []
+    for block in text.split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if line and not line.startswith(":"))
+        if fields:
+            events.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return events
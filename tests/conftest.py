@@ -0,0 +1,100 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from app.main import app
+from app.database.database import Base, get_async_db
+from app.database.models import User, UploadedFile
+from app.v1.auth.dependencies import get_current_user
+from app.v1.schemas.schemas import AcademicLevelEnum
+from app.v1.services.bulk_ingest import populate_database
+from app.v1.services.ownership import ownership_cache
+from benchmarks.fixtures import build_parsed_data
+
+
+TEST_USER_ID = "teacher-1"
+
+
+class QueryCounter:
+    """ Counts the SQL statements executed on an engine."""
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def reset(self):
+        self.count = 0
+
+
+@pytest.fixture(autouse=True)
+def clear_ownership_cache():
+    # Every test has its own database but the same TEST_USER_ID
+    ownership_cache.clear()
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    # A file database, so that the sync (seeding) and async (API) engines share it
+    return tmp_path / "test.db"
+
+
+@pytest.fixture
+def db_engine(db_path):
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def async_db_engine(db_engine, db_path):
+    # NullPool: TestClient may run each request on a new event loop
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}", poolclass=NullPool)
+    yield engine
+    engine.sync_engine.dispose()
+
+
+@pytest.fixture
+def db_session(db_engine):
+    session = sessionmaker(bind=db_engine, autoflush=False)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def seeded_file(db_session):
+    """ A teacher with an uploaded file of 20 classrooms."""
+    db_session.add(User(id=TEST_USER_ID, email="teacher@example.com", auth_provider="local",
+                        academic_level=AcademicLevelEnum.secondary))
+    uploaded_file = UploadedFile(user_id=TEST_USER_ID, file_name="grades.xls", storage_path="grades.xls")
+    db_session.add(uploaded_file)
+    db_session.flush()
+    populate_database(db_session, uploaded_file.file_id, build_parsed_data(n_students=200, n_sheets=20))
+    db_session.commit()
+    return uploaded_file
+
+
+@pytest.fixture
+def query_counter(async_db_engine):
+    """ Counts the statements sent by the API (through the async engine)."""
+    return QueryCounter(async_db_engine.sync_engine)
+
+
+@pytest.fixture
+def api_client(async_db_engine):
+    """ TestClient using the SQLite database and authenticated as TEST_USER_ID."""
+    TestingSession = async_sessionmaker(bind=async_db_engine, autoflush=False, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async with TestingSession() as db:
+            yield db
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    app.dependency_overrides[get_current_user] = lambda: TEST_USER_ID
+    yield TestClient(app)
+    app.dependency_overrides.clear()
@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import Distance, PointStruct, VectorParams
+
+from app.main import app
+from benchmarks.fixtures import sse_events, stream_post
+from app.v1.schemas.schemas import QueryExpantion
+from app.v1.services import embedding_cache
+from app.v1.services.clients import ClientRegistry
+from app.v1.services.semantic_cache import answer_cache, expansion_cache
+
+
+COLLECTION = "rag_collection"
+DIM = 16
+
+
+async def fill_collection(qdrant, embeddings):
+    await qdrant.create_collection(COLLECTION, vectors_config=VectorParams(size=DIM, distance=Distance.COSINE))
+    texts = ["Les notes sont sur 20.", "Le conseil de classe a lieu en juin."]
+    await qdrant.upsert(COLLECTION, points=[
+        PointStruct(id=i, vector=vector, payload={"page_content": text})
+        for i, (text, vector) in enumerate(zip(texts, embeddings.embed_documents(texts)))
+    ])
+
+
+def answer_text(body: str) -> str:
+    return "".join(data["text"] for event, data in sse_events(body) if event == "token")
+
+
+@pytest.fixture
+def fake_clients():
+    """ Local stand-ins: in-memory Qdrant, fake chat and embedding models."""
+    embeddings = DeterministicFakeEmbedding(size=DIM)
+    registry = ClientRegistry(
+        qdrant=AsyncQdrantClient(location=":memory:"),
+        chat_model=GenericFakeChatModel(messages=iter([AIMessage(content="Les notes sont sur 20.")])),
+        query_expansion_model=RunnableLambda(lambda messages: QueryExpantion(queries=["notes", "bareme"])),
+    )
+    registry.use_embeddings(embeddings)
+    expansion_cache.clear()
+    answer_cache.clear()
+    app.state.clients = registry
+    yield registry
+    del app.state.clients
+
+
+def test_chat_uses_the_shared_clients(api_client, fake_clients):
+    asyncio.run(fill_collection(fake_clients.qdrant, fake_clients.embeddings))
+
+    response = api_client.post("/assistant/chat/reponse", json={"query": "Sur combien sont les notes ?"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert answer_text(response.text) == "Les notes sont sur 20."
+
+
+def test_chat_without_openai_is_unavailable(api_client, fake_clients):
+    fake_clients.chat_model = None
+    response = api_client.post("/assistant/chat/reponse", json={"query": "bonjour"})
+    assert response.status_code == 503
+
+
+def test_registry_shares_and_closes_connection_pools(monkeypatch, tmp_path):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(embedding_cache, "EMBEDDING_CACHE_PATH", str(tmp_path / "embeddings.sqlite3"))
+    registry = ClientRegistry.from_env()
+    sync_pool, async_pool = registry.http_clients
+
+    assert registry.chat_model.http_async_client is async_pool
+    assert registry.embeddings.http_async_client is async_pool
+    # Queries and indexed chunks go through the same embedding cache
+    assert registry.indexer.embedding_function is registry.embedder.embeddings
+    assert registry.embedder.embeddings.embeddings is registry.embeddings
+
+    asyncio.run(registry.aclose())
+    assert sync_pool.is_closed and async_pool.is_closed
+
+
+def test_answers_are_served_from_the_semantic_cache(api_client, fake_clients, monkeypatch):
+    monkeypatch.setattr(answer_cache, "enabled", True)
+    asyncio.run(fill_collection(fake_clients.qdrant, fake_clients.embeddings))
+
+    first = api_client.post("/assistant/chat/reponse", json={"query": "Sur combien sont les notes ?"})
+    # The fake chat model has a single answer: a second generation would fail
+    second = api_client.post("/assistant/chat/reponse", json={"query": "Sur combien sont les notes ?"})
+
+    assert answer_text(first.text) == answer_text(second.text) == "Les notes sont sur 20."
+    assert sse_events(second.text)[-1] == ("done", {"cached": True})
+
+
+class SlowChatModel:
+    """ Streams two tokens, then hangs until cancelled."""
+    def __init__(self):
+        self.cancelled = False
+
+    async def _stream(self):
+        try:
+            yield AIMessage(content="Les notes ")
+            yield AIMessage(content="sont sur 20.")
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+    def astream(self, input):
+        return self._stream()
+
+
+def test_progress_is_streamed_before_the_expansion_returns(fake_clients):
+    async def expand(messages):
+        await asyncio.sleep(0.3)
+        return QueryExpantion(queries=["notes", "bareme"])
+
+    fake_clients.query_expansion_model = RunnableLambda(expand)
+
+    async def scenario():
+        await fill_collection(fake_clients.qdrant, fake_clients.embeddings)
+        return await stream_post(app, "/assistant/chat/reponse", {"query": "Sur combien sont les notes ?"})
+
+    status, chunks = asyncio.run(scenario())
+    events = sse_events("".join(chunk for _, chunk in chunks))
+
+    assert status == 200
+    assert chunks[0][0] < 0.3  # first byte before the expansion is done
+    assert [data["stage"] for event, data in events if event == "progress"] == ["embedding", "retrieving", "generating"]
+    assert events[-1] == ("done", {})
+
+
+def test_client_disconnect_cancels_the_generation(fake_clients):
+    fake_clients.chat_model = model = SlowChatModel()
+
+    async def scenario():
+        await fill_collection(fake_clients.qdrant, fake_clients.embeddings)
+        # 3 progress events, then the first token
+        return await stream_post(app, "/assistant/chat/reponse", {"query": "Sur combien sont les notes ?"},
+                                 disconnect_after=4)
+
+    status, chunks = asyncio.run(asyncio.wait_for(scenario(), 10))
+
+    assert status == 200
+    assert model.cancelled
+    assert "event: done" not in "".join(chunk for _, chunk in chunks)
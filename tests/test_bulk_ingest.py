@@ -0,0 +1,51 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.database.database import Base
+from app.database.models import User, UploadedFile, Classroom, Student
+from app.v1.services.bulk_ingest import populate_database
+from benchmarks.fixtures import build_parsed_data
+
+
+def test_populate_database_links_students_to_pregenerated_classrooms():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    data = build_parsed_data(n_students=50, n_sheets=4)
+    data["classrooms"].append({"sheet_name": "broken", "students": [{"id": 1}]})  # skipped, not fatal
+
+    with Session(engine) as db:
+        db.add(User(id="u1", email="u1@example.com", auth_provider="local"))
+        uploaded_file = UploadedFile(user_id="u1", file_name="grades.xls", storage_path="grades.xls")
+        db.add(uploaded_file)
+        db.flush()
+
+        populate_database(db, uploaded_file.file_id, data)
+        db.commit()
+
+        classrooms = db.query(Classroom).filter_by(file_id=uploaded_file.file_id).all()
+        assert sorted(c.sheet_name for c in classrooms) == sorted(c["sheet_name"] for c in data["classrooms"][:4])
+        assert db.query(Student).count() == 50
+
+        first = db.query(Student).filter_by(student_id="1").one()
+        assert first.classroom.sheet_name == data["classrooms"][0]["sheet_name"]
+        assert first.row == 8
+        assert first.evaluation == data["classrooms"][0]["students"][0]["evaluation"]
+
+
+def test_populate_database_with_classrooms_without_students():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    data = build_parsed_data(n_students=0, n_sheets=1)
+    data["classrooms"][0]["students"] = []
+
+    with Session(engine) as db:
+        db.add(User(id="u1", email="u1@example.com", auth_provider="local"))
+        uploaded_file = UploadedFile(user_id="u1", file_name="grades.xls", storage_path="grades.xls")
+        db.add(uploaded_file)
+        db.flush()
+
+        populate_database(db, uploaded_file.file_id, data)
+        db.commit()
+
+        assert db.query(Classroom).filter_by(file_id=uploaded_file.file_id).count() == 1
+        assert db.query(Student).count() == 0
@@ -0,0 +1,87 @@
+from app.database.models import Classroom, PendingSheetWrite, UploadedFile
+from app.v1.services.bulk_ingest import populate_database
+from benchmarks.fixtures import build_parsed_data
+
+
+def test_list_classrooms_uses_a_single_query(api_client, seeded_file, query_counter):
+    query_counter.reset()
+    response = api_client.get("/me/classrooms")
+
+    assert response.status_code == 200
+    assert query_counter.count == 1
+    classrooms = response.json()
+    assert len(classrooms) == 20
+    assert sum(len(c["classroom"]["students"]) for c in classrooms) == 200
+    students = classrooms[0]["classroom"]["students"]
+    assert [s["row"] for s in students] == sorted(s["row"] for s in students)
+
+
+def test_list_classrooms_stream_matches_regular_response(api_client, seeded_file, query_counter):
+    expected = api_client.get("/me/classrooms").json()
+
+    query_counter.reset()
+    response = api_client.get("/me/classrooms", params={"stream": True})
+
+    assert response.status_code == 200
+    assert response.json() == expected
+    assert query_counter.count == 2  # file lookup + the streamed join
+
+
+def test_list_classrooms_without_file(api_client):
+    response = api_client.get("/me/classrooms")
+    assert response.status_code == 404
+
+
+def test_ownership_is_resolved_once_then_served_from_the_cache(api_client, db_session, seeded_file, query_counter):
+    classroom_id = db_session.query(Classroom.classroom_id).filter_by(file_id=seeded_file.file_id).first()[0]
+
+    query_counter.reset()
+    first = api_client.get(f"/me/classrooms/{classroom_id}/students")
+    cold = query_counter.count
+    query_counter.reset()
+    second = api_client.get(f"/me/classrooms/{classroom_id}/students")
+
+    assert first.status_code == second.status_code == 200
+    assert len(second.json()) == 10
+    # file + classroom + students before; then ownership + students, and students alone once cached
+    assert (cold, query_counter.count) == (2, 1)
+    assert api_client.get("/me/classrooms/not-mine/students").status_code == 404
+
+
+def test_deleting_the_file_invalidates_the_cached_ownership(api_client, db_session, seeded_file):
+    classroom_id = db_session.query(Classroom.classroom_id).filter_by(file_id=seeded_file.file_id).first()[0]
+    assert api_client.get(f"/me/classrooms/{classroom_id}").status_code == 200
+
+    assert api_client.delete("/me/file").status_code == 200
+
+    assert api_client.get(f"/me/classrooms/{classroom_id}").status_code == 404
+    assert api_client.get("/me/file/download").status_code == 404
+
+
+def test_stale_ownership_is_checked_before_404_and_not_used_for_writes(api_client, db_session, seeded_file):
+    old_classroom = db_session.query(Classroom.classroom_id).filter_by(file_id=seeded_file.file_id).first()[0]
+    assert api_client.get(f"/me/classrooms/{old_classroom}").status_code == 200  # cached
+
+    # Another worker deletes and re-uploads the file: this process' cache is not invalidated
+    db_session.delete(seeded_file)
+    db_session.flush()
+    new_file = UploadedFile(user_id=seeded_file.user_id, file_name="new.xls", storage_path="new.xls")
+    db_session.add(new_file)
+    db_session.flush()
+    populate_database(db_session, new_file.file_id, build_parsed_data(n_students=20, n_sheets=2))
+    db_session.commit()
+    classroom = db_session.query(Classroom).filter_by(file_id=new_file.file_id).first()
+
+    assert api_client.get(f"/me/classrooms/{classroom.classroom_id}").status_code == 200
+    response = api_client.put(
+        f"/me/classrooms/{classroom.classroom_id}/grades",
+        json={"classroom_grades": [{
+            "student_id": str(classroom.students[0].student_id),
+            "new_evaluation": 15.5,
+            "new_first_assignment": 12.0,
+            "new_final_exam": 18.0,
+            "new_observation": "bien",
+        }]},
+    )
+    assert response.status_code == 200
+    assert {w.file_id for w in db_session.query(PendingSheetWrite)} == {new_file.file_id}
@@ -0,0 +1,65 @@
+import asyncio
+
+from sqlalchemy import text
+
+from app.database.database import (
+    DatabaseSettings, TimedQueuePool, TimedAsyncQueuePool, create_db_engine, pool_status,
+    POOL_CHECKED_OUT, POOL_CHECKOUT_WAIT, POOL_CONNECTS, POOL_OVERFLOW,
+)
+
+
+def test_settings_from_env(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "postgresql://u:p@pgbouncer:6432/niqatechdb")
+    monkeypatch.setenv("DB_POOL_SIZE", "3")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "false")
+    monkeypatch.setenv("DB_PGBOUNCER", "1")
+    monkeypatch.setenv("DB_STATEMENT_TIMEOUT_MS", "5000")
+
+    settings = DatabaseSettings.from_env()
+
+    assert settings.url == "postgresql://u:p@pgbouncer:6432/niqatechdb"
+    assert settings.pool_size == 3
+    assert settings.pool_pre_ping is False
+    assert settings.pgbouncer is True
+    assert settings.statement_timeout_ms == 5000
+    assert settings.max_overflow == DatabaseSettings.max_overflow
+
+
+def test_engine_pool_is_sized_and_instrumented(tmp_path):
+    engine = create_db_engine(DatabaseSettings(
+        url=f"sqlite:///{tmp_path / 'pool.db'}", pool_size=2, max_overflow=1, pool_recycle=60,
+    ))
+    waits_before = POOL_CHECKOUT_WAIT.labels().snapshot()["count"]
+    connects_before = POOL_CONNECTS.labels().snapshot()
+
+    with engine.connect() as first, engine.connect() as second, engine.connect() as third:
+        for conn in (first, second, third):
+            assert conn.execute(text("select 1")).scalar() == 1
+        status = pool_status(engine)
+        assert POOL_CHECKED_OUT.labels("sync").snapshot() == 3
+        assert POOL_OVERFLOW.labels("sync").snapshot() == 1
+
+    assert isinstance(engine.pool, TimedQueuePool)
+    assert engine.pool._recycle == 60
+    assert status["checked_out"] == 3
+    assert status["overflow"] == 1
+    assert POOL_CHECKOUT_WAIT.labels().snapshot()["count"] == waits_before + 3
+    assert POOL_CONNECTS.labels().snapshot() == connects_before + 3
+    assert pool_status(engine)["checked_out"] == 0
+    assert POOL_CHECKED_OUT.labels("sync").snapshot() == 0
+    assert POOL_OVERFLOW.labels("sync").snapshot() == 0
+    engine.dispose()
+
+
+def test_async_engine_uses_the_asyncio_driver(tmp_path):
+    engine = create_db_engine(DatabaseSettings(url=f"sqlite:///{tmp_path / 'async.db'}", pool_size=2), asynchronous=True)
+
+    async def select_one():
+        async with engine.connect() as conn:
+            return (await conn.execute(text("select 1"))).scalar()
+
+    assert engine.url.drivername == "sqlite+aiosqlite"
+    assert isinstance(engine.pool, TimedAsyncQueuePool)
+    assert asyncio.run(select_one()) == 1
+    assert POOL_CHECKED_OUT.labels("async").snapshot() == 0
+    asyncio.run(engine.dispose())
@@ -0,0 +1,99 @@
+import asyncio
+
+from app.v1.metrics import REGISTRY
+from app.v1.services.embedding_cache import CachedEmbeddings, EmbeddingCache
+from app.v1.services.embeddings import HashingEmbeddings
+
+
+class CountingEmbeddings(HashingEmbeddings):
+    def __init__(self):
+        super().__init__(size=16)
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+def counter(name, *labels):
+    return REGISTRY[name].labels(*labels).snapshot()
+
+
+def test_repeated_texts_are_embedded_once(tmp_path):
+    model = CountingEmbeddings()
+    cached = CachedEmbeddings(model, EmbeddingCache(str(tmp_path / "cache.sqlite3")))
+    bytes_saved = counter("embedding_cache_bytes_saved_total")
+
+    first = cached.embed_documents(["Les notes sont sur 20.", "Le conseil de classe"])
+    again = asyncio.run(cached.aembed_documents(["Les  notes sont sur 20. ", "Le conseil de classe"]))
+
+    assert model.embedded == ["Les notes sont sur 20.", "Le conseil de classe"]
+    assert again == first
+    assert counter("embedding_cache_bytes_saved_total") - bytes_saved == 2 * 16 * 4
+
+
+def test_disk_tier_survives_restarts(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = EmbeddingCache(path)
+    vector = CachedEmbeddings(CountingEmbeddings(), cache).embed_query("moyenne du trimestre")
+    cache.close()
+
+    model = CountingEmbeddings()
+    disk_hits = counter("embedding_cache_lookups_total", "disk")
+    cached = CachedEmbeddings(model, EmbeddingCache(path))
+    assert asyncio.run(cached.aembed_query("moyenne du trimestre")) == vector
+    assert model.embedded == []
+    assert counter("embedding_cache_lookups_total", "disk") - disk_hits == 1
+
+
+def test_models_do_not_share_vectors(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"))
+    small, large = HashingEmbeddings(size=8), HashingEmbeddings(size=16)
+
+    assert len(CachedEmbeddings(small, cache).embed_query("bonjour")) == 8
+    assert len(CachedEmbeddings(large, cache).embed_query("bonjour")) == 16
+
+
+def test_memory_tier_is_bounded():
+    cache = EmbeddingCache(path="", memory_size=2)
+    model = CountingEmbeddings()
+    cached = CachedEmbeddings(model, cache)
+
+    cached.embed_documents(["a", "b", "c"])
+    cached.embed_documents(["a"])  # evicted, memory only: embedded again
+    assert model.embedded == ["a", "b", "c", "a"]
+
+
+def test_disk_tier_failures_do_not_fail_the_call(tmp_path, monkeypatch):
+    from fastapi import HTTPException
+    from app.v1.services import embedding_cache
+
+    async def saturated(fn, *args):
+        raise HTTPException(status_code=503, detail="busy")
+
+    monkeypatch.setattr(embedding_cache.io_pool, "run", saturated)
+    model = CountingEmbeddings()
+    cached = CachedEmbeddings(model, EmbeddingCache(str(tmp_path / "cache.sqlite3")))
+
+    vectors = asyncio.run(cached.aembed_documents(["bulletin", "absences"]))
+    assert vectors == HashingEmbeddings(size=16).embed_documents(["bulletin", "absences"])
+    # still served from memory
+    asyncio.run(cached.aembed_documents(["bulletin"]))
+    assert model.embedded == ["bulletin", "absences"]
+
+
+def test_memory_lookups_do_not_wait_for_the_disk_tier(tmp_path):
+    import threading
+
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"))
+    cached = CachedEmbeddings(HashingEmbeddings(size=8), cache)
+    cached.embed_query("bonjour")
+    key = list(cache._memory)[0][1]
+    found = []
+
+    with cache._db_lock:  # a disk write in progress in the io pool
+        lookup = threading.Thread(target=lambda: found.append(cache.get_memory(cached.model, [key])))
+        lookup.start()
+        lookup.join(timeout=2)
+        assert not lookup.is_alive()
+    assert found == [{key: cache._memory[(cached.model, key)]}]
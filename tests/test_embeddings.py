@@ -0,0 +1,74 @@
+import asyncio
+import math
+
+import pytest
+
+from app.v1.services.embeddings import EmbeddingBatcher, HashingEmbeddings
+
+
+class RecordingEmbeddings(HashingEmbeddings):
+    """ HashingEmbeddings remembering the batches it was called with."""
+    def __init__(self, fail=False):
+        super().__init__(size=32)
+        self.calls = []
+        self.fail = fail
+
+    async def aembed_documents(self, texts):
+        self.calls.append(list(texts))
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise RuntimeError("embedding service down")
+        return self.embed_documents(texts)
+
+
+def test_hashing_embeddings_are_deterministic_and_normalised():
+    embeddings = HashingEmbeddings(size=64)
+    first, again, other = embeddings.embed_documents(["les notes du trimestre", "les notes du trimestre", "conseil"])
+
+    assert first == again and first != other
+    assert math.isclose(sum(x * x for x in first), 1.0)
+    assert len(embeddings.embed_query("")) == 64
+
+
+def test_concurrent_requests_share_one_call():
+    backend = RecordingEmbeddings()
+    batcher = EmbeddingBatcher(backend, window_ms=20)
+
+    async def chats():
+        return await asyncio.gather(
+            batcher.embed(["notes", "bareme"]),
+            batcher.embed(["notes", "absences"]),
+            batcher.embed_query("bareme"),
+        )
+
+    first, second, third = asyncio.run(chats())
+
+    assert backend.calls == [["notes", "bareme", "absences"]]  # one call, each text once
+    assert first == backend.embed_documents(["notes", "bareme"])
+    assert second[0] == first[0]
+    assert third == first[1]
+
+
+def test_max_batch_size_sends_early():
+    backend = RecordingEmbeddings()
+    batcher = EmbeddingBatcher(backend, max_batch_size=2, window_ms=10_000)
+
+    vectors = asyncio.run(asyncio.wait_for(batcher.embed(["a", "b", "c", "d"]), timeout=5))
+
+    assert backend.calls == [["a", "b"], ["c", "d"]]
+    assert len(vectors) == 4
+
+
+def test_failures_reach_every_waiting_caller():
+    batcher = EmbeddingBatcher(RecordingEmbeddings(fail=True), window_ms=1)
+
+    async def chats():
+        return await asyncio.gather(batcher.embed(["a"]), batcher.embed(["a", "b"]), return_exceptions=True)
+
+    results = asyncio.run(chats())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+    # Nothing is left behind: a later call goes to the model again
+    with pytest.raises(RuntimeError):
+        asyncio.run(batcher.embed(["a"]))
+    assert batcher.embeddings.calls == [["a", "b"], ["a"]]
@@ -0,0 +1,175 @@
+import asyncio
+import datetime
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from fastapi import HTTPException
+from google.auth import crypt, jwt as google_jwt
+
+from app.v1.auth.google_certs import GoogleCertCache, parse_max_age
+from app.v1.routers import auth
+from app.v1.schemas.schemas import TokenData
+
+
+AUDIENCE = "client-id.apps.googleusercontent.com"
+
+
+def make_key(key_id):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "test")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(1).not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption(),
+    )
+    signer = crypt.RSASigner.from_string(private_pem, key_id=key_id)
+    return signer, cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+def make_token(signer, **claims):
+    now = int(time.time())
+    payload = {"iss": "https://accounts.google.com", "aud": AUDIENCE, "sub": "1234567890",
+               "email": "teacher@example.com", "iat": now, "exp": now + 600, **claims}
+    return google_jwt.encode(signer, payload).decode()
+
+
+class CertServer:
+    """ Stand-in for https://www.googleapis.com/oauth2/v1/certs."""
+    def __init__(self, certs, max_age=3600):
+        self.certs = certs
+        self.max_age = max_age
+        self.hits = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.hits += 1
+                body = json.dumps(server.certs).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Cache-Control", f"public, max-age={server.max_age}, must-revalidate")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/certs"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def signing_key():
+    return make_key("key-1")
+
+
+@pytest.fixture
+def cert_server(signing_key):
+    server = CertServer({"key-1": signing_key[1]})
+    yield server
+    server.close()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_parse_max_age():
+    assert parse_max_age("public, max-age=19702, must-revalidate, no-transform") == 19702
+    assert parse_max_age(None, default=60) == 60
+
+
+def test_certificates_are_cached_for_max_age(cert_server, signing_key):
+    clock = FakeClock()
+    cache = GoogleCertCache(url=cert_server.url, refresh_margin=0, clock=clock)
+    token = make_token(signing_key[0])
+
+    for _ in range(5):
+        assert cache.verify(token, AUDIENCE)["email"] == "teacher@example.com"
+    assert cert_server.hits == 1
+
+    clock.now += 3600
+    cache.verify(token, AUDIENCE)
+    assert cert_server.hits == 2
+    cache.close()
+
+
+def test_certificates_are_refreshed_in_background_before_expiry(cert_server, signing_key):
+    clock = FakeClock()
+    cache = GoogleCertCache(url=cert_server.url, refresh_margin=300, clock=clock)
+    token = make_token(signing_key[0])
+    cache.verify(token, AUDIENCE)
+
+    clock.now += 3400  # inside the refresh margin, still valid
+    cache.verify(token, AUDIENCE)
+    deadline = time.monotonic() + 5
+    while cache._expires_at != clock.now + 3600 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert cert_server.hits == 2
+    assert cache._expires_at == clock.now + 3600
+    cache.close()
+
+
+def test_rotated_key_triggers_a_refetch(cert_server, signing_key):
+    cache = GoogleCertCache(url=cert_server.url)
+    cache.verify(make_token(signing_key[0]), AUDIENCE)
+
+    new_signer, new_cert = make_key("key-2")
+    cert_server.certs = {"key-1": signing_key[1], "key-2": new_cert}
+    cache._fetched_at -= 60  # outside the minimum refetch interval
+
+    assert cache.verify(make_token(new_signer), AUDIENCE)["sub"] == "1234567890"
+    assert cert_server.hits == 2
+    cache.close()
+
+
+def test_invalid_tokens_are_rejected(cert_server, signing_key):
+    cache = GoogleCertCache(url=cert_server.url)
+    with pytest.raises(ValueError):
+        cache.verify(make_token(signing_key[0], iss="https://evil.example.com"), AUDIENCE)
+    with pytest.raises(ValueError):
+        cache.verify(make_token(signing_key[0]), "another-client-id")
+    cache.close()
+
+
+def test_verify_google_token_uses_the_cache(cert_server, signing_key, monkeypatch):
+    cache = GoogleCertCache(url=cert_server.url)
+    monkeypatch.setattr(auth, "google_certs", cache)
+    monkeypatch.setattr(auth, "GOOGLE_CLIENT_ID", AUDIENCE)
+
+    async def login_twice():
+        first = await auth.verify_google_token(TokenData(token=make_token(signing_key[0])))
+        second = await auth.verify_google_token(TokenData(token=make_token(signing_key[0])))
+        return first, second
+
+    first, second = asyncio.run(login_twice())
+    assert first == second == {"user_id": "1234567890", "email": "teacher@example.com"}
+    assert cert_server.hits == 1
+
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(auth.verify_google_token(TokenData(token="not-a-token")))
+    assert exc_info.value.status_code == 401
+    cache.close()
@@ -0,0 +1,137 @@
+import asyncio
+
+import httpx
+import pytest
+from qdrant_client import AsyncQdrantClient
+
+from app.database import database
+from app.database.database import DocumentIndexer
+from app.main import app
+from app.v1.services.chunk_manifest import ChunkManifest
+from app.v1.services.clients import ClientRegistry
+from app.v1.services.embeddings import HashingEmbeddings
+from app.v1.services.ingestion import IncrementalSplitter
+
+
+TEXT = "\n\n".join(
+    f"Paragraphe {i}. La moyenne du trimestre {i} est calculee a partir des notes, des devoirs et de l'examen."
+    for i in range(200)
+)
+
+
+class TrackingEmbeddings(HashingEmbeddings):
+    """ Records batch sizes and the highest number of concurrent calls."""
+    def __init__(self):
+        super().__init__(size=32)
+        self.batches, self.running, self.max_running = [], 0, 0
+
+    async def aembed_documents(self, texts):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        self.batches.append(len(texts))
+        await asyncio.sleep(0.005)
+        self.running -= 1
+        return self.embed_documents(texts)
+
+
+class FlakyQdrant(AsyncQdrantClient):
+    """ In-memory Qdrant whose first upsert fails."""
+    def __init__(self):
+        super().__init__(location=":memory:")
+        self.upsert_failures = 1
+        self.exists_checks = 0
+
+    async def collection_exists(self, collection_name):
+        self.exists_checks += 1
+        return await super().collection_exists(collection_name)
+
+    async def upsert(self, *args, **kwargs):
+        if self.upsert_failures:
+            self.upsert_failures -= 1
+            raise ConnectionError("qdrant unavailable")
+        return await super().upsert(*args, **kwargs)
+
+
+def test_incremental_splitting_matches_chunk_bounds():
+    splitter = IncrementalSplitter(chunk_size=200, chunk_overlap=20)
+    chunks = []
+    for start in range(0, len(TEXT), 37):
+        chunks += splitter.feed(TEXT[start:start + 37])
+    chunks += splitter.finish()
+
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    assert all(f"Paragraphe {i}." in "".join(chunks) for i in range(200))
+    assert chunks[0] == IncrementalSplitter(chunk_size=200, chunk_overlap=20).splitter.split_text(TEXT)[0]
+
+
+def test_chunks_are_indexed_in_bounded_batches_with_retries(monkeypatch):
+    monkeypatch.setattr(database, "INGEST_RETRY_BACKOFF_SECONDS", 0)
+    embeddings = TrackingEmbeddings()
+
+    async def run():
+        client = FlakyQdrant()
+        indexer = DocumentIndexer(client, embeddings, batch_size=10, concurrency=3)
+        report = await indexer.index_chunks([f"chunk {i}" for i in range(95)], {"source": "doc.md"})
+        count = await client.count(indexer.collection_name)
+        return report.added, count.count, client.exists_checks
+
+    indexed, count, exists_checks = asyncio.run(run())
+    assert indexed == count == 95
+    assert embeddings.batches == [10] * 9 + [5]
+    assert 1 < embeddings.max_running <= 3
+    assert exists_checks == 1  # the collection is looked up once, then cached
+
+
+def test_upload_is_indexed_by_a_background_job(api_client):
+    async def run():
+        registry = ClientRegistry(qdrant=AsyncQdrantClient(location=":memory:"))
+        registry.use_embeddings(HashingEmbeddings(size=32))
+        app.state.clients = registry
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post("/assistant/file/upload", files={"file": ("cours.md", TEXT.encode())})
+            assert response.status_code == 202
+            job = response.json()
+            for _ in range(200):
+                job = (await client.get(f"/assistant/file/upload/{job['job_id']}")).json()
+                if job["status"] in ("done", "failed"):
+                    break
+                await asyncio.sleep(0.01)
+            missing = await client.get("/assistant/file/upload/unknown")
+        count = await registry.qdrant.count("rag_collection")
+        return job, missing.status_code, count.count
+
+    try:
+        job, missing_status, count = asyncio.run(run())
+    finally:
+        del app.state.clients
+
+    assert job["status"] == "done", job
+    assert job["bytes_read"] == job["total_bytes"] == len(TEXT.encode())
+    assert job["chunks_indexed"] == count > 0
+    assert missing_status == 404
+
+
+def test_reindexing_a_revised_document_only_embeds_the_diff(async_db_engine):
+    embeddings = TrackingEmbeddings()
+    version_1 = ["Introduction", "Chapitre 1: les notes", "Chapitre 2: les moyennes", "Annexe"]
+    version_2 = ["Introduction", "Chapitre 1: les notes", "Chapitre 2: les moyennes ponderees", "Annexe", "Annexe"]
+
+    async def run():
+        client = AsyncQdrantClient(location=":memory:")
+        indexer = DocumentIndexer(client, embeddings, manifest=ChunkManifest(async_db_engine))
+        first = await indexer.index_chunks(version_1, {"source": "programme.md"})
+        embeddings.batches.clear()
+        second = await indexer.index_chunks(version_2, {"source": "programme.md"})
+        embedded_again = list(embeddings.batches)
+        other = await indexer.index_chunks(version_1[:1], {"source": "autre.md"})
+        points, _ = await client.scroll(indexer.collection_name, limit=100)
+        return first, second, embedded_again, other, sorted(p.payload["page_content"] for p in points)
+
+    first, second, embedded_again, other, contents = asyncio.run(run())
+    assert (first.added, first.skipped, first.deleted) == (4, 0, 0)
+    assert (second.added, second.skipped, second.deleted) == (1, 4, 1)
+    assert embedded_again == [1]
+    # the same text in another source is a separate chunk
+    assert other.added == 1
+    assert contents == sorted(version_2[:4] + ["Introduction"])
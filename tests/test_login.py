@@ -0,0 +1,204 @@
+import asyncio
+import threading
+
+import pytest
+from jose import jwt
+from pwdlib import PasswordHash
+from pwdlib.hashers.argon2 import Argon2Hasher
+
+from fastapi.testclient import TestClient
+
+from app.database.models import User
+from app.main import app
+from app.v1.auth import dependencies, hashing, jwt_utils, rate_limit
+from app.v1.auth.dependencies import get_current_user
+from app.v1.auth.rate_limit import SlidingWindowLimiter
+from app.v1.auth.token_cache import ClaimsCache, RevocationList
+from app.v1.schemas.schemas import AcademicLevelEnum
+from app.v1.utils import get_password_hash, password_hash
+
+
+PASSWORD = "correct-horse-battery"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def local_user(db_session):
+    user = User(id="teacher-2", email="local@example.com", auth_provider="local",
+                hash_password=get_password_hash(PASSWORD), first_name="A", last_name="B",
+                school_name="School", academic_level=AcademicLevelEnum.secondary, city="City", subject="Math")
+    db_session.add(user)
+    db_session.commit()
+    return user
+
+
+@pytest.fixture(autouse=True)
+def jwt_settings(monkeypatch):
+    monkeypatch.setattr(jwt_utils, "SECRET_KEY", "test-secret")
+    monkeypatch.setattr(jwt_utils, "ALGORITHM", "HS256")
+
+
+@pytest.fixture
+def token_state(monkeypatch, tmp_path):
+    """ Empty claims cache and revocation list, the list saved under tmp_path."""
+    path = str(tmp_path / "revoked.json")
+    monkeypatch.setattr(dependencies, "claims_cache", ClaimsCache())
+    monkeypatch.setattr(dependencies, "revoked_tokens", RevocationList(path, bloom_bits=1024))
+    return path
+
+
+@pytest.fixture
+def limiters(monkeypatch):
+    client = SlidingWindowLimiter(max_attempts=3, window_seconds=60)
+    email = SlidingWindowLimiter(max_attempts=5, window_seconds=60)
+    monkeypatch.setattr(rate_limit, "client_limiter", client)
+    monkeypatch.setattr(rate_limit, "email_limiter", email)
+    return client, email
+
+
+def test_sliding_window_limiter():
+    clock = FakeClock()
+    limiter = SlidingWindowLimiter(max_attempts=2, window_seconds=10, max_keys=2, clock=clock)
+
+    assert limiter.hit("a") == 0
+    clock.now = 4
+    assert limiter.hit("a") == 0
+    assert limiter.hit("a") == 6  # first attempt leaves the window at t=10
+    clock.now = 10
+    assert limiter.hit("a") == 0
+
+    limiter.hit("b")
+    limiter.hit("c")  # evicts "a", the least recently used key
+    assert "a" not in limiter._attempts
+
+
+def test_login_hashes_in_the_hash_pool(api_client, local_user, limiters, monkeypatch):
+    threads = []
+    verify = hashing.verify_and_update_password
+
+    def recording_verify(*args):
+        threads.append(threading.current_thread().name)
+        return verify(*args)
+
+    monkeypatch.setattr(hashing, "verify_and_update_password", recording_verify)
+
+    response = api_client.post("/auth/login", json={"email": "local@example.com", "password": PASSWORD})
+    assert response.status_code == 200
+    assert response.json()["user_id"] == "teacher-2"
+    assert threads and threads[0].startswith("hash")
+
+    response = api_client.post("/auth/login", json={"email": "local@example.com", "password": "wrong-password"})
+    assert response.status_code == 401
+
+
+def test_login_is_rate_limited_per_client_and_account(api_client, local_user, limiters, monkeypatch):
+    monkeypatch.setattr(rate_limit, "trusted_proxies", rate_limit.parse_networks("10.0.0.0/8"))
+    proxy = TestClient(app, client=("10.0.0.2", 50000))  # every client comes through the reverse proxy
+
+    def login(client_ip, email, password="wrong-password"):
+        return proxy.post("/auth/login", json={"email": email, "password": password},
+                          headers={"X-Forwarded-For": f"{client_ip}, 10.0.0.9"})
+
+    for _ in range(3):
+        assert login("203.0.113.5", "local@example.com").status_code == 401
+    response = login("203.0.113.5", "LOCAL@example.com", PASSWORD)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+
+    # Neither other clients behind the same proxy nor the client's other accounts are locked out
+    assert login("198.51.100.7", "local@example.com", PASSWORD).status_code == 200
+    assert login("203.0.113.5", "other@example.com").status_code == 401
+    # A forged X-Forwarded-For from a client that is not a proxy is ignored
+    assert api_client.post("/auth/login", json={"email": "local@example.com", "password": PASSWORD},
+                           headers={"X-Forwarded-For": "192.0.2.1"}).status_code == 200
+    # The account itself has a limit, whatever the client
+    assert login("192.0.2.44", "local@example.com").status_code == 429
+
+
+def test_outdated_hash_is_upgraded_on_login(api_client, db_session, local_user, limiters):
+    weak = PasswordHash((Argon2Hasher(time_cost=1, memory_cost=8192, parallelism=1),))
+    weak_hash = local_user.hash_password = weak.hash(PASSWORD)
+    db_session.commit()
+
+    assert api_client.post("/auth/login", json={"email": "local@example.com", "password": PASSWORD}).status_code == 200
+
+    db_session.expire_all()
+    upgraded = db_session.get(User, "teacher-2").hash_password
+    assert upgraded != weak_hash
+    assert not password_hash.verify_and_update(PASSWORD, upgraded)[1]
+
+
+def test_verified_claims_are_cached_until_the_token_expires(api_client, token_state, monkeypatch):
+    decoded = []
+    decode = jwt.decode
+    monkeypatch.setattr(dependencies.jwt, "decode", lambda *args, **kwargs: decoded.append(1) or decode(*args, **kwargs))
+    del api_client.app.dependency_overrides[get_current_user]
+
+    token = asyncio.run(jwt_utils.create_access_token({"user_id": "teacher-1"}))
+    assert "exp" in jwt.get_unverified_claims(token)
+    for _ in range(3):
+        assert api_client.get("/me/file", headers={"Authorization": f"Bearer {token}"}).status_code == 404  # no user
+    assert len(decoded) == 1
+
+    expired = asyncio.run(jwt_utils.create_access_token({"user_id": "teacher-1"}, expires_minutes=-1))
+    response = api_client.get("/me/file", headers={"Authorization": f"Bearer {expired}"})
+    assert response.status_code == 401
+
+
+def test_logout_revokes_the_token_for_every_worker(api_client, token_state):
+    del api_client.app.dependency_overrides[get_current_user]
+    token = asyncio.run(jwt_utils.create_access_token({"user_id": "teacher-1"}))
+    other = asyncio.run(jwt_utils.create_access_token({"user_id": "teacher-1", "device": "phone"}))
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert api_client.post("/me/logout", params={"data": "bye"}, headers=headers).status_code == 200
+
+    response = api_client.get("/me/file", headers=headers)
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Token has been revoked"
+    assert api_client.get("/me/file", headers={"Authorization": f"Bearer {other}"}).status_code == 404
+
+    # A fresh process loads the revocations from disk at startup
+    reloaded = RevocationList(token_state, bloom_bits=1024)
+    assert not reloaded.is_revoked(dependencies.token_digest(token))  # the request path never reads the file
+    reloaded.load()
+    assert reloaded.is_revoked(dependencies.token_digest(token))
+    assert not reloaded.is_revoked(dependencies.token_digest(other))
+
+
+def test_logout_expires_the_revocation_with_the_token_even_when_its_claims_were_evicted(api_client, token_state,
+                                                                                        monkeypatch):
+    del api_client.app.dependency_overrides[get_current_user]
+    monkeypatch.setattr(dependencies, "claims_cache", ClaimsCache(max_entries=0))
+    token = asyncio.run(jwt_utils.create_access_token({"user_id": "teacher-1"}))
+
+    assert api_client.post("/me/logout", params={"data": "bye"}, headers={"Authorization": f"Bearer {token}"}).status_code == 200
+
+    expires = dependencies.revoked_tokens._revoked[dependencies.token_digest(token)]
+    assert expires == jwt.get_unverified_claims(token)["exp"]
+
+
+def test_revocations_from_other_workers_are_picked_up_in_the_background(token_state):
+    digest = dependencies.token_digest("another-workers-token")
+
+    async def scenario():
+        reloaded = RevocationList(token_state, bloom_bits=1024, reload_seconds=0.01)
+        reloaded.start()
+        try:
+            RevocationList(token_state, bloom_bits=1024).revoke(digest, None)
+            for _ in range(200):
+                if reloaded.is_revoked(digest):
+                    return True
+                await asyncio.sleep(0.01)
+            return False
+        finally:
+            await reloaded.stop()
+
+    assert asyncio.run(scenario())
@@ -0,0 +1,69 @@
+import io
+import json
+import logging
+
+import pytest
+
+from app.v1 import logs
+
+
+@pytest.fixture
+def output():
+    stream = io.StringIO()
+    yield stream
+    logs.configure_logging()  # back to the application's setup
+
+
+def test_records_are_written_as_json_by_the_listener(output):
+    logs.configure_logging(stream=output, rate_limit=0)
+    logger = logging.getLogger("__tests/test_logs.py__")
+
+    logger.debug("Below the level: %s", "dropped")
+    logger.info("Saved %s cells to %s", 4, "grades.xls", extra={"file_id": 7})
+    logs.shutdown_logging()
+
+    entry = json.loads(output.getvalue())
+    assert entry["message"] == "Saved 4 cells to grades.xls"
+    assert entry["level"] == "INFO" and entry["logger"] == "__tests/test_logs.py__"
+    assert entry["file_id"] == 7
+
+
+def test_hot_path_messages_are_sampled_and_rate_limited(output):
+    logs.configure_logging(stream=output, fmt="text", rate_limit=5, hot_loggers=["__tests/hot__"],
+                           sample_rates={"__tests/sampled__": 0.0})
+    hot, sampled = logging.getLogger("__tests/hot__"), logging.getLogger("__tests/sampled__")
+    cold = logging.getLogger("__tests/cold__")
+
+    for i in range(50):
+        hot.info("Updated grades for student %s", i)
+        sampled.info("Updated grades for student %s", i)
+        cold.info("Updated grades for student %s", i)
+    for i in range(10):
+        hot.warning("Committed %s", i)
+    sampled.error("Committed")
+    logs.shutdown_logging()
+
+    lines = output.getvalue().splitlines()
+    assert sum("__tests/hot__" in line and "INFO" in line for line in lines) == 5
+    assert sum("__tests/cold__" in line for line in lines) == 50  # only the hot-path loggers are limited
+    assert not any("__tests/sampled__" in line and "INFO" in line for line in lines)
+    assert sum("Committed" in line for line in lines) == 11  # warnings and errors always go through
+    assert not logging.getLogger("__tests/hot__").filters  # removed with the setup
+
+
+def test_messages_are_rendered_when_logged(output):
+    logs.configure_logging(stream=output, rate_limit=0)
+    logger = logging.getLogger("__tests/test_logs.py__")
+    grades = {"evaluation": 12.0}
+
+    logger.info("New grades: %s", grades)
+    grades["evaluation"] = 3.0  # changed before the listener gets to the record
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        logger.exception("Failed")
+    logs.shutdown_logging()
+
+    first, second = map(json.loads, output.getvalue().splitlines())
+    assert first["message"] == "New grades: {'evaluation': 12.0}"
+    assert "ZeroDivisionError" in second["exception"]
@@ -1,36 +1,34 @@
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import patch , MagicMock
-from app.main import app  
+from unittest.mock import patch
+from app.main import app
+from app.database.models import User
+from app.v1.auth import jwt_utils
 
 client = TestClient(app)
 
 
-@pytest.fixture
-def mock_db_session():
-    """ Fixture to mock the database session. """
-    mock_db_session = MagicMock()
-    mock_db_session.query.return_value.filter_by.return_value.first.return_value = None
-    return mock_db_session
-
-def test_google_auth_first_login(mock_db_session):
-    """ Test Google authentication for a first-time user login. """
+def test_google_auth_first_login(api_client, db_session, monkeypatch):
+    """ Test Google sign-up of a first-time user, through the cached Google certificates. """
     fake_token = "fake-google-oauth-token"
 
     fake_id_info = {
         'sub': '1234567890',
         'email': 'test@example.com'
     }
-    with patch('app.v1.routers.auth.id_token.verify_oauth2_token', return_value=fake_id_info), \
-            patch('app.v1.routers.auth.get_db', return_value=mock_db_session):
-    
-            response = client.post("/auth/google", json={"token": fake_token})
-            assert response.status_code == 200
-            data = response.json()
-            assert data["message"] == "User first login. Please complete the profile."
-            assert data["user_id"] == '1234567890'
-            assert data["email"] == 'test@example.com'
-            assert "jwt_token" in data
+    monkeypatch.setattr(jwt_utils, "SECRET_KEY", "test-secret")
+    with patch('app.v1.routers.auth.google_certs.verify', return_value=fake_id_info) as verify:
+        response = api_client.post("/auth/google/signup", json={"token": fake_token})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["message"] == "User has been created. Please complete the profile."
+    assert data["user_id"] == '1234567890'
+    assert data["email"] == 'test@example.com'
+    assert data["is_profile_complete"] is False
+    assert "jwt_token" in data
+    assert verify.call_args.args[0] == fake_token
+    assert db_session.get(User, '1234567890').auth_provider == "google"
 
 
 def test_root_endpoint():
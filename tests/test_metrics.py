@@ -0,0 +1,40 @@
+from app.v1.metrics import Counter, Histogram, exposition
+from app.v1.telemetry import DB_QUERIES_PER_REQUEST, HTTP_LATENCY, instrument_engine
+
+
+def test_exposition_is_in_the_prometheus_text_format():
+    requests = Counter("test_exposition_requests_total", "Requests", ("path",))
+    latency = Histogram("test_exposition_seconds", "Latency", buckets=(0.1, 1.0))
+    requests.labels('/a "quoted"\npath').inc(2)
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+
+    lines = exposition().splitlines()
+
+    assert "# TYPE test_exposition_requests_total counter" in lines
+    assert 'test_exposition_requests_total{path="/a \\"quoted\\"\\npath"} 2.0' in lines
+    assert "# TYPE test_exposition_seconds histogram" in lines
+    assert 'test_exposition_seconds_bucket{le="0.1"} 1' in lines
+    assert 'test_exposition_seconds_bucket{le="1.0"} 2' in lines
+    assert 'test_exposition_seconds_bucket{le="+Inf"} 3' in lines
+    assert "test_exposition_seconds_sum 5.55" in lines
+    assert "test_exposition_seconds_count 3" in lines
+
+
+def test_requests_are_measured_by_route_with_their_queries(api_client, seeded_file, async_db_engine):
+    instrument_engine(async_db_engine.sync_engine)
+    latency = HTTP_LATENCY.labels("GET", "/me/classrooms", 200)
+    queries = DB_QUERIES_PER_REQUEST.labels("/me/classrooms")
+    requests_before, queries_before = latency.snapshot()["count"], queries.snapshot()["sum"]
+
+    assert api_client.get("/me/classrooms").status_code == 200
+    assert api_client.get("/no/such/route").status_code == 404
+
+    assert latency.snapshot()["count"] == requests_before + 1
+    assert queries.snapshot()["sum"] == queries_before + 1
+    assert HTTP_LATENCY.labels("GET", "unmatched", 404).snapshot()["count"] >= 1
+
+    response = api_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'http_request_duration_seconds_count{method="GET",route="/me/classrooms",status="200"}' in response.text
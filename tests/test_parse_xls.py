@@ -0,0 +1,26 @@
+from app.v1.utils import parse_xls
+from benchmarks.fixtures import build_grade_workbook
+
+
+def test_parse_xls_reads_every_classroom_sheet():
+    data = parse_xls(build_grade_workbook(n_students=25, n_sheets=3))
+
+    assert len(data["classrooms"]) == 3  # the trailing summary sheet is skipped
+    classroom = data["classrooms"][0]
+    assert classroom["term"] == "الأول"
+    assert classroom["year"] == "2020-2021"
+    assert classroom["level"] == "أولى  متوسط    1"
+    assert classroom["subject"] == "المعلوماتية"
+    assert classroom["classroom_name"] == "Sheet-0"
+    assert classroom["number_of_students"] == 9
+    assert sum(len(c["students"]) for c in data["classrooms"]) == 25
+
+
+def test_parse_xls_student_rows():
+    student = parse_xls(build_grade_workbook(n_students=3, n_sheets=1))["classrooms"][0]["students"][0]
+
+    assert student["id"] == 1
+    assert student["row"] == 8
+    assert student["last_name"] == "Nom1"
+    assert student["first_name"] == "Prenom1"
+    assert 0 <= student["evaluation"] <= 20
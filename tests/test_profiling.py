@@ -0,0 +1,65 @@
+import asyncio
+import sys
+import threading
+
+from app.v1 import profiling
+from app.v1.telemetry import RequestStats, instrument_engine
+
+
+def test_responses_carry_server_timing(api_client, seeded_file, async_db_engine):
+    instrument_engine(async_db_engine.sync_engine)
+
+    response = api_client.get("/me/classrooms")
+
+    assert response.status_code == 200
+    timing = response.headers["server-timing"]
+    assert 'db;dur=' in timing and 'desc="1 queries"' in timing
+    assert "total;dur=" in timing
+    assert "x-profile-id" not in response.headers
+
+
+def test_profile_token_profiles_the_request(api_client, seeded_file, monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+
+    assert api_client.get("/profiles/", headers={"X-Profile": "wrong"}).status_code == 403
+    response = api_client.get("/me/classrooms", headers={"X-Profile": "secret"})
+    assert response.status_code == 200
+    profile_id = response.headers["x-profile-id"]
+
+    report = api_client.get(f"/profiles/{profile_id}", params={"profile": "secret"}).json()
+    assert report["route"] == "/me/classrooms"
+    assert report["status"] == 200
+    assert report["reason"] == "token"
+    assert "total;dur=" in report["server_timing"]
+    summaries = api_client.get("/profiles/", headers={"X-Profile": "secret"}).json()
+    assert profile_id in [summary["profile_id"] for summary in summaries]
+    assert api_client.get("/profiles/0123abcd", headers={"X-Profile": "secret"}).status_code == 404
+
+
+class TaskWithoutContext:
+    """ A task as seen before Python 3.12: no get_context()."""
+
+
+def test_samples_are_attributed_by_task_before_python_3_12(monkeypatch):
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        profile = profiling.Profile(loop, threading.get_ident(), RequestStats(), "GET", "/me/classrooms", "token")
+        profiling._track_tasks(loop)
+        profiled = profiling._profiled.set(profile)
+        started = asyncio.create_task(asyncio.sleep(0))  # e.g. an event stream producer
+        profiling._profiled.reset(profiled)
+        other = asyncio.create_task(asyncio.sleep(0))
+        await asyncio.gather(started, other)
+        return profile, started, other
+
+    profile, started, other = asyncio.run(scenario())
+    assert started in profile.tasks and other not in profile.tasks
+
+    mine, theirs = TaskWithoutContext(), TaskWithoutContext()
+    profile.tasks.add(mine)
+    for task in (mine, theirs):
+        monkeypatch.setattr(profiling.asyncio, "current_task", lambda loop=None, task=task: task)
+        profile.sample(sys._getframe())
+    assert profile.stacks[profiling.WAITING] == 1
+    assert any("test_samples_are_attributed_by_task" in stack for stack in profile.stacks)
@@ -0,0 +1,112 @@
+import asyncio
+
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import Distance, PointStruct, ScoredPoint, VectorParams
+
+from app.v1.services.embeddings import HashingEmbeddings
+from app.v1.services import retrieval
+from app.v1.services.retrieval import build_context, count_tokens, plan_retrieval, reciprocal_rank_fusion, rerank, search
+
+
+def point(point_id, text, score=0.0):
+    return ScoredPoint(id=point_id, version=0, score=score, payload={"page_content": text})
+
+
+def test_fusion_deduplicates_and_rewards_agreement():
+    a, b, c = point(1, "a"), point(2, "b"), point(3, "c")
+    fused = reciprocal_rank_fusion([[a, b], [b, c], [b, a]])
+
+    assert [p.id for p, _ in fused] == [2, 1, 3]
+    assert fused[0][1] > fused[1][1] > fused[2][1]
+
+
+def test_rerank_promotes_the_passage_matching_the_question():
+    fused = reciprocal_rank_fusion([[
+        point(1, "Le conseil de classe se tient en juin."),
+        point(2, "Les absences sont saisies chaque semaine."),
+        point(3, "La moyenne trimestrielle est la moyenne ponderee des notes."),
+    ]])
+    ranked = rerank("comment est calculee la moyenne trimestrielle", fused)
+    assert ranked[0].id == 3
+
+
+def test_context_respects_the_token_budget():
+    points = [point(1, "x" * 400), point(2, "x" * 400), point(3, "y" * 2000), point(4, "z" * 200)]
+    passages = build_context(points, token_budget=200)
+
+    # duplicate dropped, the passage that does not fit skipped, the next one kept
+    assert passages == ["x" * 400, "z" * 200]
+    assert sum(count_tokens(p) for p in passages) <= 200
+
+
+def test_search_returns_payloads_for_every_query():
+    embeddings = HashingEmbeddings(size=32)
+    texts = ["notes du trimestre", "conseil de classe", "absences des eleves"]
+
+    async def run():
+        client = AsyncQdrantClient(location=":memory:")
+        await client.create_collection("docs", vectors_config=VectorParams(size=32, distance=Distance.COSINE))
+        await client.upsert("docs", points=[
+            PointStruct(id=i, vector=v, payload={"page_content": t})
+            for i, (t, v) in enumerate(zip(texts, embeddings.embed_documents(texts)))
+        ])
+        return await search(client, "docs", embeddings.embed_documents(["notes", "absences"]), limit=1)
+
+    rankings = asyncio.run(run())
+    assert [[p.payload["page_content"] for p in ranking] for ranking in rankings] == [
+        ["notes du trimestre"], ["absences des eleves"],
+    ]
+
+
+def test_expansions_are_merged_only_when_they_meet_the_deadline():
+    embeddings = HashingEmbeddings(size=32)
+    texts = ["notes du trimestre", "conseil de classe", "absences des eleves"]
+    finished = []
+
+    async def expansion(delay):
+        await asyncio.sleep(delay)
+        finished.append(delay)
+        return ["absences", "notes"]
+
+    async def embed(queries):
+        return embeddings.embed_documents(queries)
+
+    async def run():
+        client = AsyncQdrantClient(location=":memory:")
+        await client.create_collection("docs", vectors_config=VectorParams(size=32, distance=Distance.COSINE))
+        await client.upsert("docs", points=[
+            PointStruct(id=i, vector=v, payload={"page_content": t})
+            for i, (t, v) in enumerate(zip(texts, embeddings.embed_documents(texts)))
+        ])
+        plan = lambda delay: plan_retrieval(client, "docs", "notes", embeddings.embed_query("notes"), expansion(delay),
+                                            embed, deadline_ms=100)
+        on_time, late = await plan(0.01), await plan(0.3)
+        await asyncio.gather(*retrieval._late_expansions)
+        return on_time, late
+
+    on_time, late = asyncio.run(run())
+    # The expansion found the absences; past the deadline only the query's own ranking is used
+    assert "absences des eleves" in [p.payload["page_content"] for p, _ in on_time[:2]]
+    assert [p.payload["page_content"] for p, _ in late][0] == "notes du trimestre"
+    assert len(late) == 3 and late[0][1] > late[1][1]
+    assert finished == [0.01, 0.3]  # the late expansion still completed
+
+
+def test_expansion_is_cancelled_when_the_search_fails():
+    async def expansion():
+        await asyncio.sleep(10)
+        return ["absences"]
+
+    async def run():
+        client = AsyncQdrantClient(location=":memory:")  # no collection: the search fails
+        task = asyncio.ensure_future(expansion())
+        try:
+            await plan_retrieval(client, "docs", "notes", [0.0] * 32, task, None)
+        except Exception:
+            pass
+        else:
+            raise AssertionError("the search should have failed")
+        await asyncio.sleep(0)
+        return task.cancelled()
+
+    assert asyncio.run(run())
@@ -0,0 +1,71 @@
+import asyncio
+
+from langchain_core.runnables import RunnableLambda
+
+from app.v1 import utils
+from app.v1.schemas.schemas import QueryExpantion
+from app.v1.services.embeddings import HashingEmbeddings
+from app.v1.services.semantic_cache import SemanticCache
+
+
+embeddings = HashingEmbeddings(size=256)
+QUESTION = "comment calculer la moyenne du premier trimestre"
+REPHRASED = "comment calculer la moyenne du premier trimestre svp"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_similar_queries_share_an_entry():
+    cache = SemanticCache("test", threshold=0.9)
+    cache.put(embeddings.embed_query(QUESTION), "answer")
+
+    assert cache.get(embeddings.embed_query(REPHRASED)) == "answer"
+    assert cache.get(embeddings.embed_query("date du conseil de classe")) is None
+
+
+def test_entries_expire_and_are_evicted():
+    clock = FakeClock()
+    cache = SemanticCache("test", threshold=0.99, ttl_seconds=60, max_entries=2, clock=clock)
+    first, second, third = (embeddings.embed_query(text) for text in ("absences", "notes", "bulletins"))
+
+    cache.put(first, 1)
+    clock.now += 1
+    cache.put(second, 2)
+    clock.now += 1
+    cache.get(first)        # first is now the most recently used
+    cache.put(third, 3)     # evicts second
+    assert (cache.get(first), cache.get(second), cache.get(third)) == (1, None, 3)
+
+    clock.now += 60
+    assert cache.get(first) is None and len(cache) == 0
+
+
+def test_disabled_cache_stores_nothing():
+    cache = SemanticCache("test", threshold=0.5, enabled=False)
+    cache.put(embeddings.embed_query(QUESTION), "answer")
+    assert cache.get(embeddings.embed_query(QUESTION)) is None
+
+
+def test_expansion_is_reused_and_skipped_for_short_queries(monkeypatch):
+    monkeypatch.setattr(utils, "expansion_cache", SemanticCache("test", threshold=0.9))
+    calls = []
+
+    def expand(messages):
+        calls.append(messages)
+        return QueryExpantion(queries=["moyenne trimestrielle", "calcul de la moyenne"])
+
+    model = RunnableLambda(expand)
+
+    async def ask(query):
+        return await utils.expand_query_cached(query, embeddings.embed_query(query), model, None, "rag_collection")
+
+    assert asyncio.run(ask(QUESTION)) == ["moyenne trimestrielle", "calcul de la moyenne", QUESTION]
+    assert asyncio.run(ask(REPHRASED)) == ["moyenne trimestrielle", "calcul de la moyenne", REPHRASED]
+    assert asyncio.run(ask("bareme")) == ["bareme"]
+    assert len(calls) == 1
@@ -0,0 +1,97 @@
+import asyncio
+
+from app.database.models import Classroom, PendingSheetWrite
+from app.v1.utils import open_xls
+from benchmarks.fixtures import build_grade_workbook
+
+
+def test_grades_are_written_behind_and_flushed_on_download(api_client, db_session, seeded_file, tmp_path):
+    path = tmp_path / "grades.xls"
+    path.write_bytes(build_grade_workbook(n_students=200, n_sheets=20))
+    original = path.read_bytes()
+    seeded_file.storage_path = str(path)
+    db_session.commit()
+    classroom = db_session.query(Classroom).filter_by(sheet_name="2100003_1").one()
+
+    response = api_client.put(
+        f"/me/classrooms/{classroom.classroom_id}/grades",
+        json={"classroom_grades": [{
+            "student_id": str(classroom.students[0].student_id),
+            "new_evaluation": 15.5,
+            "new_first_assignment": 12.0,
+            "new_final_exam": 18.0,
+            "new_observation": "bien",
+        }]},
+    )
+    assert response.status_code == 200
+
+    # Committed to the database, not yet written to the file
+    assert db_session.query(PendingSheetWrite).count() == 4
+    assert path.read_bytes() == original
+
+    lag = api_client.get("/status/sync").json()
+    assert lag["files"][0]["file_id"] == str(seeded_file.file_id)
+    assert lag["files"][0]["pending_writes"] == 4
+
+    download = api_client.get("/me/file/download")
+    assert download.status_code == 200
+    assert db_session.query(PendingSheetWrite).count() == 0
+
+    sheet = open_xls(content=download.content).sheet_by_name("2100003_1")
+    row = classroom.students[0].row
+    assert sheet.cell_value(row, 4) == 15.5
+    assert sheet.cell_value(row, 7) == "bien"
+
+
+def test_writes_that_cannot_be_applied_are_dead_lettered(api_client, db_session, seeded_file, tmp_path, monkeypatch):
+    from app.v1.services import sheet_sync
+
+    path = tmp_path / "grades.xls"
+    path.write_bytes(build_grade_workbook(n_students=20, n_sheets=2))
+    seeded_file.storage_path = str(path)
+    db_session.add_all([
+        PendingSheetWrite(file_id=seeded_file.file_id, sheet_name="2100000_1", row=8, col=4, value="12.5"),
+        PendingSheetWrite(file_id=seeded_file.file_id, sheet_name="no such sheet", row=8, col=4, value="1.0"),
+    ])
+    db_session.commit()
+
+    download = api_client.get("/me/file/download")
+    assert download.status_code == 200
+    assert download.headers["x-sheet-sync"] == "failed-writes"
+    assert open_xls(content=download.content).sheet_by_name("2100000_1").cell_value(8, 4) == 12.5
+    failed = api_client.get("/status/sync").json()["failed_writes"]
+    assert [(w["sheet_name"], w["attempts"]) for w in failed] == [("no such sheet", 1)]
+
+    # The whole file fails: each attempt counts, then the writes are given up on
+    monkeypatch.setattr(sheet_sync, "SYNC_MAX_ATTEMPTS", 2)
+    db_session.add(PendingSheetWrite(file_id=seeded_file.file_id, sheet_name="2100000_1", row=9, col=4, value="3.0"))
+    db_session.commit()
+    path.unlink()
+    assert api_client.get("/me/file/download").status_code == 404
+    assert api_client.get("/status/sync").json()["files"][0]["pending_writes"] == 1
+    assert api_client.get("/me/file/download").status_code == 404
+    status = api_client.get("/status/sync").json()
+    assert status["files"] == []
+    assert len(status["failed_writes"]) == 2
+
+
+def test_sync_status_only_shows_the_users_own_file(api_client, db_session, seeded_file, async_db_engine):
+    from app.database.models import UploadedFile, User
+    from app.v1.services.sheet_sync import SheetSyncWorker
+
+    db_session.add(User(id="teacher-2", email="other@example.com", auth_provider="local"))
+    other = UploadedFile(user_id="teacher-2", file_name="other.xls", storage_path="other.xls")
+    db_session.add(other)
+    db_session.flush()
+    db_session.add_all([
+        PendingSheetWrite(file_id=other.file_id, sheet_name="2100000_1", row=8, col=4, value="12.5"),
+        PendingSheetWrite(file_id=seeded_file.file_id, sheet_name="2100000_1", row=8, col=4, value="9.0"),
+    ])
+    db_session.commit()
+
+    files = api_client.get("/status/sync").json()["files"]
+    assert [f["file_id"] for f in files] == [str(seeded_file.file_id)]
+    worker = SheetSyncWorker(bind=async_db_engine)
+    asyncio.run(worker.sync_once())
+    assert set(worker.errors) == {str(other.file_id), str(seeded_file.file_id)}  # neither file is on disk
+    assert len(worker._locks) == 0  # no sync in progress: no lock kept
@@ -0,0 +1,34 @@
+import asyncio
+
+from fastapi import HTTPException
+
+from app.v1.services.streaming import HEARTBEAT, EventStream
+from benchmarks.fixtures import sse_events
+
+
+async def collect(stream: EventStream) -> list[str]:
+    return [event async for event in stream.events()]
+
+
+def test_tokens_are_coalesced_and_heartbeats_fill_the_silences():
+    async def producer(stream):
+        for word in ("a", "b", "c"):
+            await stream.token(word)
+        await asyncio.sleep(0.1)  # longer than the heartbeat
+        await stream.token("d")
+        return {"tokens": 4}
+
+    raw = asyncio.run(collect(EventStream(producer, heartbeat_seconds=0.03, flush_interval_ms=20)))
+
+    assert HEARTBEAT in raw
+    assert sse_events("".join(raw)) == [("token", {"text": "abc"}), ("token", {"text": "d"}), ("done", {"tokens": 4})]
+
+
+def test_failures_end_the_stream_with_an_error_event():
+    async def producer(stream):
+        await stream.progress("retrieving")
+        raise HTTPException(status_code=503, detail="Qdrant is unavailable")
+
+    events = sse_events("".join(asyncio.run(collect(EventStream(producer)))))
+
+    assert events == [("progress", {"stage": "retrieving"}), ("error", {"status": 503, "detail": "Qdrant is unavailable"})]
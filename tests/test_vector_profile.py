@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import Datatype
+
+from app.database.database import DocumentIndexer
+from app.v1.services.embeddings import HashingEmbeddings
+from app.v1.services.vector_profile import VectorProfile
+
+
+def test_profile_configs():
+    profile = VectorProfile(quantization="scalar", on_disk=True, oversampling=3.0, hnsw_m=32, hnsw_ef_search=64)
+
+    vectors = profile.vectors_config(1024)
+    assert vectors.size == 1024 and vectors.on_disk and vectors.hnsw_config.m == 32
+    assert profile.quantization_config().scalar.always_ram
+    params = profile.search_params()
+    assert params.hnsw_ef == 64
+    assert params.quantization.rescore and params.quantization.oversampling == 3.0
+
+    plain = VectorProfile()
+    assert plain.quantization_config() is None and plain.search_params().quantization is None
+    assert VectorProfile(datatype="float16").vectors_config(8).datatype == Datatype.FLOAT16
+    with pytest.raises(ValueError):
+        VectorProfile(quantization="pq")
+
+
+def test_ram_estimate_shrinks_with_the_profile():
+    full = VectorProfile().ram_bytes_per_vector(3072)
+    truncated = VectorProfile(dimensions=512).ram_bytes_per_vector(3072)
+    scalar = VectorProfile(quantization="scalar", on_disk=True).ram_bytes_per_vector(3072)
+    binary = VectorProfile(quantization="binary", on_disk=True).ram_bytes_per_vector(3072)
+
+    assert full == 3072 * 4 + 16 * 8
+    assert full > scalar > binary and full > truncated
+    assert binary == 3072 // 8 + 16 * 8
+
+
+def test_indexer_creates_the_collection_from_the_profile_and_checks_its_size():
+    async def scenario():
+        client = AsyncQdrantClient(location=":memory:")
+        profile = VectorProfile(dimensions=64, quantization="binary", hnsw_m=8)
+        indexer = DocumentIndexer(client, HashingEmbeddings(size=64), collection_name="profiled", profile=profile)
+        await indexer.ensure_collection(64)
+        info = await client.get_collection("profiled")
+
+        other = DocumentIndexer(client, HashingEmbeddings(size=32), collection_name="profiled", profile=profile)
+        with pytest.raises(ValueError, match="64-dimension"):
+            await other.ensure_collection(32)
+        return info
+
+    info = asyncio.run(scenario())
+    assert info.config.params.vectors.size == 64
@@ -0,0 +1,55 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from app.v1.services.workers import WorkerPool, QUEUE_WAIT, EXECUTION
+from app.v1.utils import parse_xls
+from benchmarks.fixtures import build_grade_workbook
+
+
+def test_saturated_pool_returns_503_with_retry_after():
+    pool = WorkerPool("test-io", "thread", max_workers=1, queue_depth=0, retry_after=7)
+    release = threading.Event()
+
+    async def scenario():
+        blocked = asyncio.create_task(pool.run(release.wait))
+        await asyncio.sleep(0.05)
+        with pytest.raises(HTTPException) as exc_info:
+            await pool.run(sum, [1, 2])
+        release.set()
+        await blocked
+        return exc_info.value, await pool.run(sum, [1, 2])
+
+    try:
+        error, result = asyncio.run(scenario())
+    finally:
+        pool.shutdown()
+
+    assert result == 3
+    assert error.status_code == 503
+    assert error.headers["Retry-After"] == "7"
+    assert EXECUTION.labels("test-io").snapshot()["count"] == 2
+    assert QUEUE_WAIT.labels("test-io").snapshot()["count"] == 2
+
+
+def test_process_pool_parses_workbook():
+    pool = WorkerPool("test-cpu", "process", max_workers=1, queue_depth=1)
+    content = build_grade_workbook(n_students=10, n_sheets=2)
+    try:
+        data = asyncio.run(pool.run(parse_xls, content))
+    finally:
+        pool.shutdown()
+
+    assert data == parse_xls(content)
+
+
+def test_internal_status_needs_the_operator_token(api_client, monkeypatch):
+    from app.v1.auth import dependencies
+
+    assert api_client.get("/status/workers").status_code == 404  # no token configured
+    monkeypatch.setattr(dependencies, "OPERATOR_TOKEN", "ops")
+    assert api_client.get("/status/db", headers={"X-Operator-Token": "wrong"}).status_code == 403
+    response = api_client.get("/status/workers", headers={"X-Operator-Token": "ops"})
+    assert response.status_code == 200 and "io" in str(response.json()["pools"])
@@ -0,0 +1,30 @@
+from app.v1.services import xls_writer
+from app.v1.services.xls_writer import WorkbookWriter
+from app.v1.utils import open_xls
+from benchmarks.fixtures import build_grade_workbook
+
+
+def test_updates_reuse_the_cached_copy_and_skip_cells_that_cannot_be_written(tmp_path, monkeypatch):
+    path = str(tmp_path / "grades.xls")
+    with open(path, "wb") as f:
+        f.write(build_grade_workbook(n_students=20, n_sheets=2))
+
+    opens = []
+    monkeypatch.setattr(xls_writer, "open_xls", lambda **kwargs: (opens.append(kwargs), open_xls(**kwargs))[1])
+    writer = WorkbookWriter()
+
+    assert writer.apply(path, {("2100000_1", 8, 4): 11.0, ("2100001_1", 9, 6): 17.5}) == {}
+    rejected = writer.apply(path, {
+        ("2100000_1", 9, 4): 3.0,
+        ("no such sheet", 8, 4): 1.0,
+        ("2100000_1", 8, 7): object(),
+    })
+
+    assert set(rejected) == {("no such sheet", 8, 4), ("2100000_1", 8, 7)}
+    assert len(opens) == 1
+    assert writer._path_locks == {}
+    workbook = open_xls(path=path)
+    # a later update keeps the earlier cells
+    assert workbook.sheet_by_name("2100000_1").cell_value(8, 4) == 11.0
+    assert workbook.sheet_by_name("2100000_1").cell_value(9, 4) == 3.0
+    assert workbook.sheet_by_name("2100001_1").cell_value(9, 6) == 17.5